@@ -0,0 +1,91 @@
+# Compares the original geopy closest-truck path with the batch distance kernels
+# and the spatial index.
+#
+#   python -m benchmarks.bench_distance --sizes 1000 100000 1000000
+import argparse, random, time
+
+from geopy.distance import geodesic
+
+from src.geo import Accuracy, CoordinateArray, distances_from, nearest_indices, top_k
+from src.spatial import SpatialIndex
+
+USER = (37.7749, -122.4194)
+
+
+def random_trucks(count, seed=0):
+    rng = random.Random(seed)
+    return [
+        {
+            "latitude": rng.uniform(37.70, 37.81),
+            "longitude": rng.uniform(-122.52, -122.36),
+        }
+        for _ in range(count)
+    ]
+
+
+# The code path this module replaced: one geodesic object per truck and a full sort
+def geopy_closest(trucks, num_closest):
+    distances = [
+        geodesic(USER, (truck["latitude"], truck["longitude"])).kilometers
+        for truck in trucks
+    ]
+    distance_indices = sorted(enumerate(distances), key=lambda x: x[1])
+    return [idx for idx, _ in distance_indices[:num_closest]]
+
+
+def kernel_closest(coordinates, num_closest, accuracy):
+    return top_k(distances_from(*USER, coordinates, accuracy), num_closest)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000])
+    parser.add_argument("--num-closest", type=int, default=3)
+    parser.add_argument(
+        "--geopy-limit",
+        type=int,
+        default=None,
+        help="skip the (slow) geopy baseline above this many points",
+    )
+    args = parser.parse_args()
+
+    print(f"{'points':>10} {'path':<22} {'seconds':>10}")
+    for size in args.sizes:
+        trucks = random_trucks(size)
+
+        results = {}
+        if args.geopy_limit is None or size <= args.geopy_limit:
+            results["geopy + sort"] = timed(geopy_closest, trucks, args.num_closest)
+
+        start = time.perf_counter()
+        coordinates = CoordinateArray.from_trucks(trucks)
+        results["pack buffers"] = time.perf_counter() - start
+        results["haversine + top_k"] = timed(
+            kernel_closest, coordinates, args.num_closest, Accuracy.fast
+        )
+        results["haversine + geodesic"] = timed(
+            nearest_indices, *USER, coordinates, args.num_closest
+        )
+        results["all geodesics + top_k"] = timed(
+            kernel_closest, coordinates, args.num_closest, Accuracy.exact
+        )
+
+        index = SpatialIndex()
+        start = time.perf_counter()
+        for location_id, truck in enumerate(trucks):
+            index.insert(location_id, truck["latitude"], truck["longitude"])
+        results["build spatial index"] = time.perf_counter() - start
+        results["spatial index query"] = timed(index.nearest, *USER, args.num_closest)
+
+        for path, seconds in results.items():
+            print(f"{size:>10} {path:<22} {seconds:>10.4f}")
+
+
+if __name__ == "__main__":
+    main()
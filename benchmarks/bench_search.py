@@ -0,0 +1,64 @@
+# Compares the LIKE name lookup with the FTS5 search index. The bundled CSV is
+# replicated --copies times (with fresh location_ids) to get a bigger table.
+#
+#   python -m benchmarks.bench_search --copies 200
+import argparse, csv, os, tempfile, time
+
+from src.database import Database
+from src.ingest import CSV_FIELDS
+
+CSV_FILE = "./data/Mobile_Food_Facility_Permit.csv"
+QUERIES = ["Senor Sisig", "tacos", "coffee", "Kettle Corn", "zzzz"]
+
+
+def replicate_csv(path, copies):
+    with open(CSV_FILE, encoding="utf-8") as file:
+        reader = csv.DictReader(file)
+        rows = list(reader)
+        fieldnames = reader.fieldnames
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=fieldnames)
+        writer.writeheader()
+        location_id = 1
+        for _ in range(copies):
+            for row in rows:
+                writer.writerow({**row, "location_id": location_id})
+                location_id += 1
+
+
+def timed(fn, *args, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn(*args)
+    return (time.perf_counter() - start) / repeat * 1000, len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--copies", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_file = os.path.join(tmp, "trucks.csv")
+        replicate_csv(csv_file, args.copies)
+        db = Database(os.path.join(tmp, "trucks.db"))
+        report = db.create_database(csv_file)
+        print(f"{report.inserted} trucks, {len(CSV_FIELDS)} columns")
+
+        print(f"{'query':<14} {'LIKE ms':>9} {'rows':>7} {'FTS ms':>9} {'rows':>7}")
+        for query in QUERIES:
+            like_ms, like_rows = timed(
+                db.get_food_truck_by_name, query, repeat=args.repeat
+            )
+            fts_ms, fts_rows = timed(
+                db.search_food_trucks, query, 20, repeat=args.repeat
+            )
+            print(
+                f"{query:<14} {like_ms:>9.2f} {like_rows:>7} {fts_ms:>9.2f} {fts_rows:>7}"
+            )
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# Writes a synthetic permit CSV with the same columns as the SF dataset. Every row is
+# a real row from the bundled CSV with a fresh location_id and a random location
+# inside San Francisco, so text lengths and categorical values stay realistic.
+#
+#   python -m benchmarks.generate --rows 1000000 --out /tmp/trucks_1m.csv
+import argparse, csv, random
+
+CSV_FILE = "./data/Mobile_Food_Facility_Permit.csv"
+
+# Roughly the city limits
+SF_BOUNDING_BOX = (37.708, -122.515, 37.812, -122.357)
+
+
+def generate_csv(path, rows: int, seed: int = 0):
+    with open(CSV_FILE, encoding="utf-8") as file:
+        reader = csv.DictReader(file)
+        templates = list(reader)
+        fieldnames = reader.fieldnames
+
+    rng = random.Random(seed)
+    min_lat, min_lon, max_lat, max_lon = SF_BOUNDING_BOX
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=fieldnames)
+        writer.writeheader()
+        for location_id in range(1, rows + 1):
+            latitude = rng.uniform(min_lat, max_lat)
+            longitude = rng.uniform(min_lon, max_lon)
+            writer.writerow(
+                {
+                    **rng.choice(templates),
+                    "location_id": location_id,
+                    "Latitude": latitude,
+                    "Longitude": longitude,
+                    "Location": f"({latitude}, {longitude})",
+                }
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate_csv(args.out, args.rows, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# HTTP load test against a running server. Fires a fixed number of requests at each
+# concurrency level and reports throughput and latency percentiles, so you can check
+# that it scales with the number of clients instead of serializing on the event loop.
+# With --output the results are also written as JSON for benchmarks.results.
+#
+#   poetry run uvicorn src.main:app --workers 1 &
+#   python -m benchmarks.load_test --path /food_trucks/ --concurrency 1 4 16 64
+import argparse, asyncio, time
+
+import httpx
+
+from benchmarks.results import summarize, write_results
+
+
+async def run_level(client, path, concurrency, total):
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+    errors = 0
+    latencies = []
+
+    async def worker():
+        nonlocal errors
+        while not queue.empty():
+            queue.get_nowait()
+            start = time.perf_counter()
+            response = await client.get(path)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - start, errors, latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--path", default="/food_trucks/")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = {}
+    limits = httpx.Limits(max_connections=max(args.concurrency))
+    async with httpx.AsyncClient(
+        base_url=args.url, limits=limits, timeout=60
+    ) as client:
+        print(
+            f"{'clients':>8} {'requests':>9} {'seconds':>9} {'req/s':>9} {'errors':>7}"
+            f" {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8}"
+        )
+        for concurrency in args.concurrency:
+            seconds, errors, latencies = await run_level(
+                client, args.path, concurrency, args.requests
+            )
+            summary = summarize(latencies)
+            summary.update(
+                seconds=seconds,
+                requests_per_second=args.requests / seconds,
+                errors=errors,
+            )
+            results[f"{args.path}/c{concurrency}"] = summary
+            print(
+                f"{concurrency:>8} {args.requests:>9} {seconds:>9.3f} "
+                f"{args.requests / seconds:>9.1f} {errors:>7} {summary['p50_ms']:>8.2f}"
+                f" {summary['p90_ms']:>8.2f} {summary['p99_ms']:>8.2f}"
+            )
+
+    if args.output:
+        write_results(args.output, "load_test", vars(args), results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
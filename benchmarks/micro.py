@@ -0,0 +1,83 @@
+# Micro-benchmarks of the data layer and the distance ranking on synthetic datasets
+# of increasing size (see benchmarks.generate). Results are written as JSON, compare
+# two runs with benchmarks.results.
+#
+#   python -m benchmarks.micro --rows 10000 100000 1000000 --output micro.json
+import argparse, asyncio, os, tempfile, time
+from typing import Callable, Dict, List
+
+from benchmarks.generate import generate_csv
+from benchmarks.results import summarize, write_results
+from src.database import Database
+from src.geo import Accuracy
+from src.main import find_closest_applicants
+
+USER = (37.7749, -122.4194)
+SUMMARY_COLUMNS = ["applicant", "food_items", "address"]
+
+
+def time_runs(fn: Callable, repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_size(rows: int, repeat: int, load_repeat: int, tmp: str) -> Dict[str, dict]:
+    csv_file = os.path.join(tmp, f"trucks_{rows}.csv")
+    generate_csv(csv_file, rows)
+    results = {}
+
+    db_files = [os.path.join(tmp, f"trucks_{rows}_{i}.db") for i in range(load_repeat)]
+    loads = iter(db_files)
+    results["create_database"] = time_runs(
+        lambda: Database(next(loads)).create_database(csv_file), load_repeat
+    )
+
+    db = Database(db_files[-1])
+    results["get_all_food_trucks"] = time_runs(db.get_all_food_trucks, repeat)
+    results["get_all_food_trucks[summary columns]"] = time_runs(
+        lambda: db.get_all_food_trucks(SUMMARY_COLUMNS), repeat
+    )
+    results["get_food_truck_by_name"] = time_runs(
+        lambda: db.get_food_truck_by_name("Sisig"), repeat
+    )
+
+    truck_data = db.get_all_food_trucks(["location_id", "latitude", "longitude"])
+    for accuracy in Accuracy:
+
+        async def closest():
+            return await find_closest_applicants(truck_data, USER, 3, accuracy)
+
+        results[f"find_closest_applicants[{accuracy.value}]"] = time_runs(
+            lambda: asyncio.run(closest()), repeat
+        )
+    db.close()
+    return {f"{rows}/{name}": summarize(samples) for name, samples in results.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument(
+        "--load-repeat", type=int, default=3, help="runs of create_database per size"
+    )
+    parser.add_argument("--output", default="benchmarks-micro.json")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            size_results = bench_size(rows, args.repeat, args.load_repeat, tmp)
+            for name, summary in size_results.items():
+                print(f"{name:<52} p50 {summary['p50_ms']:>10.2f} ms")
+            results.update(size_results)
+    write_results(args.output, "micro", vars(args), results)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# Machine-readable benchmark results. Every suite writes a JSON file stamped with the
+# commit it ran on, and two such files can be compared:
+#
+#   python -m benchmarks.results before.json after.json
+import argparse, json, platform, subprocess, sys, time
+from typing import Dict, List, Sequence
+
+
+def percentile(samples: Sequence[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+# Timings in seconds summarized in milliseconds
+def summarize(samples: List[float]) -> Dict[str, float]:
+    return {
+        "runs": len(samples),
+        "min_ms": min(samples) * 1000,
+        "mean_ms": sum(samples) / len(samples) * 1000,
+        "p50_ms": percentile(samples, 0.50) * 1000,
+        "p90_ms": percentile(samples, 0.90) * 1000,
+        "p99_ms": percentile(samples, 0.99) * 1000,
+        "max_ms": max(samples) * 1000,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def write_results(path, suite: str, parameters: dict, results: Dict[str, dict]):
+    document = {
+        "suite": suite,
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "parameters": parameters,
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(document, file, indent=2)
+
+
+# Prints every metric present in both files with the relative change
+def compare(before: dict, after: dict, metric: str):
+    print(f"{before['commit']} -> {after['commit']} ({metric})")
+    print(f"{'benchmark':<44} {'before':>10} {'after':>10} {'change':>8}")
+    for name, result in before["results"].items():
+        other = after["results"].get(name)
+        if other is None or metric not in result or metric not in other:
+            continue
+        old, new = result[metric], other[metric]
+        change = (new - old) / old * 100 if old else 0.0
+        print(f"{name:<44} {old:>10.3f} {new:>10.3f} {change:>+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--metric", default="p50_ms")
+    args = parser.parse_args()
+    with open(args.before, encoding="utf-8") as file:
+        before = json.load(file)
+    with open(args.after, encoding="utf-8") as file:
+        after = json.load(file)
+    compare(before, after, args.metric)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import asyncio, functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from .database import Database
+from .profiler import profiled
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+_DEFAULT = object()
+
+
+# Runs blocking calls on a dedicated, fixed-size thread pool so they never stall the
+# event loop. Each call can be given a timeout; when it expires the caller gets a
+# QueryTimeout right away, although the worker thread still finishes the call.
+class BoundedExecutor:
+    def __init__(
+        self,
+        max_workers: int = 8,
+        timeout: Optional[float] = 10.0,
+        name: str = "estee-worker",
+    ):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=name
+        )
+
+    async def run(self, fn: Callable, *args, timeout: Any = _DEFAULT, **kwargs):
+        if timeout is _DEFAULT:
+            timeout = self.timeout
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(
+            self._executor, profiled(functools.partial(fn, *args, **kwargs))
+        )
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise QueryTimeout(
+                f"{getattr(fn, '__name__', fn)} timed out after {timeout}s"
+            ) from None
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+
+# Awaitable view of a Database: every method of the wrapped database is available
+# as a coroutine that runs on the executor, e.g. await adb.get_food_truck_by_id(1)
+class AsyncDatabase(BoundedExecutor):
+    def __init__(
+        self,
+        db: Database,
+        max_workers: int = 8,
+        timeout: Optional[float] = 10.0,
+    ):
+        super().__init__(max_workers, timeout, name="estee-db")
+        self.db = db
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.db, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def call(*args, **kwargs):
+            return await self.run(attr, *args, **kwargs)
+
+        return call
@@ -0,0 +1,266 @@
+# Read-only columnar copy of a TruckSnapshot that every worker process memory-maps, so
+# that N uvicorn workers share one copy of the truck data in the page cache instead of
+# each holding its own on the heap. Fixed-width columns are typed views straight into
+# the map; strings are stored back to back in a heap and addressed through an offsets
+# column. The grid of the spatial index is stored as well, so closest-truck queries
+# run off the map too.
+#
+# Layout: a header, a directory with the (offset, length) of every section in SECTIONS
+# order, then the sections, each aligned to 8 bytes. Numbers are in native byte order:
+# the file is a cache for processes on the same machine, rebuilt from the database
+# whenever it is missing or stale.
+import collections.abc, math, mmap, os, struct, threading
+from array import array
+from bisect import bisect_left, bisect_right
+from contextlib import nullcontext
+from typing import Dict, Iterator, Optional, Sequence, Tuple, Union
+
+from .snapshot import TruckSnapshot
+from .spatial import DEFAULT_CELL_SIZE, GridIndex
+
+MAGIC = b"ESTEECOL"
+FORMAT_VERSION = 1
+# magic, format version, section count, rows, data version, modified_at, cell size
+HEADER = struct.Struct("=8sIIqqdd")
+DIRECTORY_ENTRY = struct.Struct("=qq")
+
+# String columns, as (name, decode): text columns are read back as str, blob columns
+# (the pre-serialized JSON rows) as bytes
+STRING_COLUMNS = (
+    ("applicants", True),
+    ("food_items", True),
+    ("addresses", True),
+    ("payloads", False),
+)
+SECTIONS = (
+    "location_ids",
+    "latitudes",
+    "longitudes",
+    *(f"{name}.{part}" for name, _ in STRING_COLUMNS for part in ("offsets", "heap")),
+    # Grid cells in key order, where each cell's positions start in cell_members, and
+    # every position grouped by cell
+    "cell_keys",
+    "cell_starts",
+    "cell_members",
+)
+
+
+# Grid cell (row, col) as one int64 that sorts like the tuple
+def _cell_key(row: int, col: int) -> int:
+    return (row << 32) + (col + (1 << 31))
+
+
+def _cell_row(key: int) -> int:
+    return key >> 32
+
+
+class StringColumn(collections.abc.Sequence):
+    def __init__(self, offsets: memoryview, heap: memoryview, decode: bool):
+        self._offsets = offsets
+        self._heap = heap
+        self._decode = decode
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        value = self._heap[self._offsets[i] : self._offsets[i + 1]]
+        return str(value, "utf-8") if self._decode else bytes(value)
+
+
+def _string_sections(values: Sequence[Union[str, bytes]]) -> Tuple[bytes, bytes]:
+    encoded = [
+        value.encode("utf-8") if isinstance(value, str) else bytes(value)
+        for value in values
+    ]
+    offsets = array("q", [0])
+    end = 0
+    for value in encoded:
+        end += len(value)
+        offsets.append(end)
+    return offsets.tobytes(), b"".join(encoded)
+
+
+def _grid_sections(
+    latitudes: Sequence[float], longitudes: Sequence[float], cell_size: float
+) -> Tuple[bytes, bytes, bytes]:
+    keys = [
+        _cell_key(math.floor(lat / cell_size), math.floor(lon / cell_size))
+        for lat, lon in zip(latitudes, longitudes)
+    ]
+    members = array("q", sorted(range(len(keys)), key=keys.__getitem__))
+    cell_keys = array("q")
+    cell_starts = array("q")
+    for i, position in enumerate(members):
+        if not cell_keys or keys[position] != cell_keys[-1]:
+            cell_keys.append(keys[position])
+            cell_starts.append(i)
+    cell_starts.append(len(members))
+    return cell_keys.tobytes(), cell_starts.tobytes(), members.tobytes()
+
+
+# Writes snapshot to path. The file is written under a temporary name and renamed over
+# the old one, so a process mapping it sees either the old or the new file, and keeps
+# reading the old one for as long as it has it mapped.
+def write_columnar(
+    path: str, snapshot: TruckSnapshot, cell_size: float = DEFAULT_CELL_SIZE
+):
+    sections = [
+        memoryview(snapshot.location_ids).cast("B").tobytes(),
+        memoryview(snapshot.latitudes).cast("B").tobytes(),
+        memoryview(snapshot.longitudes).cast("B").tobytes(),
+    ]
+    for name, _ in STRING_COLUMNS:
+        sections.extend(_string_sections(getattr(snapshot, name)))
+    sections.extend(_grid_sections(snapshot.latitudes, snapshot.longitudes, cell_size))
+
+    offset = HEADER.size + DIRECTORY_ENTRY.size * len(SECTIONS)
+    directory = []
+    for section in sections:
+        offset += -offset % 8
+        directory.append((offset, len(section)))
+        offset += len(section)
+
+    temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp, "wb") as file:
+            file.write(
+                HEADER.pack(
+                    MAGIC,
+                    FORMAT_VERSION,
+                    len(SECTIONS),
+                    len(snapshot),
+                    snapshot.version,
+                    snapshot.modified_at,
+                    cell_size,
+                )
+            )
+            for entry in directory:
+                file.write(DIRECTORY_ENTRY.pack(*entry))
+            for (start, _), section in zip(directory, sections):
+                file.write(b"\0" * (start - file.tell()))
+                file.write(section)
+        os.replace(temp, path)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+
+# A mapped columnar file. Sections are memoryviews into the map, which stays open as
+# long as any of them is referenced.
+class ColumnarFile:
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._map)
+        if len(view) < HEADER.size:
+            raise ValueError(f"{path} is not a columnar snapshot")
+        (
+            magic,
+            format_version,
+            num_sections,
+            self.rows,
+            self.version,
+            self.modified_at,
+            self.cell_size,
+        ) = HEADER.unpack_from(view)
+        if (magic, format_version, num_sections) != (
+            MAGIC,
+            FORMAT_VERSION,
+            len(SECTIONS),
+        ):
+            raise ValueError(f"{path} is not a columnar snapshot of this version")
+        self.sections: Dict[str, memoryview] = {}
+        for i, name in enumerate(SECTIONS):
+            start, length = DIRECTORY_ENTRY.unpack_from(
+                view, HEADER.size + i * DIRECTORY_ENTRY.size
+            )
+            if start + length > len(view):
+                raise ValueError(f"{path} is truncated")
+            self.sections[name] = view[start : start + length]
+
+    def array(self, name: str, typecode: str) -> memoryview:
+        return self.sections[name].cast(typecode)
+
+    def strings(self, name: str, decode: bool) -> StringColumn:
+        return StringColumn(
+            self.array(f"{name}.offsets", "q"), self.sections[f"{name}.heap"], decode
+        )
+
+
+# The columnar file at path, or None if there is none or it can't be read, in which
+# case the caller writes a fresh one
+def open_columnar(path: str) -> Optional[ColumnarFile]:
+    try:
+        return ColumnarFile(path)
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+# TruckSnapshot reading its columns from a mapped file instead of the heap. Only
+# the list payload is cached per process. apply() returns an in-memory TruckSnapshot,
+# which the writer serves until it is exported to a new file (Database.export_columnar).
+class MappedSnapshot(TruckSnapshot):
+    def __init__(self, columns: ColumnarFile):
+        self.columns = columns
+        self.version = columns.version
+        self.modified_at = columns.modified_at
+        self.location_ids = columns.array("location_ids", "q")
+        self.latitudes = columns.array("latitudes", "d")
+        self.longitudes = columns.array("longitudes", "d")
+        for name, decode in STRING_COLUMNS:
+            setattr(self, name, columns.strings(name, decode))
+        self._list_payloads = {}
+        self._address_index = None
+
+
+# Spatial index over the grid stored in a columnar file. It is immutable, so queries
+# need no lock.
+class MappedSpatialIndex(GridIndex):
+    def __init__(self, columns: ColumnarFile):
+        self.cell_size = columns.cell_size
+        self._lock = nullcontext()
+        self._location_ids = columns.array("location_ids", "q")
+        self._latitudes = columns.array("latitudes", "d")
+        self._longitudes = columns.array("longitudes", "d")
+        self._cell_keys = columns.array("cell_keys", "q")
+        self._cell_starts = columns.array("cell_starts", "q")
+        self._cell_members = columns.array("cell_members", "q")
+
+    def __len__(self) -> int:
+        return len(self._location_ids)
+
+    def _point(self, location_id: int) -> Tuple[float, float]:
+        i = bisect_left(self._location_ids, location_id)
+        return self._latitudes[i], self._longitudes[i]
+
+    # Cells of one grid row are adjacent in key order, so each row of the box is a
+    # single run of cell_members
+    def _points_in_box(
+        self, box: Tuple[float, float, float, float]
+    ) -> Iterator[Tuple[int, float, float]]:
+        keys = self._cell_keys
+        if not keys:
+            return
+        min_row, min_col = self._cell(box[0], box[1])
+        max_row, max_col = self._cell(box[2], box[3])
+        min_row = max(min_row, _cell_row(keys[0]))
+        max_row = min(max_row, _cell_row(keys[-1]))
+        for row in range(min_row, max_row + 1):
+            lo = bisect_left(keys, _cell_key(row, min_col))
+            hi = bisect_right(keys, _cell_key(row, max_col))
+            if lo == hi:
+                continue
+            for position in self._cell_members[
+                self._cell_starts[lo] : self._cell_starts[hi]
+            ]:
+                yield (
+                    self._location_ids[position],
+                    self._latitudes[position],
+                    self._longitudes[position],
+                )
@@ -1,9 +1,35 @@
-import csv, sqlite3
+import re, secrets, threading, time
+from collections import Counter
 from contextlib import contextmanager
-from typing import List, Optional
+from enum import Enum
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 
 from pydantic import BaseModel
 
+from .food_items import item_postings, normalize_food_item
+from .geo import Accuracy
+from .hours import MINUTES_PER_DAY, hours_rows
+from .ingest import (
+    COLUMNS,
+    LATITUDE,
+    LONGITUDE,
+    IngestReport,
+    RejectedRow,
+    check_coordinates,
+    read_csv_batches,
+    row_hash,
+)
+from .metrics import instrument_methods
+from .pool import ConnectionPool, PoolStats
+from .columnar import (
+    MappedSnapshot,
+    MappedSpatialIndex,
+    open_columnar,
+    write_columnar,
+)
+from .snapshot import TruckSnapshot
+from .spatial import GridIndex, SpatialIndex
+
 
 # Most of these fields are probably useless, but data is data
 class FoodTruck(BaseModel):
@@ -37,72 +63,561 @@ class FoodTruck(BaseModel):
     zip_codes: Optional[int]
     neighborhoods_old: Optional[int]
 
+    # Column values in table order
+    def as_row(self) -> tuple:
+        return tuple(getattr(self, column) for column in COLUMNS)
+
+
+_INSERT_SQL = f"""INSERT INTO food_trucks ({", ".join(COLUMNS)})
+                  VALUES ({", ".join("?" for _ in COLUMNS)})"""
+_UPDATE_SQL = f"""UPDATE food_trucks SET {", ".join(f"{column} = ?" for column in COLUMNS[1:])}
+                  WHERE location_id = ?"""
+_INSERT_HOURS_SQL = "INSERT INTO food_truck_hours VALUES (?, ?, ?, ?)"
+_LOG_CHANGE_SQL = """INSERT OR REPLACE INTO food_truck_changes
+                     (location_id, deleted, changed_at) VALUES (?, ?, ?)"""
+
+# A query result row: a FoodTruck when every column was read, a dict of the projected
+# columns otherwise
+Record = Union[FoodTruck, dict]
+
+
+# SELECT list for a projection, every column if None
+def _select_list(columns: Optional[Sequence[str]]) -> str:
+    if columns is None:
+        return ", ".join(COLUMNS)
+    unknown = set(columns) - set(COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(sorted(unknown))}")
+    return ", ".join(columns)
+
+
+# Rows come from our own table, which only ever receives validated trucks, so the
+# model is built without validating every field again
+def _food_truck(row: tuple) -> FoodTruck:
+    return FoodTruck.model_construct(**dict(zip(COLUMNS, row)))
+
+
+def _records(rows: Iterable[tuple], columns: Optional[Sequence[str]]) -> List[Record]:
+    if columns is None:
+        return [_food_truck(row) for row in rows]
+    return [dict(zip(columns, row)) for row in rows]
+
+
+# Writes touching more rows than this (and more than a tenth of the table) rebuild the
+# in-memory views instead of patching them row by row
+REBUILD_THRESHOLD = 1000
+
+_NOCASE_FILTERS = {"status", "facility_type"}
+
+
+# Composable predicates over the categorical columns. Values within a field are
+# OR'ed together and the fields are AND'ed, e.g. APPROVED trucks in either of two zips.
+class TruckFilter(BaseModel):
+    status: Optional[List[str]] = None
+    facility_type: Optional[List[str]] = None
+    zip_codes: Optional[List[int]] = None
+    supervisor_districts: Optional[List[int]] = None
+    police_districts: Optional[List[int]] = None
+    # Only trucks serving any of these items, see src/food_items.py
+    food_item: Optional[List[str]] = None
+    # Only trucks open at this minute of the week, see src/hours.py
+    open_at: Optional[int] = None
+
+    def _categorical(self) -> Iterator[Tuple[str, Optional[list]]]:
+        return (
+            (column, values)
+            for column, values in self
+            if column not in ("food_item", "open_at")
+        )
+
+    def is_empty(self) -> bool:
+        return all(value is None or value == [] for _, value in self)
+
+    # WHERE clause (without the WHERE) and its parameters; empty if nothing is filtered
+    def where(self) -> Tuple[str, list]:
+        clauses = []
+        params: list = []
+        if self.open_at is not None:
+            clauses.append(
+                """location_id IN (SELECT location_id FROM food_truck_hours
+                       WHERE weekday = ? AND start_minute <= ? AND end_minute > ?)"""
+            )
+            params.extend([self.open_at // MINUTES_PER_DAY, self.open_at, self.open_at])
+        if self.food_item:
+            names = [normalize_food_item(name) for name in self.food_item]
+            placeholders = ", ".join("?" for _ in names)
+            clauses.append(
+                f"""location_id IN (SELECT location_id FROM food_truck_items
+                        JOIN food_items USING (item_id) WHERE name IN ({placeholders}))"""
+            )
+            params.extend(names)
+        for column, values in self._categorical():
+            if not values:
+                continue
+            collate = " COLLATE NOCASE" if column in _NOCASE_FILTERS else ""
+            placeholders = ", ".join("?" for _ in values)
+            clauses.append(f"{column}{collate} IN ({placeholders})")
+            params.extend(values)
+        return " AND ".join(clauses), params
+
+
+class SearchResult(BaseModel):
+    location_id: int
+    applicant: str
+    food_items: str
+    address: str
+    latitude: float
+    longitude: float
+    # bm25 relevance, lower is better
+    score: float
+
+
+class BatchStatus(str, Enum):
+    created = "created"
+    updated = "updated"
+    deleted = "deleted"
+    # The item was invalid, see error
+    failed = "failed"
+    # The item was valid but its all-or-nothing batch was not applied
+    skipped = "skipped"
+
+
+class BatchItemResult(BaseModel):
+    location_id: Optional[int]
+    status: BatchStatus
+    error: Optional[str] = None
+
+
+class BatchResult(BaseModel):
+    applied: int
+    results: List[BatchItemResult]
+
+
+# Tombstones in the change log are kept this long before compaction removes them
+CHANGE_LOG_RETENTION = 30 * 24 * 3600
+
 
-@contextmanager
-def database_connection(db_name: str):
-    conn = sqlite3.connect(db_name)
-    try:
-        yield conn
-    finally:
-        conn.close()
+# An entry of the change log: the truck was written (truck is its current state) or
+# deleted at seq
+class Change(BaseModel):
+    seq: int
+    location_id: int
+    deleted: bool
+    changed_at: float
+    truck: Optional[FoodTruck] = None
 
 
+# A page of the change log. Cursors are "<epoch>-<seq>": the epoch is a random id
+# drawn when the log was created, so cursors from a rebuilt database never match.
+class ChangePage(BaseModel):
+    changes: List[Change]
+    epoch: int
+    last_seq: int
+
+    def cursor(self, seq: int) -> str:
+        return f"{self.epoch}-{seq}"
+
+
+# A change log cursor that compaction has passed, or that belongs to another database
+class StaleCursor(Exception):
+    pass
+
+
+# Turns free text into an FTS5 query: every word becomes a quoted term, so user input
+# can never be parsed as FTS5 syntax
+def fts_query(text: str, prefix: bool = False) -> str:
+    words = re.findall(r"\w+", text)
+    terms = [f'"{word}"' for word in words]
+    if prefix and terms:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+# Every public method reports its latency and errors to the metrics registry
+@instrument_methods
 class Database:
-    def __init__(self, db_name: str):
+    def __init__(
+        self,
+        db_name: str,
+        pool_size: int = 4,
+        busy_timeout: float = 5.0,
+        acquire_timeout: Optional[float] = 30.0,
+        statement_cache_size: int = 128,
+        wal_autocheckpoint: int = 1000,
+        version_check_interval: Optional[float] = 1.0,
+        columnar_file: Optional[str] = None,
+        export_delay: float = 0.5,
+    ):
         self.db_name = db_name
+        self.pool = ConnectionPool(
+            db_name,
+            size=pool_size,
+            busy_timeout=busy_timeout,
+            acquire_timeout=acquire_timeout,
+            statement_cache_size=statement_cache_size,
+            wal_autocheckpoint=wal_autocheckpoint,
+        )
+        # Data version of the views, see _changed. The version itself is stored in the
+        # meta table so that other processes writing to the file bump it too.
+        self.version = 0
+        self.version_check_interval = version_check_interval
+        self._last_version_check = 0.0
+        # With a columnar file the views are memory-mapped from it, see src.columnar.
+        # Writes patch in-memory views, exported to the file export_delay seconds later.
+        self.columnar_file = columnar_file
+        self.export_delay = export_delay
+        self._export_timer: Optional[threading.Timer] = None
+        self._timer_lock = threading.Lock()
+        self._export_lock = threading.Lock()
+        self._spatial_index: Optional[GridIndex] = None
+        self._snapshot: Optional[TruckSnapshot] = None
+        self._views_lock = threading.Lock()
+        # Held while views are swapped in or patched, see _publish_views
+        self._publish_lock = threading.RLock()
 
-    def create_database(self, csv_file):
-        with database_connection(self.db_name) as conn:
-            self.create_table()
-            with open(csv_file, "r", encoding="utf-8") as file:
-                csv_reader = csv.DictReader(file)
-                for row in csv_reader:
-                    # Some of the columns are empty, so we need to handle that
-                    def to_float(value):
-                        return float(value) if value.strip() else 0.0
-
-                    def to_int(value):
-                        return int(value) if value.strip() else 0
-
-                    food_truck = FoodTruck(
-                        location_id=to_int(row.get("location_id", "")),
-                        applicant=row.get("Applicant", ""),
-                        facility_type=row.get("FacilityType", ""),
-                        cnn=to_int(row.get("cnn", "")),
-                        location_description=row.get("LocationDescription", ""),
-                        address=row.get("Address", ""),
-                        blocklot=row.get("blocklot", ""),
-                        block=row.get("block", ""),
-                        lot=row.get("lot", ""),
-                        permit=row.get("permit", ""),
-                        status=row.get("Status", ""),
-                        food_items=row.get("FoodItems", ""),
-                        x=to_float(row.get("X", "")),
-                        y=to_float(row.get("Y", "")),
-                        latitude=to_float(row.get("Latitude", "")),
-                        longitude=to_float(row.get("Longitude", "")),
-                        schedule=row.get("Schedule", ""),
-                        dayshours=row.get("dayshours", ""),
-                        NOISent=row.get("NOISent", ""),
-                        approved=row.get("Approved", ""),
-                        received=row.get("Received", ""),
-                        prior_permit=row.get("PriorPermit", ""),
-                        expiration_date=row.get("ExpirationDate", ""),
-                        location=row.get("Location", ""),
-                        fire_prevention_districts=to_int(
-                            row.get("Fire Prevention Districts", "")
-                        ),
-                        police_districts=to_int(row.get("Police Districts", "")),
-                        supervisor_districts=to_int(
-                            row.get("Supervisor Districts", "")
-                        ),
-                        zip_codes=to_int(row.get("Zip Codes", "")),
-                        neighborhoods_old=to_int(row.get("Neighborhoods (old)", "")),
-                    )
-                    self.insert_food_truck(food_truck)
+    def pool_stats(self) -> PoolStats:
+        return self.pool.stats()
+
+    # Moves the WAL contents back into the database file, see ConnectionPool.checkpoint
+    def checkpoint(self, mode: str = "PASSIVE"):
+        return self.pool.checkpoint(mode)
+
+    def close(self):
+        self.export_columnar()
+        self.pool.checkpoint("TRUNCATE")
+        self.pool.close()
+
+    # Forgets the open connections and the views, for when the file was replaced.
+    # Both are opened and loaded again on next use.
+    def reset(self):
+        self.pool.close()
+        self._invalidate_views()
+        self.version = 0
+
+    @staticmethod
+    def _read_version(conn) -> int:
+        row = conn.execute(
+            "SELECT value FROM meta WHERE key = 'data_version'"
+        ).fetchone()
+        return row[0] if row else 0
+
+    # Version of the data in the file, which may be ahead of the views
+    def data_version(self) -> int:
+        with self.pool.reader() as conn:
+            return self._read_version(conn)
+
+    # Time of the last write, None for databases that haven't been written to since
+    # it was recorded
+    @staticmethod
+    def _read_modified_at(conn) -> Optional[float]:
+        row = conn.execute(
+            "SELECT value FROM meta WHERE key = 'data_modified_at'"
+        ).fetchone()
+        return row[0] if row else None
+
+    # Bumps the stored data version as part of the current write transaction
+    @staticmethod
+    def _next_version(conn) -> int:
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'data_version'")
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('data_modified_at', ?)",
+            (time.time(),),
+        )
+        return Database._read_version(conn)
+
+    # Reads the whole table into a new snapshot and spatial index and publishes them,
+    # see _publish_views. On a reader the version and the rows are read in one
+    # transaction, so they come from the same state of the file; the writer calls this
+    # inside its write. Returns whether the views were published.
+    def _build_views(self, conn, force: bool = False) -> bool:
+        if not conn.in_transaction:
+            conn.execute("BEGIN")
+        version = self._read_version(conn)
+        modified_at = self._read_modified_at(conn)
+        if self.columnar_file is not None:
+            # Another process may already have written the file for this version
+            columns = open_columnar(self.columnar_file)
+            if columns is not None and (columns.version, columns.modified_at) == (
+                version,
+                modified_at,
+            ):
+                return self._publish_views(
+                    MappedSnapshot(columns), MappedSpatialIndex(columns), force
+                )
+
+        rows = conn.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM food_trucks ORDER BY location_id"
+        ).fetchall()
+        snapshot = TruckSnapshot(rows, version, modified_at)
+        if not self._publish_views(snapshot, self._index_snapshot(snapshot), force):
+            return False
+        if self.columnar_file is not None:
+            self._schedule_export()
+        return True
+
+    @staticmethod
+    def _index_snapshot(snapshot: TruckSnapshot) -> SpatialIndex:
+        index = SpatialIndex()
+        for i, location_id in enumerate(snapshot.location_ids):
+            index.insert(location_id, snapshot.latitudes[i], snapshot.longitudes[i])
+        return index
+
+    # Exports the in-memory views export_delay seconds from now, on a background
+    # thread: writes never wait for the file, and a burst of them is exported once
+    def _schedule_export(self):
+        with self._timer_lock:
+            if self._export_timer is None:
+                self._export_timer = threading.Timer(
+                    self.export_delay, self.export_columnar
+                )
+                self._export_timer.daemon = True
+                self._export_timer.start()
+
+    # Writes the in-memory views to the columnar file, unless another worker already
+    # wrote that version, and swaps in views mapped from it. Views whose write hasn't
+    # committed yet are exported later; ones another process has moved past are left
+    # to the version check.
+    def export_columnar(self):
+        with self._timer_lock:
+            if self._export_timer is not None:
+                self._export_timer.cancel()
+                self._export_timer = None
+        with self._export_lock:
+            snapshot = self._snapshot
+            if (
+                self.columnar_file is None
+                or snapshot is None
+                or isinstance(snapshot, MappedSnapshot)
+            ):
+                return
+            with self.pool.reader() as conn:
+                conn.execute("BEGIN")
+                committed = (self._read_version(conn), self._read_modified_at(conn))
+            if committed[0] < snapshot.version:
+                self._schedule_export()
+                return
+            if committed != (snapshot.version, snapshot.modified_at):
+                return
+            columns = open_columnar(self.columnar_file)
+            if columns is None or (columns.version, columns.modified_at) != committed:
+                write_columnar(self.columnar_file, snapshot)
+                columns = open_columnar(self.columnar_file)
+            # Another worker may have replaced it with a different version since
+            if columns is None or (columns.version, columns.modified_at) != committed:
+                return
+            mapped = MappedSnapshot(columns)
+            mapped._address_index = snapshot._address_index
+            with self._publish_lock:
+                if self._snapshot is snapshot:
+                    self._snapshot = mapped
+                    self._spatial_index = MappedSpatialIndex(columns)
+
+    # Swaps in views built from the table, unless a write made by this process has
+    # moved past their version while they were being built: its own views are newer
+    # then. force is for builds made with the writer held, when no write can be in
+    # flight.
+    def _publish_views(
+        self, snapshot: TruckSnapshot, index: GridIndex, force: bool = False
+    ) -> bool:
+        with self._publish_lock:
+            if not force and snapshot.version < self.version:
+                return False
+            self._spatial_index = index
+            self._snapshot = snapshot
+            self.version = snapshot.version
+            return True
+
+    # The snapshot and the spatial index are built from the table on first use and then
+    # patched by the write methods below. They are read from a reader connection, so a
+    # write in progress doesn't hold them up, unless that write finishes first.
+    def _load_views(self):
+        with self._views_lock:
+            if self._snapshot is not None and self._spatial_index is not None:
+                return
+            with self.pool.reader() as conn:
+                if self._build_views(conn):
+                    return
+            if self._snapshot is not None and self._spatial_index is not None:
+                return
+            with self.pool.writer() as conn:
+                self._build_views(conn, force=True)
+
+    # Writes made by another process, e.g. python -m src.sync, only show up as a new
+    # data version in the meta table. It is checked at most once per
+    # version_check_interval; when it moved, the views are rebuilt from a reader while
+    # requests keep using the old ones. A build that loses to a write made here is
+    # dropped, since that write brings the views up to date itself (see _changed).
+    def _check_version(self):
+        if self._snapshot is None or self.version_check_interval is None:
+            return
+        now = time.monotonic()
+        if now - self._last_version_check < self.version_check_interval:
+            return
+        self._last_version_check = now
+        with self.pool.reader() as conn:
+            version = self._read_version(conn)
+        if version == self.version or not self._views_lock.acquire(blocking=False):
+            return
+        try:
+            with self.pool.reader() as conn:
+                self._build_views(conn)
+        finally:
+            self._views_lock.release()
+
+    @property
+    def spatial_index(self) -> GridIndex:
+        self._check_version()
+        index = self._spatial_index
+        if index is None:
+            self._load_views()
+            index = self._spatial_index
+        return index
+
+    # The snapshot together with the spatial index built from the same table
+    def get_views(self) -> Tuple[TruckSnapshot, GridIndex]:
+        self._check_version()
+        snapshot, index = self._snapshot, self._spatial_index
+        if snapshot is None or index is None:
+            self._load_views()
+            return self.get_views()
+        return snapshot, index
+
+    # Current snapshot of the table; its version tells which write it reflects
+    def get_snapshot(self) -> TruckSnapshot:
+        self._check_version()
+        snapshot = self._snapshot
+        if snapshot is None:
+            self._load_views()
+            snapshot = self._snapshot
+        return snapshot
+
+    # Every write updates the opening hours and food items, appends to the change log,
+    # bumps the data version and, if the views are loaded, patches them with the rows
+    # it wrote and the location_ids it deleted. Batches that touch a large part of the
+    # table rebuild the views instead. Must be called with the writer held, inside the
+    # write's transaction.
+    def _changed(self, conn, rows: Sequence[tuple] = (), deleted: Sequence[int] = ()):
+        self._store_hours(conn, rows, deleted)
+        self._store_food_items(conn, rows, deleted)
+        self._log_changes(conn, rows, deleted)
+        version = self._next_version(conn)
+        with self._publish_lock:
+            index, snapshot = self._spatial_index, self._snapshot
+            # Another process wrote in between and the views haven't caught up with it
+            # yet: patching them would label stale data with the new version, and in
+            # columnar mode export it to every other worker
+            if snapshot is not None and (
+                snapshot.version != version - 1
+                or len(rows) + len(deleted)
+                > max(REBUILD_THRESHOLD, len(snapshot) // 10)
+            ):
+                self._build_views(conn, force=True)
+                return
+            if isinstance(snapshot, MappedSnapshot):
+                # The mapped views are read-only: the first write after an export goes
+                # back to in-memory views, which are patched until the next export
+                snapshot = snapshot.apply(
+                    rows, deleted, version, self._read_modified_at(conn)
+                )
+                self._spatial_index = self._index_snapshot(snapshot)
+                self._snapshot = snapshot
+                self.version = version
+                self._schedule_export()
+                return
+            if index is not None:
+                for location_id in deleted:
+                    index.remove(location_id)
+                for row in rows:
+                    index.insert(row[0], row[LATITUDE], row[LONGITUDE])
+            if snapshot is not None:
+                self._snapshot = snapshot.apply(
+                    rows, deleted, version, self._read_modified_at(conn)
+                )
+                if self.columnar_file is not None:
+                    self._schedule_export()
+            self.version = version
+
+    # Drops the views so they are rebuilt on next use, after bulk changes or a
+    # failed write
+    def _invalidate_views(self):
+        with self._views_lock:
+            self._spatial_index = None
+            self._snapshot = None
+
+    # Writer connection that invalidates the views if the transaction fails, since
+    # they may already have been patched with its changes
+    @contextmanager
+    def _transaction(self):
+        try:
+            with self.pool.writer() as conn:
+                yield conn
+        except BaseException:
+            self._invalidate_views()
+            raise
+
+    # Bulk loads the CSV: rows are parsed and validated in batches and written with
+    # executemany inside a single transaction. fsyncs are turned off and the page cache
+    # is enlarged for the load since a failed load is simply rolled back and rerun.
+    def create_database(
+        self, csv_file, batch_size: int = 5000, cache_size_kib: int = 65536
+    ) -> IngestReport:
+        self.create_table()
+        report = IngestReport()
+        sql = f"""INSERT INTO food_trucks ({", ".join(COLUMNS)})
+                  VALUES ({", ".join("?" for _ in COLUMNS)})"""
+        with self.pool.writer() as conn:
+            (cache_size,) = conn.execute("PRAGMA cache_size").fetchone()
+            conn.execute("PRAGMA synchronous = OFF")
+            conn.execute(f"PRAGMA cache_size = -{int(cache_size_kib)}")
+            seen = {
+                location_id
+                for (location_id,) in conn.execute(
+                    "SELECT location_id FROM food_trucks"
+                )
+            }
+            try:
+                conn.execute("BEGIN")
+                with open(csv_file, "r", encoding="utf-8") as file:
+                    for batch in read_csv_batches(file, report, batch_size):
+                        rows = []
+                        for line, values in batch:
+                            if values[0] in seen:
+                                report.rejected.append(
+                                    RejectedRow(
+                                        line=line,
+                                        location_id=str(values[0]),
+                                        reason="duplicate location_id",
+                                    )
+                                )
+                                continue
+                            seen.add(values[0])
+                            rows.append(values)
+                        conn.executemany(sql, rows)
+                        conn.executemany(
+                            "INSERT INTO food_truck_hashes VALUES (?, ?)",
+                            [(values[0], row_hash(values)) for values in rows],
+                        )
+                        conn.executemany(_INSERT_HOURS_SQL, hours_rows(rows))
+                        self._store_food_items(conn, rows)
+                        self._log_changes(conn, rows)
+                        report.inserted += len(rows)
+                self._next_version(conn)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                conn.execute("PRAGMA synchronous = NORMAL")
+                conn.execute(f"PRAGMA cache_size = {cache_size}")
+            # Refresh the planner statistics so the secondary indexes get picked up
+            conn.execute("PRAGMA optimize")
+
+        # Rebuilt from the table on next use
+        self._invalidate_views()
+        return report
 
     def create_table(self):
-        with database_connection(self.db_name) as conn:
+        with self.pool.writer() as conn:
             conn.execute(
                 """CREATE TABLE IF NOT EXISTS food_trucks (
                             location_id INTEGER PRIMARY KEY,
@@ -136,6 +651,332 @@ class Database:
                             neighborhoods_old INTEGER
                             )"""
             )
+            # Backs the filters in TruckFilter and the bounding box prefilter of radius
+            # queries, which the location_id rowid makes a covering index. status and facility_type are matched
+            # case-insensitively, so their indexes use NOCASE as well.
+            conn.executescript(
+                """CREATE INDEX IF NOT EXISTS idx_food_trucks_status_facility_type
+                       ON food_trucks (status COLLATE NOCASE, facility_type COLLATE NOCASE);
+                   CREATE INDEX IF NOT EXISTS idx_food_trucks_facility_type
+                       ON food_trucks (facility_type COLLATE NOCASE);
+                   CREATE INDEX IF NOT EXISTS idx_food_trucks_zip_codes
+                       ON food_trucks (zip_codes);
+                   CREATE INDEX IF NOT EXISTS idx_food_trucks_supervisor_districts
+                       ON food_trucks (supervisor_districts);
+                   CREATE INDEX IF NOT EXISTS idx_food_trucks_police_districts
+                       ON food_trucks (police_districts);
+                   CREATE INDEX IF NOT EXISTS idx_food_trucks_latitude_longitude
+                       ON food_trucks (latitude, longitude);"""
+            )
+            self._create_search_index(conn)
+            self._create_sync_tables(conn)
+            self._create_hours_table(conn)
+            self._create_food_item_tables(conn)
+            self._create_change_log(conn)
+
+    # meta holds the data version; food_truck_hashes has the row_hash of every row as
+    # it was last loaded from the CSV, see src/sync.py. Any other write to a row drops
+    # its hash, so the next sync puts the CSV's version of the row back.
+    def _create_sync_tables(self, conn):
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'food_truck_hashes'"
+        ).fetchone()
+        conn.executescript(
+            """CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER);
+               INSERT OR IGNORE INTO meta (key, value) VALUES ('data_version', 0);
+               INSERT OR IGNORE INTO meta (key, value)
+                   VALUES ('data_modified_at', (julianday('now') - 2440587.5) * 86400.0);
+               CREATE TABLE IF NOT EXISTS food_truck_hashes (
+                   location_id INTEGER PRIMARY KEY,
+                   hash TEXT NOT NULL
+               );
+               CREATE TRIGGER IF NOT EXISTS food_truck_hashes_update
+               AFTER UPDATE ON food_trucks BEGIN
+                   DELETE FROM food_truck_hashes
+                   WHERE location_id IN (old.location_id, new.location_id);
+               END;
+               CREATE TRIGGER IF NOT EXISTS food_truck_hashes_delete
+               AFTER DELETE ON food_trucks BEGIN
+                   DELETE FROM food_truck_hashes WHERE location_id = old.location_id;
+               END;"""
+        )
+        # Rows of databases created before syncing existed all came from the CSV
+        if not exists:
+            rows = conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM food_trucks"
+            ).fetchall()
+            conn.executemany(
+                "INSERT INTO food_truck_hashes VALUES (?, ?)",
+                ((row[0], row_hash(row)) for row in rows),
+            )
+
+    # Opening hours parsed from dayshours, see src/hours.py. The index answers "open at"
+    # queries from the rows of a single weekday.
+    def _create_hours_table(self, conn):
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'food_truck_hours'"
+        ).fetchone()
+        conn.executescript(
+            """CREATE TABLE IF NOT EXISTS food_truck_hours (
+                   location_id INTEGER NOT NULL,
+                   weekday INTEGER NOT NULL,
+                   start_minute INTEGER NOT NULL,
+                   end_minute INTEGER NOT NULL
+               );
+               CREATE INDEX IF NOT EXISTS idx_food_truck_hours_open
+                   ON food_truck_hours (weekday, start_minute, end_minute, location_id);
+               CREATE INDEX IF NOT EXISTS idx_food_truck_hours_location_id
+                   ON food_truck_hours (location_id);"""
+        )
+        if not exists:
+            rows = conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM food_trucks"
+            ).fetchall()
+            conn.executemany(_INSERT_HOURS_SQL, hours_rows(rows))
+
+    @staticmethod
+    def _store_hours(conn, rows: Sequence[tuple], deleted: Sequence[int]):
+        conn.executemany(
+            "DELETE FROM food_truck_hours WHERE location_id = ?",
+            [(location_id,) for location_id in deleted] + [(row[0],) for row in rows],
+        )
+        conn.executemany(_INSERT_HOURS_SQL, hours_rows(rows))
+
+    # Vocabulary of normalized food item names with the number of trucks serving each,
+    # and a posting list of trucks per item. Kept up to date by every write, so facet
+    # counts over the whole table are read straight from food_items.
+    def _create_food_item_tables(self, conn):
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'food_truck_items'"
+        ).fetchone()
+        conn.executescript(
+            """CREATE TABLE IF NOT EXISTS food_items (
+                   item_id INTEGER PRIMARY KEY,
+                   name TEXT NOT NULL UNIQUE,
+                   truck_count INTEGER NOT NULL DEFAULT 0
+               );
+               CREATE INDEX IF NOT EXISTS idx_food_items_truck_count
+                   ON food_items (truck_count DESC, name);
+               CREATE TABLE IF NOT EXISTS food_truck_items (
+                   item_id INTEGER NOT NULL,
+                   location_id INTEGER NOT NULL,
+                   PRIMARY KEY (item_id, location_id)
+               ) WITHOUT ROWID;
+               CREATE INDEX IF NOT EXISTS idx_food_truck_items_location_id
+                   ON food_truck_items (location_id, item_id);"""
+        )
+        if not exists:
+            rows = conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM food_trucks"
+            ).fetchall()
+            self._store_food_items(conn, rows)
+
+    # Replaces the postings of the written and deleted rows and moves the per item
+    # counts by the difference
+    @staticmethod
+    def _store_food_items(
+        conn,
+        rows: Sequence[tuple],
+        deleted: Sequence[int] = (),
+        chunk_size: int = 500,
+    ):
+        counts: Counter = Counter()
+        location_ids = [*deleted, *(row[0] for row in rows)]
+        for i in range(0, len(location_ids), chunk_size):
+            chunk = location_ids[i : i + chunk_size]
+            placeholders = ", ".join("?" for _ in chunk)
+            for (item_id,) in conn.execute(
+                f"SELECT item_id FROM food_truck_items WHERE location_id IN ({placeholders})",
+                chunk,
+            ):
+                counts[item_id] -= 1
+            conn.execute(
+                f"DELETE FROM food_truck_items WHERE location_id IN ({placeholders})",
+                chunk,
+            )
+
+        postings = list(item_postings(rows))
+        names = list({name for _, name in postings})
+        conn.executemany(
+            "INSERT OR IGNORE INTO food_items (name) VALUES (?)",
+            [(name,) for name in names],
+        )
+        item_ids = {}
+        for i in range(0, len(names), chunk_size):
+            chunk = names[i : i + chunk_size]
+            placeholders = ", ".join("?" for _ in chunk)
+            item_ids.update(
+                conn.execute(
+                    f"SELECT name, item_id FROM food_items WHERE name IN ({placeholders})",
+                    chunk,
+                )
+            )
+        conn.executemany(
+            "INSERT INTO food_truck_items (item_id, location_id) VALUES (?, ?)",
+            [(item_ids[name], location_id) for location_id, name in postings],
+        )
+        for _, name in postings:
+            counts[item_ids[name]] += 1
+        conn.executemany(
+            "UPDATE food_items SET truck_count = truck_count + ? WHERE item_id = ?",
+            [(delta, item_id) for item_id, delta in counts.items() if delta],
+        )
+
+    # Change log with one entry per truck, for its latest write or deletion. Writing a
+    # truck again replaces its entry with one at a new seq, so reading everything after
+    # a seq gives the current state of every truck changed since, and reading from 0
+    # gives the whole table plus the tombstones that haven't been compacted yet.
+    def _create_change_log(self, conn):
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'food_truck_changes'"
+        ).fetchone()
+        conn.executescript(
+            """CREATE TABLE IF NOT EXISTS food_truck_changes (
+                   seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                   location_id INTEGER NOT NULL UNIQUE,
+                   deleted INTEGER NOT NULL,
+                   changed_at REAL NOT NULL
+               );
+               INSERT OR IGNORE INTO meta (key, value) VALUES ('change_log_floor', 0);"""
+        )
+        conn.execute(
+            "INSERT OR IGNORE INTO meta (key, value) VALUES ('change_log_epoch', ?)",
+            (secrets.randbits(62),),
+        )
+        if not exists:
+            conn.execute(
+                """INSERT INTO food_truck_changes (location_id, deleted, changed_at)
+                   SELECT location_id, 0, ? FROM food_trucks ORDER BY location_id""",
+                (time.time(),),
+            )
+
+    @staticmethod
+    def _log_changes(conn, rows: Sequence[tuple], deleted: Sequence[int] = ()):
+        changed_at = time.time()
+        conn.executemany(
+            _LOG_CHANGE_SQL,
+            [(location_id, 1, changed_at) for location_id in deleted]
+            + [(row[0], 0, changed_at) for row in rows],
+        )
+
+    # Changes after the cursor since, oldest first, up to limit of them. "0" starts from
+    # the beginning. Raises StaleCursor when since comes from another log (e.g. before
+    # a rebuild), is older than the oldest compacted tombstone or is ahead of the log,
+    # in which case the client starts over from "0".
+    def get_changes(self, since: str = "0", limit: Optional[int] = None) -> ChangePage:
+        if since == "0":
+            epoch, seq = None, 0
+        else:
+            try:
+                epoch, seq = (int(part) for part in since.split("-"))
+            except ValueError:
+                raise StaleCursor(f"Invalid cursor {since!r}, start over with since=0")
+        sql = f"""SELECT c.seq, c.location_id, c.deleted, c.changed_at,
+                         {", ".join(f"t.{column}" for column in COLUMNS)}
+                  FROM food_truck_changes c
+                  LEFT JOIN food_trucks t ON t.location_id = c.location_id
+                  WHERE c.seq > ? ORDER BY c.seq"""
+        params = [seq]
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self.pool.reader() as conn:
+            # One read transaction, so the epoch, the floor and the entries agree
+            conn.execute("BEGIN")
+            try:
+                log = dict(
+                    conn.execute(
+                        """SELECT key, value FROM meta
+                           WHERE key IN ('change_log_epoch', 'change_log_floor')"""
+                    )
+                )
+                row = conn.execute(
+                    "SELECT seq FROM sqlite_sequence WHERE name = 'food_truck_changes'"
+                ).fetchone()
+                last_seq = row[0] if row else 0
+                if epoch is not None and (
+                    epoch != log["change_log_epoch"]
+                    or seq > last_seq
+                    or seq < log["change_log_floor"]
+                ):
+                    raise StaleCursor(
+                        f"Changes since {since} are no longer available, "
+                        "start over with since=0"
+                    )
+                rows = conn.execute(sql, params).fetchall()
+            finally:
+                conn.commit()
+        changes = [
+            Change(
+                seq=row[0],
+                location_id=row[1],
+                deleted=bool(row[2]),
+                changed_at=row[3],
+                truck=None if row[2] else _food_truck(row[4:]),
+            )
+            for row in rows
+        ]
+        return ChangePage(
+            changes=changes, epoch=log["change_log_epoch"], last_seq=last_seq
+        )
+
+    # Removes tombstones older than retention seconds and returns how many. Cursors
+    # from before the newest one removed can no longer be served.
+    def compact_changes(self, retention: float = CHANGE_LOG_RETENTION) -> int:
+        with self.pool.writer() as conn:
+            (newest,) = conn.execute(
+                """SELECT max(seq) FROM food_truck_changes
+                   WHERE deleted AND changed_at < ?""",
+                (time.time() - retention,),
+            ).fetchone()
+            if newest is None:
+                return 0
+            removed = conn.execute(
+                "DELETE FROM food_truck_changes WHERE deleted AND seq <= ?", (newest,)
+            ).rowcount
+            conn.execute(
+                """UPDATE meta SET value = max(value, ?)
+                   WHERE key = 'change_log_floor'""",
+                (newest,),
+            )
+        return removed
+
+    # FTS5 index over the searchable text columns. It is an external content table
+    # that stores no copy of the text, and triggers keep it in sync with every write
+    # to food_trucks.
+    def _create_search_index(self, conn):
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'food_trucks_fts'"
+        ).fetchone()
+        conn.executescript(
+            """CREATE VIRTUAL TABLE IF NOT EXISTS food_trucks_fts USING fts5(
+                   applicant, food_items, location_description,
+                   content='food_trucks', content_rowid='location_id',
+                   tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+               );
+               CREATE TRIGGER IF NOT EXISTS food_trucks_fts_insert
+               AFTER INSERT ON food_trucks BEGIN
+                   INSERT INTO food_trucks_fts (rowid, applicant, food_items, location_description)
+                   VALUES (new.location_id, new.applicant, new.food_items, new.location_description);
+               END;
+               CREATE TRIGGER IF NOT EXISTS food_trucks_fts_delete
+               AFTER DELETE ON food_trucks BEGIN
+                   INSERT INTO food_trucks_fts (food_trucks_fts, rowid, applicant, food_items, location_description)
+                   VALUES ('delete', old.location_id, old.applicant, old.food_items, old.location_description);
+               END;
+               CREATE TRIGGER IF NOT EXISTS food_trucks_fts_update
+               AFTER UPDATE ON food_trucks BEGIN
+                   INSERT INTO food_trucks_fts (food_trucks_fts, rowid, applicant, food_items, location_description)
+                   VALUES ('delete', old.location_id, old.applicant, old.food_items, old.location_description);
+                   INSERT INTO food_trucks_fts (rowid, applicant, food_items, location_description)
+                   VALUES (new.location_id, new.applicant, new.food_items, new.location_description);
+               END;"""
+        )
+        # Databases created before the index existed need it filled once
+        if not exists:
+            conn.execute(
+                "INSERT INTO food_trucks_fts (food_trucks_fts) VALUES ('rebuild')"
+            )
 
     def insert_food_truck(self, food_truck: FoodTruck):
         sql = """INSERT INTO food_trucks (location_id, applicant, facility_type, cnn, location_description, address, blocklot, block, lot,
@@ -174,43 +1015,235 @@ class Database:
             food_truck.zip_codes,
             food_truck.neighborhoods_old,
         )
-        with database_connection(self.db_name) as conn:
-            conn.execute(sql, values)
-            conn.commit()
+        with self._transaction() as conn:
+            cursor = conn.execute(sql, values)
+            if food_truck.location_id is None:
+                food_truck = food_truck.model_copy(
+                    update={"location_id": cursor.lastrowid}
+                )
+            self._changed(conn, [food_truck.as_row()])
         return True
 
-    def get_all_food_trucks(self) -> List[FoodTruck]:
-        with database_connection(self.db_name) as conn:
-            cursor = conn.execute("SELECT * FROM food_trucks")
-            data = cursor.fetchall()
-            columns = [column[0] for column in cursor.description]
-            return [FoodTruck(**dict(zip(map(str, columns), row))) for row in data]
+    # Every truck in location_id order. Without columns the rows come back as FoodTruck
+    # models; with a projection only those columns are read and each row is a plain
+    # dict, ready to serialize.
+    def get_all_food_trucks(
+        self, columns: Optional[Sequence[str]] = None
+    ) -> List[Record]:
+        with self.pool.reader() as conn:
+            cursor = conn.execute(
+                f"SELECT {_select_list(columns)} FROM food_trucks ORDER BY location_id"
+            )
+            return _records(cursor, columns)
+
+    # Streams rows in location_id order straight from a server-side cursor, fetching
+    # batch_size rows at a time, so the full result set is never held in memory. A
+    # pooled reader stays checked out until the generator is exhausted or closed.
+    def iter_food_trucks(
+        self,
+        columns: Sequence[str] = COLUMNS,
+        after: Optional[int] = None,
+        limit: Optional[int] = None,
+        batch_size: int = 500,
+    ) -> Iterator[tuple]:
+        sql = f"SELECT {_select_list(columns)} FROM food_trucks"
+        params: list = []
+        if after is not None:
+            sql += " WHERE location_id > ?"
+            params.append(after)
+        sql += " ORDER BY location_id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
 
-    def get_food_truck_by_id(self, location_id: int) -> Optional[FoodTruck]:
-        with database_connection(self.db_name) as conn:
+        with self.pool.reader() as conn:
+            cursor = conn.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+
+    def get_food_truck_by_id(
+        self, location_id: int, columns: Optional[Sequence[str]] = None
+    ) -> Optional[Record]:
+        with self.pool.reader() as conn:
             cursor = conn.execute(
-                "SELECT * FROM food_trucks WHERE location_id = ?", (location_id,)
+                f"SELECT {_select_list(columns)} FROM food_trucks WHERE location_id = ?",
+                (location_id,),
             )
-            data = cursor.fetchone()
-            if data:
-                columns = [column[0] for column in cursor.description]
-                return FoodTruck(**dict(zip(columns, data)))
-            return None
-
-    def get_food_truck_by_name(self, name: str) -> List[FoodTruck]:
-        with database_connection(self.db_name) as conn:
+            records = _records(cursor, columns)
+        return records[0] if records else None
+
+    def get_food_trucks_by_ids(
+        self, location_ids: List[int], columns: Optional[Sequence[str]] = None
+    ) -> List[Record]:
+        if not location_ids:
+            return []
+        # The location_id is needed to put the rows back in order
+        selected = None if columns is None else ["location_id", *columns]
+        placeholders = ", ".join("?" for _ in location_ids)
+        with self.pool.reader() as conn:
+            rows = conn.execute(
+                f"""SELECT {_select_list(selected)} FROM food_trucks
+                    WHERE location_id IN ({placeholders})""",
+                list(location_ids),
+            ).fetchall()
+        if columns is None:
+            trucks = {row[0]: _food_truck(row) for row in rows}
+        else:
+            trucks = {row[0]: dict(zip(columns, row[1:])) for row in rows}
+        # Keep the order the caller asked for
+        return [trucks[idx] for idx in location_ids if idx in trucks]
+
+    # Uses the spatial index to find the closest trucks without scanning the table.
+    # Returns the snapshot that served the query and the positions of the trucks in it.
+    def get_closest_positions(
+        self,
+        latitude: float,
+        longitude: float,
+        num_closest: int = 3,
+        accuracy: Accuracy = Accuracy.exact,
+    ) -> Tuple[TruckSnapshot, List[int]]:
+        snapshot, index = self.get_views()
+        nearest = index.nearest(
+            latitude, longitude, num_closest, exact=accuracy == Accuracy.exact
+        )
+        return snapshot, snapshot.positions([idx for _, idx in nearest])
+
+    def get_closest_food_trucks(
+        self,
+        latitude: float,
+        longitude: float,
+        num_closest: int = 3,
+        accuracy: Accuracy = Accuracy.exact,
+    ) -> List[FoodTruck]:
+        snapshot, positions = self.get_closest_positions(
+            latitude, longitude, num_closest, accuracy
+        )
+        return [FoodTruck.model_validate_json(snapshot.payloads[i]) for i in positions]
+
+    def get_food_truck_by_name(
+        self, name: str, columns: Optional[Sequence[str]] = None
+    ) -> List[Record]:
+        with self.pool.reader() as conn:
             cursor = conn.execute(
-                "SELECT * FROM food_trucks WHERE applicant LIKE ?", ("%" + name + "%",)
+                f"SELECT {_select_list(columns)} FROM food_trucks WHERE applicant LIKE ?",
+                ("%" + name + "%",),
+            )
+            return _records(cursor, columns)
+
+    # Trucks matching the filter in location_id order, after the given location_id
+    def filter_food_trucks(
+        self,
+        filters: TruckFilter,
+        after: Optional[int] = None,
+        limit: Optional[int] = None,
+        columns: Optional[Sequence[str]] = None,
+    ) -> List[Record]:
+        where, params = filters.where()
+        clauses = [where] if where else []
+        if after is not None:
+            clauses.append("location_id > ?")
+            params.append(after)
+        sql = f"SELECT {_select_list(columns)} FROM food_trucks"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY location_id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self.pool.reader() as conn:
+            return _records(conn.execute(sql, params), columns)
+
+    # (location_id, latitude, longitude) of every truck matching the filter, the
+    # candidates for a filtered distance ranking. box is an optional
+    # (min_lat, min_lon, max_lat, max_lon) bounding box, see geo.bounding_box.
+    def filter_coordinates(
+        self,
+        filters: TruckFilter,
+        box: Optional[Tuple[float, float, float, float]] = None,
+    ) -> List[Tuple[int, float, float]]:
+        where, params = filters.where()
+        clauses = [where] if where else []
+        if box is not None:
+            min_lat, min_lon, max_lat, max_lon = box
+            clauses.append("latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?")
+            params.extend([min_lat, max_lat, min_lon, max_lon])
+        sql = "SELECT location_id, latitude, longitude FROM food_trucks"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY location_id"
+        with self.pool.reader() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    # (item name, number of trucks) pairs, most common first. Without filters the counts
+    # are the ones every write keeps up to date; otherwise the postings of the matching
+    # trucks, or of the trucks in location_ids, are counted.
+    def food_item_facets(
+        self,
+        filters: Optional[TruckFilter] = None,
+        location_ids: Optional[Sequence[int]] = None,
+        limit: Optional[int] = None,
+        chunk_size: int = 500,
+    ) -> List[Tuple[str, int]]:
+        with self.pool.reader() as conn:
+            if location_ids is not None:
+                counts: Counter = Counter()
+                location_ids = list(location_ids)
+                for i in range(0, len(location_ids), chunk_size):
+                    chunk = location_ids[i : i + chunk_size]
+                    placeholders = ", ".join("?" for _ in chunk)
+                    for name, count in conn.execute(
+                        f"""SELECT name, COUNT(*) FROM food_truck_items
+                            JOIN food_items USING (item_id)
+                            WHERE location_id IN ({placeholders}) GROUP BY item_id""",
+                        chunk,
+                    ):
+                        counts[name] += count
+                facets = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+                return facets if limit is None else facets[:limit]
+
+            where, params = filters.where() if filters is not None else ("", [])
+            if where:
+                sql = f"""SELECT name, COUNT(*) AS trucks FROM food_truck_items
+                          JOIN food_items USING (item_id)
+                          WHERE location_id IN (SELECT location_id FROM food_trucks WHERE {where})
+                          GROUP BY item_id ORDER BY trucks DESC, name"""
+            else:
+                sql = """SELECT name, truck_count FROM food_items WHERE truck_count > 0
+                         ORDER BY truck_count DESC, name"""
+            if limit is not None:
+                sql += " LIMIT ?"
+                params.append(limit)
+            return conn.execute(sql, params).fetchall()
+
+    # Ranked full-text search over applicant, food_items and location_description.
+    # Every word of the query has to match; with prefix set the last word only has to
+    # be the start of a word, for autocomplete.
+    def search_food_trucks(
+        self, query: str, limit: int = 20, prefix: bool = False
+    ) -> List[SearchResult]:
+        match = fts_query(query, prefix)
+        if not match:
+            return []
+        with self.pool.reader() as conn:
+            cursor = conn.execute(
+                """SELECT t.location_id, t.applicant, t.food_items, t.address,
+                          t.latitude, t.longitude,
+                          bm25(food_trucks_fts, 4.0, 2.0, 1.0) AS score
+                   FROM food_trucks_fts
+                   JOIN food_trucks t ON t.location_id = food_trucks_fts.rowid
+                   WHERE food_trucks_fts MATCH ?
+                   ORDER BY score, t.location_id
+                   LIMIT ?""",
+                (match, limit),
             )
-            data = cursor.fetchall()
             columns = [column[0] for column in cursor.description]
-            return [FoodTruck(**dict(zip(map(str, columns), row))) for row in data]
+            return [SearchResult(**dict(zip(columns, row))) for row in cursor]
 
     def update_food_truck(self, location_id: int, food_truck: FoodTruck):
-        with database_connection(self.db_name) as conn:
-            existing_truck = self.get_food_truck_by_id(location_id)
-            if existing_truck is None:
-                return None
+        with self._transaction() as conn:
             sql = """UPDATE food_trucks SET location_id = ?, applicant = ?, facility_type = ?, cnn = ?, location_description = ?, address = ?,
                      blocklot = ?, block = ?, lot = ?, permit = ?, status = ?, food_items = ?, x = ?, y = ?, latitude = ?,
                      longitude = ?, schedule = ?, dayshours = ?, NOISent = ?, approved = ?, received = ?, prior_permit = ?,
@@ -248,17 +1281,203 @@ class Database:
                 food_truck.neighborhoods_old,
                 location_id,
             )
-            conn.execute(sql, values)
-            conn.commit()
+            if conn.execute(sql, values).rowcount == 0:
+                return None
+            deleted = [] if food_truck.location_id == location_id else [location_id]
+            self._changed(conn, [food_truck.as_row()], deleted)
         return food_truck
 
     def delete_food_truck(self, location_id: int):
-        with database_connection(self.db_name) as conn:
-            existing_truck = self.get_food_truck_by_id(location_id)
-            if existing_truck is None:
-                return None
-            conn.execute(
+        with self._transaction() as conn:
+            cursor = conn.execute(
                 "DELETE FROM food_trucks WHERE location_id = ?", (location_id,)
             )
-            conn.commit()
+            if cursor.rowcount == 0:
+                return None
+            self._changed(conn, deleted=[location_id])
         return True
+
+    # location_id -> row_hash of every row, None for rows that did not come from the
+    # CSV or were changed since
+    def get_row_hashes(self) -> Dict[int, Optional[str]]:
+        with self.pool.reader() as conn:
+            return dict(
+                conn.execute(
+                    """SELECT t.location_id, h.hash FROM food_trucks t
+                       LEFT JOIN food_truck_hashes h USING (location_id)"""
+                )
+            )
+
+    # Applies a diff against the CSV in a single transaction: deletes the given
+    # location_ids, inserts or overwrites the given rows and records their hashes.
+    # Readers see either none or all of it.
+    def apply_changes(self, rows: List[tuple], deleted: List[int]) -> int:
+        columns = ", ".join(COLUMNS)
+        upsert = f"""INSERT INTO food_trucks ({columns})
+                     VALUES ({", ".join("?" for _ in COLUMNS)})
+                     ON CONFLICT (location_id) DO UPDATE SET
+                     {", ".join(f"{column} = excluded.{column}" for column in COLUMNS[1:])}"""
+        with self._transaction() as conn:
+            conn.executemany(
+                "DELETE FROM food_trucks WHERE location_id = ?",
+                [(location_id,) for location_id in deleted],
+            )
+            conn.executemany(upsert, rows)
+            conn.executemany(
+                "INSERT OR REPLACE INTO food_truck_hashes VALUES (?, ?)",
+                [(row[0], row_hash(row)) for row in rows],
+            )
+            self._changed(conn, rows, deleted)
+        return self.version
+
+    # location_ids from the given ones that exist in the table
+    @staticmethod
+    def _existing_ids(conn, location_ids: List[int], chunk_size: int = 500) -> set:
+        existing = set()
+        for i in range(0, len(location_ids), chunk_size):
+            chunk = location_ids[i : i + chunk_size]
+            placeholders = ", ".join("?" for _ in chunk)
+            existing.update(
+                location_id
+                for (location_id,) in conn.execute(
+                    f"SELECT location_id FROM food_trucks WHERE location_id IN ({placeholders})",
+                    chunk,
+                )
+            )
+        return existing
+
+    # Shared by the batch writes: every item has already been checked against the
+    # table inside the transaction. In atomic mode a single invalid item means nothing
+    # is written; otherwise the valid items are written and the others reported.
+    def _apply_batch(
+        self,
+        conn,
+        results: List[BatchItemResult],
+        atomic: bool,
+        sql: str,
+        params: List[tuple],
+        rows: Sequence[tuple] = (),
+        deleted: Sequence[int] = (),
+    ) -> BatchResult:
+        if atomic and any(r.status == BatchStatus.failed for r in results):
+            for result in results:
+                if result.status != BatchStatus.failed:
+                    result.status = BatchStatus.skipped
+            return BatchResult(applied=0, results=results)
+        if params:
+            conn.executemany(sql, params)
+            self._changed(conn, rows, deleted)
+        return BatchResult(applied=len(params), results=results)
+
+    # Inserts many trucks in one transaction. Trucks without a location_id are given
+    # the next free ones, in order.
+    def insert_food_trucks(
+        self, food_trucks: List[FoodTruck], atomic: bool = True
+    ) -> BatchResult:
+        with self._transaction() as conn:
+            given = [t.location_id for t in food_trucks if t.location_id is not None]
+            existing = self._existing_ids(conn, given)
+            (max_id,) = conn.execute(
+                "SELECT COALESCE(MAX(location_id), 0) FROM food_trucks"
+            ).fetchone()
+            seen = set()
+            results, valid = [], []
+            for food_truck in food_trucks:
+                location_id = food_truck.location_id
+                result = BatchItemResult(
+                    location_id=location_id, status=BatchStatus.created
+                )
+                results.append(result)
+                try:
+                    check_coordinates(food_truck.latitude, food_truck.longitude)
+                    if location_id in existing:
+                        raise ValueError("location_id already exists")
+                    if location_id in seen:
+                        raise ValueError("duplicate location_id")
+                except ValueError as error:
+                    result.status, result.error = BatchStatus.failed, str(error)
+                    continue
+                if location_id is not None:
+                    seen.add(location_id)
+                valid.append((result, food_truck))
+
+            # New ids are only handed out once the batch is known to be written
+            next_id = max([max_id, *given]) + 1
+            rows = []
+            if not (atomic and len(valid) < len(results)):
+                for result, food_truck in valid:
+                    if result.location_id is None:
+                        result.location_id, next_id = next_id, next_id + 1
+                    rows.append(
+                        food_truck.model_copy(
+                            update={"location_id": result.location_id}
+                        ).as_row()
+                    )
+            return self._apply_batch(conn, results, atomic, _INSERT_SQL, rows, rows)
+
+    # Overwrites many trucks in one transaction, each identified by its location_id
+    def update_food_trucks(
+        self, food_trucks: List[FoodTruck], atomic: bool = True
+    ) -> BatchResult:
+        with self._transaction() as conn:
+            existing = self._existing_ids(
+                conn, [t.location_id for t in food_trucks if t.location_id is not None]
+            )
+            seen = set()
+            results, rows = [], []
+            for food_truck in food_trucks:
+                location_id = food_truck.location_id
+                result = BatchItemResult(
+                    location_id=location_id, status=BatchStatus.updated
+                )
+                results.append(result)
+                try:
+                    if location_id is None:
+                        raise ValueError("location_id is required")
+                    check_coordinates(food_truck.latitude, food_truck.longitude)
+                    if location_id not in existing:
+                        raise ValueError("food truck not found")
+                    if location_id in seen:
+                        raise ValueError("duplicate location_id")
+                except ValueError as error:
+                    result.status, result.error = BatchStatus.failed, str(error)
+                    continue
+                seen.add(location_id)
+                rows.append(food_truck.as_row())
+            # SET takes every column but location_id, which goes last for the WHERE
+            params = [row[1:] + row[:1] for row in rows]
+            return self._apply_batch(conn, results, atomic, _UPDATE_SQL, params, rows)
+
+    def delete_food_trucks(
+        self, location_ids: List[int], atomic: bool = True
+    ) -> BatchResult:
+        with self._transaction() as conn:
+            existing = self._existing_ids(conn, location_ids)
+            seen = set()
+            results, deleted = [], []
+            for location_id in location_ids:
+                result = BatchItemResult(
+                    location_id=location_id, status=BatchStatus.deleted
+                )
+                results.append(result)
+                if location_id not in existing:
+                    result.status, result.error = (
+                        BatchStatus.failed,
+                        "food truck not found",
+                    )
+                elif location_id in seen:
+                    result.status, result.error = (
+                        BatchStatus.failed,
+                        "duplicate location_id",
+                    )
+                else:
+                    seen.add(location_id)
+                    deleted.append(location_id)
+            return self._apply_batch(
+                conn,
+                results,
+                atomic,
+                "DELETE FROM food_trucks WHERE location_id = ?",
+                [(location_id,) for location_id in deleted],
+                deleted=deleted,
+            )
@@ -0,0 +1,39 @@
+# The food_items column is free text listing what a truck sells, separated by colons,
+# e.g. "Tacos: Burritos: Mac & Cheese: and String beans.". It is split into normalized
+# item names once per written row, and every truck is listed under each of its items
+# in the food_truck_items table, with the number of trucks per item kept alongside.
+import re
+from typing import Iterable, Iterator, List, Tuple
+
+from .ingest import COLUMNS
+
+FOOD_ITEMS = COLUMNS.index("food_items")
+
+_SEPARATOR = re.compile(r"[:;]")
+_CONJUNCTION = re.compile(r"^(?:and|&)\s+")
+_ETC = re.compile(r"[\s,]*\betc\b\.?$")
+
+
+# Lowercase, single spaces and no "and ..." or "... etc." around it, so that the same
+# item listed by different trucks gets the same name
+def normalize_food_item(text: str) -> str:
+    name = " ".join(text.lower().split()).strip(" .,")
+    name = _CONJUNCTION.sub("", name)
+    return _ETC.sub("", name).strip(" .,")
+
+
+# Distinct item names in the order the truck lists them
+def food_item_names(food_items: str) -> List[str]:
+    names = []
+    for part in _SEPARATOR.split(food_items or ""):
+        name = normalize_food_item(part)
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+# (location_id, item name) for every item of every row
+def item_postings(rows: Iterable[tuple]) -> Iterator[Tuple[int, str]]:
+    for row in rows:
+        for name in food_item_names(row[FOOD_ITEMS]):
+            yield row[0], name
@@ -0,0 +1,215 @@
+import heapq, math
+from array import array
+from enum import Enum
+from typing import Iterable, List, Sequence, Tuple
+
+from geographiclib.geodesic import Geodesic
+
+# Mean earth radius (IUGG), good enough for spherical approximations
+EARTH_RADIUS_KM = 6371.0088
+
+# Largest possible great-circle distance on the sphere
+MAX_DISTANCE_KM = math.pi * EARTH_RADIUS_KM
+
+# The spherical model is off from the WGS-84 ellipsoid by at most ~0.6%, so any
+# candidate set gathered with haversine gets widened by this factor before we
+# re-rank it with exact geodesic distances
+ELLIPSOID_MARGIN = 1.02
+
+
+# fast: spherical haversine, exact: geodesic on the WGS-84 ellipsoid
+class Accuracy(str, Enum):
+    fast = "fast"
+    exact = "exact"
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = (
+        math.sin(dphi / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+# Smallest latitude/longitude box that contains every point within radius_km of
+# (lat, lon). When the circle touches a pole or crosses the antimeridian we
+# give up on narrowing the longitude and return the full [-180, 180] range.
+def bounding_box(
+    lat: float, lon: float, radius_km: float
+) -> Tuple[float, float, float, float]:
+    angular = radius_km / EARTH_RADIUS_KM
+    if angular >= math.pi:
+        return (-90.0, -180.0, 90.0, 180.0)
+
+    phi = math.radians(lat)
+    min_phi = phi - angular
+    max_phi = phi + angular
+    if min_phi <= -math.pi / 2 or max_phi >= math.pi / 2:
+        return (
+            max(math.degrees(min_phi), -90.0),
+            -180.0,
+            min(math.degrees(max_phi), 90.0),
+            180.0,
+        )
+
+    dlambda = math.degrees(math.asin(min(1.0, math.sin(angular) / math.cos(phi))))
+    min_lon = lon - dlambda
+    max_lon = lon + dlambda
+    if min_lon < -180.0 or max_lon > 180.0:
+        min_lon, max_lon = -180.0, 180.0
+    return (math.degrees(min_phi), min_lon, math.degrees(max_phi), max_lon)
+
+
+# Truck coordinates packed into contiguous float64 buffers. The radians and cosines
+# the kernels need are computed once here instead of once per truck per query.
+class CoordinateArray:
+    def __init__(self, latitudes: Iterable[float], longitudes: Iterable[float]):
+        self.latitudes = array("d", latitudes)
+        self.longitudes = array("d", longitudes)
+        if len(self.latitudes) != len(self.longitudes):
+            raise ValueError("latitudes and longitudes must have the same length")
+        self.phi = array("d", map(math.radians, self.latitudes))
+        self.lambda_ = array("d", map(math.radians, self.longitudes))
+        self.cos_phi = array("d", map(math.cos, self.phi))
+
+    def __len__(self) -> int:
+        return len(self.latitudes)
+
+    @classmethod
+    def from_trucks(cls, trucks: Sequence[dict]) -> "CoordinateArray":
+        return cls(
+            (truck["latitude"] for truck in trucks),
+            (truck["longitude"] for truck in trucks),
+        )
+
+
+# Great-circle distance from one origin to every point, in kilometers. There is no
+# array library among the dependencies, so this is a single pass over the packed
+# buffers with the per-truck trigonometry already done; it costs a few hundred
+# nanoseconds per point and is the first stage of every query below.
+def haversine_many(
+    latitude: float, longitude: float, coordinates: CoordinateArray
+) -> array:
+    phi0 = math.radians(latitude)
+    lambda0 = math.radians(longitude)
+    cos_phi0 = math.cos(phi0)
+    sin = math.sin
+    asin = math.asin
+    sqrt = math.sqrt
+    diameter = 2 * EARTH_RADIUS_KM
+
+    distances = array("d", bytes(8 * len(coordinates)))
+    for i, (phi, lambda_, cos_phi) in enumerate(
+        zip(coordinates.phi, coordinates.lambda_, coordinates.cos_phi)
+    ):
+        a = (
+            sin((phi - phi0) / 2) ** 2
+            + cos_phi0 * cos_phi * sin((lambda_ - lambda0) / 2) ** 2
+        )
+        distances[i] = diameter * asin(sqrt(a) if a < 1.0 else 1.0)
+    return distances
+
+
+# Geodesic distance on the WGS-84 ellipsoid (Karney's algorithm, the same one geopy's
+# geodesic uses) from one origin to every point, in kilometers. Each geodesic costs
+# about a hundred times a haversine, so queries never run this over every truck:
+# nearest_indices and within_radius only compute geodesics for the few candidates
+# haversine leaves. It remains the reference the tests check those against.
+def geodesic_many(
+    latitude: float, longitude: float, coordinates: CoordinateArray
+) -> array:
+    inverse = Geodesic.WGS84.Inverse
+    distance_mask = Geodesic.DISTANCE
+    return array(
+        "d",
+        (
+            inverse(latitude, longitude, lat, lon, distance_mask)["s12"] / 1000
+            for lat, lon in zip(coordinates.latitudes, coordinates.longitudes)
+        ),
+    )
+
+
+def geodesic_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    return (
+        Geodesic.WGS84.Inverse(lat1, lon1, lat2, lon2, Geodesic.DISTANCE)["s12"] / 1000
+    )
+
+
+# Every distance at the given accuracy; see geodesic_many for why the queries use
+# nearest_indices and within_radius instead
+def distances_from(
+    latitude: float,
+    longitude: float,
+    coordinates: CoordinateArray,
+    accuracy: Accuracy = Accuracy.exact,
+) -> array:
+    if accuracy == Accuracy.fast:
+        return haversine_many(latitude, longitude, coordinates)
+    return geodesic_many(latitude, longitude, coordinates)
+
+
+# Indices of the k smallest distances, closest first. Uses a bounded heap instead of
+# sorting everything; ties keep their original order.
+def top_k(distances: Sequence[float], k: int) -> List[int]:
+    if k <= 0:
+        return []
+    if k >= len(distances):
+        return sorted(range(len(distances)), key=distances.__getitem__)
+    return heapq.nsmallest(k, range(len(distances)), key=distances.__getitem__)
+
+
+# Indices of the k points closest to the origin. Exact queries rank everything with
+# haversine first and only compute geodesics for the points that can still be among
+# the k closest on the ellipsoid, i.e. those within the k-th spherical distance
+# widened by ELLIPSOID_MARGIN.
+def nearest_indices(
+    latitude: float,
+    longitude: float,
+    coordinates: CoordinateArray,
+    k: int,
+    accuracy: Accuracy = Accuracy.exact,
+) -> List[int]:
+    distances = haversine_many(latitude, longitude, coordinates)
+    closest = top_k(distances, k)
+    if accuracy == Accuracy.fast or not closest:
+        return closest
+
+    limit = distances[closest[-1]] * ELLIPSOID_MARGIN
+    candidates = [i for i, distance in enumerate(distances) if distance <= limit]
+    exact = [
+        geodesic_km(
+            latitude, longitude, coordinates.latitudes[i], coordinates.longitudes[i]
+        )
+        for i in candidates
+    ]
+    return [candidates[j] for j in top_k(exact, k)]
+
+
+# (distance, index) of every point within radius_km of the origin, in index order.
+# Exact queries only compute geodesics for the points haversine puts within the
+# radius widened by ELLIPSOID_MARGIN.
+def within_radius(
+    latitude: float,
+    longitude: float,
+    coordinates: CoordinateArray,
+    radius_km: float,
+    accuracy: Accuracy = Accuracy.exact,
+) -> List[Tuple[float, int]]:
+    distances = haversine_many(latitude, longitude, coordinates)
+    if accuracy == Accuracy.fast:
+        return [(d, i) for i, d in enumerate(distances) if d <= radius_km]
+
+    limit = radius_km * ELLIPSOID_MARGIN
+    found = []
+    for i, distance in enumerate(distances):
+        if distance <= limit:
+            distance = geodesic_km(
+                latitude, longitude, coordinates.latitudes[i], coordinates.longitudes[i]
+            )
+            if distance <= radius_km:
+                found.append((distance, i))
+    return found
@@ -0,0 +1,224 @@
+import logging, re, threading, time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable, Dict, Optional, Protocol, Tuple
+
+from geopy.exc import GeopyError
+
+from .pool import ConnectionPool
+
+if TYPE_CHECKING:  # snapshot imports normalize_address from here
+    from .snapshot import TruckSnapshot
+
+logger = logging.getLogger(__name__)
+
+Coordinates = Tuple[float, float]
+
+
+class GeocodingUnavailable(Exception):
+    pass
+
+
+# Anything that can turn an address into coordinates
+class Geocoder(Protocol):
+    def geocode(self, address: str) -> Optional[Coordinates]: ...
+
+
+_ABBREVIATIONS = {
+    "STREET": "ST",
+    "AVENUE": "AVE",
+    "BOULEVARD": "BLVD",
+    "DRIVE": "DR",
+    "PLACE": "PL",
+    "ROAD": "RD",
+    "TERRACE": "TER",
+    "COURT": "CT",
+    "LANE": "LN",
+    "HIGHWAY": "HWY",
+}
+
+# Trailing address parts that don't narrow anything down inside San Francisco
+_REDUNDANT_PARTS = {"SAN FRANCISCO", "SF", "CA", "CALIFORNIA", "USA", "US"}
+_ZIP_CODE = re.compile(r"^\d{5}(-\d{4})?$")
+
+
+# Canonical form used for cache keys and offline lookups, so that
+# "90 Broadway, San Francisco, CA 94133" and "90 BROADWAY" are the same address
+def normalize_address(address: str) -> str:
+    parts = []
+    for part in address.upper().split(","):
+        words = re.sub(r"[^\w#/&-]+", " ", part).split()
+        words = [_ABBREVIATIONS.get(word, word) for word in words]
+        # "CA 94133" -> "CA"
+        if len(words) > 1 and _ZIP_CODE.match(words[-1]):
+            words = words[:-1]
+        if words:
+            parts.append(" ".join(words))
+    while len(parts) > 1 and (
+        parts[-1] in _REDUNDANT_PARTS or _ZIP_CODE.match(parts[-1])
+    ):
+        parts.pop()
+    return ", ".join(parts)
+
+
+# Resolves addresses we already know about from the food_trucks table without any
+# network access. snapshot returns the current TruckSnapshot, whose address index
+# every write patches, so moved and deleted trucks don't linger.
+class OfflineGeocoder:
+    def __init__(self, snapshot: Callable[[], "TruckSnapshot"]):
+        self.snapshot = snapshot
+
+    def geocode(self, address: str) -> Optional[Coordinates]:
+        return self.snapshot().address_coordinates(normalize_address(address))
+
+
+# Nominatim (OpenStreetMap), the public online geocoder. The geopy client is only
+# created the first time an address actually has to go over the network.
+class NominatimGeocoder:
+    def __init__(self, user_agent: str = "address_finder", timeout: float = 5.0):
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self._client = None
+
+    def geocode(self, address: str) -> Optional[Coordinates]:
+        if self._client is None:
+            from geopy.geocoders import Nominatim
+
+            self._client = Nominatim(user_agent=self.user_agent, timeout=self.timeout)
+        location = self._client.geocode(address)
+        if location:
+            return (location.latitude, location.longitude)
+        return None
+
+
+# LRU of normalized address -> coordinates with a TTL, backed by a SQLite table so it
+# survives restarts. A None value is a negative entry: the address didn't resolve.
+# The table keeps at most max_rows entries, the ones expiring first are dropped.
+class GeocodeCache:
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        maxsize: int = 10000,
+        ttl: float = 30 * 24 * 3600,
+        negative_ttl: float = 24 * 3600,
+        max_rows: int = 100000,
+    ):
+        self.pool = pool
+        self.maxsize = maxsize
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries: "OrderedDict[str, Tuple[Optional[Coordinates], float]]" = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+        self._table_ready = False
+
+    def _ensure_table(self):
+        if not self._table_ready:
+            with self.pool.writer() as conn:
+                conn.executescript(
+                    """CREATE TABLE IF NOT EXISTS geocode_cache (
+                            address TEXT PRIMARY KEY,
+                            latitude REAL,
+                            longitude REAL,
+                            expires_at REAL
+                            );
+                       CREATE INDEX IF NOT EXISTS idx_geocode_cache_expires_at
+                            ON geocode_cache (expires_at);"""
+                )
+            self._table_ready = True
+
+    def _remember(self, key: str, value: Optional[Coordinates], expires_at: float):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    # Returns (hit, coordinates); a hit with None coordinates is a cached miss
+    def get(self, key: str) -> Tuple[bool, Optional[Coordinates]]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(key)
+                    return True, entry[0]
+                del self._entries[key]
+
+        self._ensure_table()
+        with self.pool.reader() as conn:
+            row = conn.execute(
+                """SELECT latitude, longitude, expires_at FROM geocode_cache
+                   WHERE address = ? AND expires_at > ?""",
+                (key, now),
+            ).fetchone()
+        if row is None:
+            return False, None
+        value = None if row[0] is None else (row[0], row[1])
+        self._remember(key, value, row[2])
+        return True, value
+
+    def put(self, key: str, value: Optional[Coordinates]):
+        expires_at = time.time() + (self.ttl if value else self.negative_ttl)
+        self._remember(key, value, expires_at)
+        self._ensure_table()
+        latitude, longitude = value if value else (None, None)
+        with self.pool.writer() as conn:
+            conn.execute(
+                """INSERT OR REPLACE INTO geocode_cache
+                   (address, latitude, longitude, expires_at) VALUES (?, ?, ?, ?)""",
+                (key, latitude, longitude, expires_at),
+            )
+            # Only online answers get here, so counting the rows is cheap by comparison
+            conn.execute(
+                """DELETE FROM geocode_cache WHERE address IN (
+                       SELECT address FROM geocode_cache ORDER BY expires_at
+                       LIMIT max(0, (SELECT count(*) FROM geocode_cache) - ?))""",
+                (self.max_rows,),
+            )
+
+    def purge_expired(self) -> int:
+        self._ensure_table()
+        with self.pool.writer() as conn:
+            return conn.execute(
+                "DELETE FROM geocode_cache WHERE expires_at <= ?", (time.time(),)
+            ).rowcount
+
+
+# Looks an address up in the offline geocoder first, then in the cache, and only then
+# asks the online geocoder. Online answers, including "not found", are cached.
+class GeocodingService:
+    def __init__(
+        self,
+        cache: GeocodeCache,
+        offline: Optional[Geocoder] = None,
+        online: Optional[Geocoder] = None,
+    ):
+        self.cache = cache
+        self.offline = offline
+        self.online = online
+
+    def geocode(self, address: str) -> Optional[Coordinates]:
+        key = normalize_address(address)
+        if not key:
+            return None
+
+        if self.offline is not None:
+            coordinates = self.offline.geocode(key)
+            if coordinates is not None:
+                return coordinates
+
+        hit, coordinates = self.cache.get(key)
+        if hit or self.online is None:
+            return coordinates
+
+        try:
+            coordinates = self.online.geocode(address)
+        except GeopyError as error:
+            # Not cached, the address may well resolve once the service is back
+            logger.warning("Geocoding %r failed: %s", address, error)
+            raise GeocodingUnavailable(str(error)) from error
+
+        self.cache.put(key, coordinates)
+        return coordinates
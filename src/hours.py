@@ -0,0 +1,124 @@
+# Opening hours from the free-text dayshours column, e.g. "Mo-We:7AM-7PM" or
+# "Tu/We/Th:12AM-3AM;Mo-We:12PM-12AM", as intervals of minutes since Monday 00:00. They
+# are parsed once when a row is written and stored in the food_truck_hours table, one
+# row per truck, weekday and interval, which is what "open at" queries search.
+import re
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from .ingest import COLUMNS
+
+DAYS = ("Mo", "Tu", "We", "Th", "Fr", "Sa", "Su")
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+# The permits give San Francisco local times
+TIMEZONE = ZoneInfo("America/Los_Angeles")
+
+DAYSHOURS = COLUMNS.index("dayshours")
+
+_TIME = re.compile(r"(\d{1,2})(?::(\d{2}))?\s*(AM|PM)", re.IGNORECASE)
+
+Interval = Tuple[int, int]
+
+
+def _minute_of_day(text: str) -> int:
+    match = _TIME.fullmatch(text.strip())
+    if match is None:
+        raise ValueError(f"invalid time: {text!r}")
+    hour, minute = int(match[1]), int(match[2] or 0)
+    if not 1 <= hour <= 12 or minute >= 60:
+        raise ValueError(f"invalid time: {text!r}")
+    return (hour % 12 + (12 if match[3].upper() == "PM" else 0)) * 60 + minute
+
+
+def _day(text: str) -> int:
+    try:
+        return DAYS.index(text.strip().title())
+    except ValueError:
+        raise ValueError(f"invalid day: {text!r}") from None
+
+
+# "Mo/We/Fr" or "Mo-Fr", ranges may wrap around the week, e.g. "Sa-Mo"
+def _days(text: str) -> List[int]:
+    days = []
+    for part in text.split("/"):
+        first, _, last = part.partition("-")
+        start = _day(first)
+        end = _day(last) if last else start
+        days.extend((start + i) % 7 for i in range((end - start) % 7 + 1))
+    return days
+
+
+# Sorted, non-overlapping intervals within the week. An interval running past Sunday
+# midnight continues on Monday morning.
+def _merge(intervals: Iterable[Interval]) -> List[Interval]:
+    wrapped = []
+    for start, end in intervals:
+        if end > MINUTES_PER_WEEK:
+            wrapped.append((start, MINUTES_PER_WEEK))
+            wrapped.append((0, end - MINUTES_PER_WEEK))
+        else:
+            wrapped.append((start, end))
+    merged: List[Interval] = []
+    for start, end in sorted(wrapped):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+# Raises ValueError if any part of text can't be read
+def parse_dayshours(text: str) -> List[Interval]:
+    intervals = []
+    for group in text.split(";"):
+        if not group.strip():
+            continue
+        days, separator, times = group.partition(":")
+        if not separator:
+            raise ValueError(f"missing hours: {group!r}")
+        for time_range in times.split("/"):
+            opens, separator, closes = time_range.partition("-")
+            if not separator:
+                raise ValueError(f"invalid hours: {time_range!r}")
+            start, end = _minute_of_day(opens), _minute_of_day(closes)
+            # Closing at or before the opening time means closing the next day,
+            # e.g. 8PM-2AM or 12PM-12AM
+            if end <= start:
+                end += MINUTES_PER_DAY
+            for day in _days(days):
+                offset = day * MINUTES_PER_DAY
+                intervals.append((offset + start, offset + end))
+    return _merge(intervals)
+
+
+# Opening hours of a truck; empty when they are unknown or can't be read, so the truck
+# never counts as open
+def weekly_hours(dayshours: Optional[str]) -> List[Interval]:
+    if not dayshours:
+        return []
+    try:
+        return parse_dayshours(dayshours)
+    except ValueError:
+        return []
+
+
+# (location_id, weekday, start_minute, end_minute) rows for food_truck_hours. Intervals
+# are split at midnight so that every row belongs to a single weekday.
+def hours_rows(rows: Iterable[tuple]) -> Iterator[Tuple[int, int, int, int]]:
+    for row in rows:
+        for start, end in weekly_hours(row[DAYSHOURS]):
+            while start < end:
+                day = start // MINUTES_PER_DAY
+                day_end = min(end, (day + 1) * MINUTES_PER_DAY)
+                yield row[0], day, start, day_end
+                start = day_end
+
+
+# Minutes since Monday 00:00 in San Francisco. Times without a time zone are taken to
+# be local already.
+def minute_of_week(when: datetime) -> int:
+    if when.tzinfo is not None:
+        when = when.astimezone(TIMEZONE)
+    return when.weekday() * MINUTES_PER_DAY + when.hour * 60 + when.minute
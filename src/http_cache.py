@@ -0,0 +1,87 @@
+import gzip
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Mapping, Optional
+
+try:
+    import brotli
+except ImportError:  # optional, responses are only gzipped without it
+    brotli = None
+
+# Responses smaller than this aren't worth compressing
+COMPRESS_MIN_SIZE = 1024
+
+
+# Validators derived from the data version. Every write bumps the version, so a
+# client holding the current ETag has exactly what the server would send again. The
+# modification time is part of it so a rebuilt database never reuses an old ETag.
+def etag(version: int, modified_at: float) -> str:
+    return f'W/"{version}-{int(modified_at * 1000)}"'
+
+
+def http_date(timestamp: float) -> str:
+    return formatdate(timestamp, usegmt=True)
+
+
+def cache_headers(
+    version: int, modified_at: float, max_age: int = 0
+) -> Mapping[str, str]:
+    return {
+        "ETag": etag(version, modified_at),
+        "Last-Modified": http_date(modified_at),
+        # max-age 0 still lets clients keep the body, they just revalidate every time
+        "Cache-Control": f"public, max-age={max_age}" if max_age else "no-cache",
+        "X-Data-Version": str(version),
+    }
+
+
+# Conditional GET: If-None-Match wins over If-Modified-Since when both are sent
+def is_not_modified(
+    headers: Mapping[str, str], version: int, modified_at: float
+) -> bool:
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {tag.strip() for tag in if_none_match.split(",")}
+        return "*" in tags or etag(version, modified_at) in tags
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        # HTTP dates only have second precision
+        return int(modified_at) <= since
+    return False
+
+
+# Weight of an Accept-Encoding entry such as "gzip;q=0.5". Entries without a q are
+# fully accepted; ones with a malformed q are treated as refused.
+def _quality(params) -> float:
+    for param in params:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                return float(value.strip())
+            except ValueError:
+                return 0.0
+    return 1.0
+
+
+# Best encoding the client accepts: brotli if it's installed, then gzip. A q of 0
+# means the client refuses that coding.
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = set()
+    for part in accept_encoding.split(","):
+        coding, *params = part.split(";")
+        if _quality(params) > 0:
+            accepted.add(coding.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
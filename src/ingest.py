@@ -0,0 +1,121 @@
+import csv, hashlib
+from typing import Iterator, List, Optional, Sequence, TextIO, Tuple
+
+from pydantic import BaseModel
+
+
+# Some of the columns are empty, so we need to handle that
+def to_float(value: str) -> float:
+    return float(value) if value.strip() else 0.0
+
+
+def to_int(value: str) -> int:
+    return int(value) if value.strip() else 0
+
+
+# CSV header and converter for every column of the food_trucks table, in table order
+CSV_FIELDS = [
+    ("location_id", "location_id", to_int),
+    ("applicant", "Applicant", str),
+    ("facility_type", "FacilityType", str),
+    ("cnn", "cnn", to_int),
+    ("location_description", "LocationDescription", str),
+    ("address", "Address", str),
+    ("blocklot", "blocklot", str),
+    ("block", "block", str),
+    ("lot", "lot", str),
+    ("permit", "permit", str),
+    ("status", "Status", str),
+    ("food_items", "FoodItems", str),
+    ("x", "X", to_float),
+    ("y", "Y", to_float),
+    ("latitude", "Latitude", to_float),
+    ("longitude", "Longitude", to_float),
+    ("schedule", "Schedule", str),
+    ("dayshours", "dayshours", str),
+    ("NOISent", "NOISent", str),
+    ("approved", "Approved", str),
+    ("received", "Received", str),
+    ("prior_permit", "PriorPermit", str),
+    ("expiration_date", "ExpirationDate", str),
+    ("location", "Location", str),
+    ("fire_prevention_districts", "Fire Prevention Districts", to_int),
+    ("police_districts", "Police Districts", to_int),
+    ("supervisor_districts", "Supervisor Districts", to_int),
+    ("zip_codes", "Zip Codes", to_int),
+    ("neighborhoods_old", "Neighborhoods (old)", to_int),
+]
+
+COLUMNS = [column for column, _, _ in CSV_FIELDS]
+
+LATITUDE = COLUMNS.index("latitude")
+LONGITUDE = COLUMNS.index("longitude")
+
+
+class RejectedRow(BaseModel):
+    line: int
+    location_id: Optional[str]
+    reason: str
+
+
+class IngestReport(BaseModel):
+    inserted: int = 0
+    rejected: List[RejectedRow] = []
+
+
+def check_coordinates(latitude: float, longitude: float):
+    if not -90.0 <= latitude <= 90.0:
+        raise ValueError(f"latitude out of range: {latitude}")
+    if not -180.0 <= longitude <= 180.0:
+        raise ValueError(f"longitude out of range: {longitude}")
+
+
+# Converts one CSV row straight into a tuple of column values. This replaces building a
+# full FoodTruck model per row: only the numeric columns can actually be invalid.
+def parse_row(row: dict) -> tuple:
+    if not (row.get("location_id") or "").strip():
+        raise ValueError("missing location_id")
+
+    values = []
+    for column, header, convert in CSV_FIELDS:
+        value = row.get(header) or ""
+        try:
+            values.append(convert(value))
+        except ValueError:
+            raise ValueError(f"invalid {column}: {value!r}") from None
+
+    check_coordinates(values[LATITUDE], values[LONGITUDE])
+    return tuple(values)
+
+
+# Fingerprint of a row's column values, used to tell which rows changed between two
+# copies of the CSV. Rows read back from the table hash the same as freshly parsed ones.
+def row_hash(values: Sequence) -> str:
+    return hashlib.blake2b(
+        repr(tuple(values)).encode("utf-8"), digest_size=16
+    ).hexdigest()
+
+
+# Parses the CSV in batches of column tuples. Rows that fail validation are appended to
+# report.rejected along with their line number instead of aborting the load.
+def read_csv_batches(
+    file: TextIO, report: IngestReport, batch_size: int = 5000
+) -> Iterator[List[Tuple[int, tuple]]]:
+    csv_reader = csv.DictReader(file)
+    batch = []
+    for row in csv_reader:
+        try:
+            batch.append((csv_reader.line_num, parse_row(row)))
+        except ValueError as error:
+            report.rejected.append(
+                RejectedRow(
+                    line=csv_reader.line_num,
+                    location_id=row.get("location_id"),
+                    reason=str(error),
+                )
+            )
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
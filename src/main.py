@@ -1,89 +1,491 @@
-import os
+import asyncio, logging, os, time
+from contextlib import asynccontextmanager, nullcontext
+from datetime import datetime
+from enum import Enum
+from typing import List, Optional, Tuple
+
+from fastapi import Body, Depends, FastAPI, HTTPException, Query, Request, status
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import (
+    JSONResponse,
+    PlainTextResponse,
+    Response,
+    StreamingResponse,
+)
+from pydantic import BaseModel, Field, model_validator
+
+from .async_db import AsyncDatabase, BoundedExecutor, QueryTimeout
+from .database import (
+    BatchResult,
+    BatchStatus,
+    Database,
+    FoodTruck,
+    StaleCursor,
+    TruckFilter,
+)
+from .geo import (
+    ELLIPSOID_MARGIN,
+    Accuracy,
+    CoordinateArray,
+    bounding_box,
+    nearest_indices,
+    within_radius,
+)
+from .geocoding import (
+    Coordinates,
+    GeocodeCache,
+    GeocodingService,
+    GeocodingUnavailable,
+    NominatimGeocoder,
+    OfflineGeocoder,
+    normalize_address,
+)
+from .hours import minute_of_week
+from .http_cache import (
+    COMPRESS_MIN_SIZE,
+    cache_headers,
+    choose_encoding,
+    is_not_modified,
+)
+from .ingest import COLUMNS
+from .metrics import (
+    HTTP_ERRORS,
+    HTTP_LATENCY,
+    HTTP_REQUESTS,
+    REGISTRY,
+    CallbackGauge,
+    span,
+)
+from .profiler import SamplingProfiler, current_profiler, profiled
+from .result_cache import ResultCache, SingleFlight, geohash
+from .snapshot import TruckSnapshot, dump_json
+from .spatial import GridIndex
+from .startup import prepare
 
-from fastapi import FastAPI, HTTPException, Query, status
-from fastapi.responses import JSONResponse
-from geopy.geocoders import Nominatim
-from geopy.distance import geodesic
 
-from .database import Database, FoodTruck
+CSV_FILE = "./data/Mobile_Food_Facility_Permit.csv"
+DB_FILE = "food_trucks.db"
+DB_POOL_SIZE = int(os.environ.get("ESTEE_DB_POOL_SIZE", 4))
+DB_QUERY_TIMEOUT = float(os.environ.get("ESTEE_DB_QUERY_TIMEOUT", 10))
+# Seconds clients may reuse a response without revalidating it
+CACHE_MAX_AGE = int(os.environ.get("ESTEE_CACHE_MAX_AGE", 0))
+# Set to 1 to let any request be profiled by adding ?profile=1
+PROFILING = os.environ.get("ESTEE_PROFILING", "0") == "1"
+# Set to 0 to only resolve addresses already known to the database or the cache
+GEOCODER_ONLINE = os.environ.get("ESTEE_GEOCODER_ONLINE", "1") != "0"
+# Set to 0 to keep the snapshot on each worker's heap instead of memory-mapping one
+# columnar copy of it shared by every worker
+SHARED_SNAPSHOT = os.environ.get("ESTEE_SHARED_SNAPSHOT", "1") != "0"
+# Closest-truck results are shared by requests from the same geohash cell of this
+# precision (8 is about 38 x 19 m, 0 only shares them between identical coordinates)
+CLOSEST_CACHE_PRECISION = int(os.environ.get("ESTEE_CLOSEST_CACHE_PRECISION", 8))
+CLOSEST_CACHE_SIZE = int(os.environ.get("ESTEE_CLOSEST_CACHE_SIZE", 10000))
+# Days deletions stay in the change feed; older cursors have to start over
+CHANGE_RETENTION_DAYS = float(os.environ.get("ESTEE_CHANGE_RETENTION_DAYS", 30))
+
+# Shows up next to uvicorn's own startup messages
+logger = logging.getLogger("uvicorn.error")
+
+# Nothing below touches the disk or the network at import time: connections are opened
+# on first use and the database is prepared by the lifespan hook
+db = Database(
+    DB_FILE,
+    pool_size=DB_POOL_SIZE,
+    columnar_file=f"{DB_FILE}.columns" if SHARED_SNAPSHOT else None,
+)
+
+# Database calls and distance math run on their own bounded thread pools so a slow
+# query never stalls the event loop. One extra worker is kept for the writer.
+adb = AsyncDatabase(db, max_workers=DB_POOL_SIZE + 1, timeout=DB_QUERY_TIMEOUT)
+compute = BoundedExecutor(
+    max_workers=os.cpu_count() or 1, timeout=None, name="estee-compute"
+)
+
+# Responses of /food_trucks/closest/ by origin cell and query, see src/result_cache.py
+closest_cache = ResultCache(maxsize=CLOSEST_CACHE_SIZE)
+# Concurrent lookups of the same address share one geocoder call
+geocode_flights = SingleFlight()
+
+# Seconds each startup phase took in this process, see StartupReport
+startup_seconds = {}
+
+
+# Builds the database from the CSV if there is none (only one of several workers
+# starting together does, the others wait for it), migrates an existing one and loads
+# the snapshot and spatial index before the first request is accepted. Old deletions
+# in the change log and expired geocoder cache entries are cleaned up as well.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    report = await asyncio.to_thread(prepare, db, CSV_FILE)
+    startup_seconds.update(report.seconds)
+    await asyncio.to_thread(db.compact_changes, CHANGE_RETENTION_DAYS * 24 * 3600)
+    await asyncio.to_thread(geolocator.cache.purge_expired)
+    logger.info(
+        "Ready in %.3fs: %d food trucks at data version %d%s (%s)",
+        report.total_seconds,
+        report.rows,
+        report.version,
+        ", built from the CSV" if report.built else "",
+        ", ".join(
+            f"{phase} {seconds:.3f}s" for phase, seconds in report.seconds.items()
+        ),
+    )
+    yield
+    await asyncio.to_thread(db.checkpoint)
+
+
+app = FastAPI(lifespan=lifespan)
+# Everything else above the threshold is gzipped on the way out, streams included
+app.add_middleware(GZipMiddleware, minimum_size=COMPRESS_MIN_SIZE, compresslevel=6)
+
+# Connection pool counters and the data version, read whenever /metrics is scraped
+REGISTRY.register(
+    CallbackGauge(
+        "estee_db_pool",
+        "Connection pool counters, see PoolStats",
+        lambda: {(field,): value for field, value in db.pool_stats()},
+        ("stat",),
+    )
+)
+REGISTRY.register(
+    CallbackGauge(
+        "estee_data_version",
+        "Data version served by this process",
+        lambda: {(): db.version},
+    )
+)
+REGISTRY.register(
+    CallbackGauge(
+        "estee_closest_cache",
+        "Closest-truck result cache counters and hit ratio, see CacheStats",
+        lambda: {
+            (field,): value
+            for field, value in closest_cache.stats().model_dump().items()
+        },
+        ("stat",),
+    )
+)
+REGISTRY.register(
+    CallbackGauge(
+        "estee_geocode_coalesced",
+        "Address lookups that waited for an identical one already in flight",
+        lambda: {(): geocode_flights.coalesced},
+    )
+)
+REGISTRY.register(
+    CallbackGauge(
+        "estee_startup_seconds",
+        "Time each startup phase took in this process",
+        lambda: {(phase,): seconds for phase, seconds in startup_seconds.items()},
+        ("phase",),
+    )
+)
+
+# Initialize the geolocator, which will be used to get the coordinates of the address provided by the user.
+# Addresses of known trucks resolve offline, everything else goes through a persistent cache to Nominatim.
+# None of them do any work until the first address is looked up.
+geolocator = GeocodingService(
+    cache=GeocodeCache(db.pool),
+    offline=OfflineGeocoder(db.get_snapshot),
+    online=NominatimGeocoder(user_agent="address_finder") if GEOCODER_ONLINE else None,
+)
+
+
+@app.exception_handler(QueryTimeout)
+async def query_timeout_handler(request: Request, exc: QueryTimeout):
+    return JSONResponse(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+        content={"detail": "Database query timed out"},
+    )
+
+
+# Route template the request matched, e.g. /food_trucks/{location_id}, so that
+# metrics don't get a label per truck
+def route_label(request: Request) -> str:
+    route = request.scope.get("route")
+    return getattr(route, "path", "unmatched")
+
+
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    profiler = token = None
+    if PROFILING and request.query_params.get("profile") == "1":
+        # Samples only this request's threads: the event loop and the workers while
+        # they run its jobs
+        profiler = SamplingProfiler(all_threads=False)
+        token = current_profiler.set(profiler)
+        profiler.start()
+    try:
+        with profiler.thread() if profiler is not None else nullcontext():
+            response = await call_next(request)
+    except Exception:
+        HTTP_ERRORS.inc(method=request.method, route=route_label(request))
+        HTTP_REQUESTS.inc(
+            method=request.method, route=route_label(request), status="500"
+        )
+        raise
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            current_profiler.reset(token)
+        HTTP_LATENCY.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=route_label(request),
+        )
+    route = route_label(request)
+    HTTP_REQUESTS.inc(
+        method=request.method, route=route, status=str(response.status_code)
+    )
+    if response.status_code >= 500:
+        HTTP_ERRORS.inc(method=request.method, route=route)
+    if profiler is not None:
+        # The profile replaces the response, as collapsed stacks for a flame graph
+        return PlainTextResponse(
+            profiler.collapsed(),
+            headers={
+                "X-Profile-Samples": str(profiler.samples),
+                "X-Profiled-Status": str(response.status_code),
+            },
+        )
+    return response
 
 
-app = FastAPI()
-db = Database("food_trucks.db")
+# Prometheus text format
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
-CSV_FILE = "./data/Mobile_Food_Facility_Permit.csv"
-DB_FILE = "food_trucks.db"
 
-# Check if the database file exists, if not, create it
-# We are using SQLite just for demonstration purposes and ease of use
-if not os.path.exists(DB_FILE):
-    if not os.path.exists(CSV_FILE):
-        raise FileNotFoundError(
-            f"File {CSV_FILE} not found. Please download the file from https://data.sfgov.org/api/views/rqzj-sfat/rows.csv and place it in the data directory."
+async def get_coordinates(address, geolocator):
+    # Cache lookups hit SQLite and Nominatim is a blocking network call
+    try:
+        with span("geocode"):
+            return await geocode_flights.run(
+                (geolocator, normalize_address(address)),
+                lambda: asyncio.to_thread(profiled(geolocator.geocode), address),
+            )
+    except GeocodingUnavailable:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Geocoding service unavailable",
         )
-    db.create_database(CSV_FILE)
 
-# Initialize the geolocator, which will be used to get the coordinates of the address provided by the user
-geolocator = Nominatim(user_agent="address_finder")
 
+async def find_closest_applicants(
+    truck_data, user_coordinates, num_closest=3, accuracy: Accuracy = Accuracy.exact
+):
+    (closest,) = await find_closest_applicants_many(
+        truck_data, [user_coordinates], num_closest, accuracy
+    )
+    return closest
 
-async def get_coordinates(address, geolocator):
-    location = geolocator.geocode(address)
-    if location:
-        return (location.latitude, location.longitude)
-    else:
-        return None
 
+ORIGIN_CHUNK_SIZE = 256
 
-# Use the geopy library to calculate the distance between the user and all the food trucks
-async def calculate_distances(user_coordinates, all_truck_data):
-    return [
-        geodesic(
-            user_coordinates, (truck_data["latitude"], truck_data["longitude"])
-        ).kilometers
-        for truck_data in all_truck_data
-    ]
+
+# The closest trucks for each of many origins. The truck coordinates are packed once
+# and shared by every origin; origins are ranked a chunk at a time on the compute pool,
+# so only one chunk's distance rows are ever alive.
+async def find_closest_applicants_many(
+    truck_data,
+    origins,
+    num_closest=3,
+    accuracy: Accuracy = Accuracy.exact,
+    chunk_size: int = ORIGIN_CHUNK_SIZE,
+):
+    coordinates = await compute.run(CoordinateArray.from_trucks, truck_data)
+
+    # Partial selection of the num_closest smallest distances, no full sort needed
+    def closest(chunk):
+        return [
+            nearest_indices(lat, lon, coordinates, num_closest, accuracy)
+            for lat, lon in chunk
+        ]
+
+    results = []
+    with span("distances"):
+        for start in range(0, len(origins), chunk_size):
+            chunk = origins[start : start + chunk_size]
+            for indices in await compute.run(closest, chunk):
+                results.append([truck_data[idx] for idx in indices])
+    return results
 
 
-async def find_closest_applicants(truck_data, user_coordinates, num_closest=3):
-    # Calculate distances between target address and all other addresses
-    target_distances = await calculate_distances(user_coordinates, truck_data)
+# Responses served from the in-memory snapshot say which version of the data they saw
+def snapshot_headers(snapshot: TruckSnapshot) -> dict:
+    return {"X-Data-Version": str(snapshot.version)}
 
-    # Create pairs of (distance, index)
-    distance_indices = list(enumerate(target_distances))
 
-    # Sort the distance-index pairs based on distances
-    distance_indices.sort(key=lambda x: x[1])
+# Responses that only depend on the data version can be revalidated with the
+# snapshot's ETag and Last-Modified
+def validator_headers(snapshot: TruckSnapshot) -> dict:
+    return dict(cache_headers(snapshot.version, snapshot.modified_at, CACHE_MAX_AGE))
 
-    # Get the indices of the top num_closest applicants
-    closest_indices = [idx for idx, _ in distance_indices[:num_closest]]
 
-    return [truck_data[idx] for idx in closest_indices]
+# 304 for a conditional GET the client already has the current answer to, decided
+# from the in-memory snapshot alone
+def not_modified(request: Request, snapshot: TruckSnapshot) -> Optional[Response]:
+    if is_not_modified(request.headers, snapshot.version, snapshot.modified_at):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED,
+            headers=validator_headers(snapshot),
+        )
+    return None
+
+
+class StreamFormat(str, Enum):
+    ndjson = "ndjson"
+    json = "json"
+
+
+SUMMARY_COLUMNS = ("applicant", "food_items", "address")
+OPEN_AT_DESCRIPTION = (
+    "Only trucks whose posted hours say they are open at this time, e.g. "
+    "2024-05-06T12:30 (San Francisco time unless an offset is given)"
+)
+STREAM_CHUNK_ROWS = 256
+
+
+# Encodes rows from a database cursor a chunk at a time, either as one JSON object
+# per line or as a JSON array that is never held in memory as a whole
+def stream_rows(rows, stream_format: StreamFormat):
+    chunk = []
+    first = True
+    if stream_format == StreamFormat.json:
+        yield b"["
+    for row in rows:
+        line = dump_json(dict(zip(SUMMARY_COLUMNS, row)))
+        if stream_format == StreamFormat.ndjson:
+            chunk.append(line + b"\n")
+        else:
+            chunk.append(line if first else b"," + line)
+            first = False
+        if len(chunk) >= STREAM_CHUNK_ROWS:
+            yield b"".join(chunk)
+            chunk = []
+    if chunk:
+        yield b"".join(chunk)
+    if stream_format == StreamFormat.json:
+        yield b"]"
 
 
 @app.get("/food_trucks/")
-async def get_food_trucks():
-    results = db.get_all_food_trucks()
-    # Extracting applicant (name of the truck) and food_items from each food truck
-    data = [
-        {
-            "applicant": truck.applicant,
-            "food_items": truck.food_items,
-            "address": truck.address,
-        }
-        for truck in results
-    ]
-
-    return data
+async def get_food_trucks(
+    request: Request,
+    limit: Optional[int] = Query(
+        None, ge=1, le=10000, description="Maximum number of trucks to return"
+    ),
+    after: Optional[int] = Query(
+        None, description="Only return trucks with a larger location_id (cursor)"
+    ),
+    stream: Optional[StreamFormat] = Query(
+        None, description="Stream rows from the database as ndjson or a json array"
+    ),
+    open_at: Optional[datetime] = Query(None, description=OPEN_AT_DESCRIPTION),
+):
+    if stream is not None and open_at is not None:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="open_at can't be combined with stream",
+        )
+    if stream is not None:
+        rows = db.iter_food_trucks(SUMMARY_COLUMNS, after=after, limit=limit)
+        media_type = (
+            "application/x-ndjson"
+            if stream == StreamFormat.ndjson
+            else "application/json"
+        )
+        return StreamingResponse(stream_rows(rows, stream), media_type=media_type)
+
+    snapshot = await adb.get_snapshot()
+    cached = not_modified(request, snapshot)
+    if cached is not None:
+        return cached
+    headers = validator_headers(snapshot)
+    if open_at is not None:
+        # Only the trucks open at that time, looked up in the opening hours index
+        filters = TruckFilter(open_at=minute_of_week(open_at))
+        rows = await adb.filter_food_trucks(
+            filters,
+            after,
+            None if limit is None else limit + 1,
+            ("location_id", *SUMMARY_COLUMNS),
+        )
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_after = rows[-1]["location_id"]
+            next_url = request.url.include_query_params(after=next_after)
+            headers["X-Next-After"] = str(next_after)
+            headers["Link"] = f'<{next_url}>; rel="next"'
+        content = dump_json(
+            [{column: row[column] for column in SUMMARY_COLUMNS} for row in rows]
+        )
+        return Response(content, media_type="application/json", headers=headers)
+    if limit is None and after is None:
+        # applicant (name of the truck), food_items and address of each food truck,
+        # serialized once per snapshot. The compressed body is cached alongside it, so
+        # the compression middleware leaves it alone.
+        content = await compute.run(snapshot.list_payload)
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""))
+        if encoding is not None and len(content) >= COMPRESS_MIN_SIZE:
+            content = await compute.run(snapshot.list_payload, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Vary"] = "Accept-Encoding"
+        return Response(content, media_type="application/json", headers=headers)
+
+    # Keyset pagination on location_id, the cursor for the next page is the last
+    # location_id of this one
+    start, end = snapshot.page(after, limit)
+    if end < len(snapshot) and end > start:
+        next_after = snapshot.location_ids[end - 1]
+        next_url = request.url.include_query_params(after=next_after)
+        headers["X-Next-After"] = str(next_after)
+        headers["Link"] = f'<{next_url}>; rel="next"'
+    content = dump_json([snapshot.summary(i) for i in range(start, end)])
+    return Response(content, media_type="application/json", headers=headers)
+
+
+# Trucks written or deleted after the cursor since, oldest first, so that clients can
+# keep a copy of the table in sync. Deletions come back with deleted set and no truck.
+# since=0 returns every truck, which is also how a client starts over after a 410.
+@app.get("/food_trucks/changes/")
+async def get_changes(
+    request: Request,
+    since: str = Query("0", description="X-Next-Since of the previous call"),
+    limit: int = Query(1000, ge=1, le=10000, description="Maximum number of changes"),
+):
+    try:
+        page = await adb.get_changes(since, limit + 1)
+    except StaleCursor as error:
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail=str(error))
+    changes = page.changes
+    headers = {"X-Last-Seq": str(page.last_seq)}
+    if len(changes) > limit:
+        changes = changes[:limit]
+        next_url = request.url.include_query_params(since=page.cursor(changes[-1].seq))
+        headers["Link"] = f'<{next_url}>; rel="next"'
+    headers["X-Next-Since"] = page.cursor(changes[-1].seq if changes else page.last_seq)
+    content = [change.model_dump() for change in changes]
+    return Response(dump_json(content), media_type="application/json", headers=headers)
 
 
 # Get a specific truck by its location_id
 @app.get("/food_trucks/{location_id}")
-async def get_food_truck(location_id: int):
-    food_truck = db.get_food_truck_by_id(location_id)
-    if food_truck is None:
+async def get_food_truck(request: Request, location_id: int):
+    snapshot = await adb.get_snapshot()
+    payload = snapshot.payload(location_id)
+    if payload is None:
         raise HTTPException(status_code=404, detail="Food truck not found")
-    return food_truck
+    cached = not_modified(request, snapshot)
+    if cached is not None:
+        return cached
+    return Response(
+        payload, media_type="application/json", headers=validator_headers(snapshot)
+    )
 
 
 # Get a specific truck by its name
@@ -91,21 +493,195 @@ async def get_food_truck(location_id: int):
 async def get_food_truck_by_name(
     name: str = Query(..., description="Name of the food truck")
 ):
-    results = db.get_food_truck_by_name(name)
+    # Every column, read as plain rows and serialized without building models
+    results = await adb.get_food_truck_by_name(name, COLUMNS)
     if not results:
         raise HTTPException(status_code=404, detail="Food truck not found")
-    return results
+    return Response(dump_json(results), media_type="application/json")
+
+
+# Query parameters shared by every endpoint that can be filtered. Each one can be
+# repeated, e.g. ?status=APPROVED&zip_codes=28855&zip_codes=28856
+def truck_filter(
+    status: Optional[List[str]] = Query(None, description="e.g. APPROVED"),
+    facility_type: Optional[List[str]] = Query(None, description="Truck or Push Cart"),
+    zip_codes: Optional[List[int]] = Query(None),
+    supervisor_districts: Optional[List[int]] = Query(None),
+    police_districts: Optional[List[int]] = Query(None),
+    food_item: Optional[List[str]] = Query(
+        None,
+        description="Trucks serving this item, e.g. tacos, see /food_trucks/facets/",
+    ),
+    open_at: Optional[datetime] = Query(None, description=OPEN_AT_DESCRIPTION),
+) -> TruckFilter:
+    return TruckFilter(
+        status=status,
+        facility_type=facility_type,
+        zip_codes=zip_codes,
+        supervisor_districts=supervisor_districts,
+        police_districts=police_districts,
+        food_item=food_item,
+        open_at=None if open_at is None else minute_of_week(open_at),
+    )
+
+
+# Trucks matching every given filter, in location_id order and paginated like
+# GET /food_trucks/
+@app.get("/food_trucks/filter/")
+async def filter_food_trucks(
+    request: Request,
+    filters: TruckFilter = Depends(truck_filter),
+    limit: int = Query(100, ge=1, le=10000, description="Maximum number of trucks"),
+    after: Optional[int] = Query(
+        None, description="Only return trucks with a larger location_id (cursor)"
+    ),
+):
+    snapshot = await adb.get_snapshot()
+    cached = not_modified(request, snapshot)
+    if cached is not None:
+        return cached
+
+    # One extra row tells us whether there is a next page
+    results = await adb.filter_food_trucks(filters, after, limit + 1, COLUMNS)
+    headers = validator_headers(snapshot)
+    if len(results) > limit:
+        results = results[:limit]
+        next_after = results[-1]["location_id"]
+        next_url = request.url.include_query_params(after=next_after)
+        headers["X-Next-After"] = str(next_after)
+        headers["Link"] = f'<{next_url}>; rel="next"'
+    return Response(dump_json(results), media_type="application/json", headers=headers)
+
+
+# How many trucks serve each food item, most common first. Optionally only counts the
+# trucks matching the filters and within radius_km of an address or lat/lon.
+@app.get("/food_trucks/facets/")
+async def food_item_facets(
+    request: Request,
+    limit: int = Query(50, ge=1, le=10000, description="Maximum number of items"),
+    radius_km: Optional[float] = Query(
+        None, gt=0, le=100, description="Only count trucks within this radius"
+    ),
+    address: Optional[str] = Query(None, description="Center of the radius"),
+    lat: Optional[float] = Query(None, ge=-90, le=90, description="Center latitude"),
+    lon: Optional[float] = Query(None, ge=-180, le=180, description="Center longitude"),
+    accuracy: Accuracy = Query(
+        Accuracy.exact,
+        description="fast: spherical approximation, exact: WGS-84 ellipsoid",
+    ),
+    filters: TruckFilter = Depends(truck_filter),
+):
+    snapshot = await adb.get_snapshot()
+    if radius_km is None:
+        if address is not None or lat is not None or lon is not None:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="A location needs a radius_km",
+            )
+        cached = not_modified(request, snapshot)
+        if cached is not None:
+            return cached
+        facets = await adb.food_item_facets(filters, limit=limit)
+        headers = validator_headers(snapshot)
+    else:
+        user_coordinates = await resolve_origin(address, lat, lon)
+        box = bounding_box(*user_coordinates, radius_km * ELLIPSOID_MARGIN)
+        candidates = await adb.filter_coordinates(filters, box)
+
+        def in_range():
+            coordinates = CoordinateArray(
+                (row[1] for row in candidates), (row[2] for row in candidates)
+            )
+            found = within_radius(*user_coordinates, coordinates, radius_km, accuracy)
+            return [candidates[idx][0] for _, idx in found]
+
+        with span("distances"):
+            location_ids = await compute.run(in_range)
+        facets = await adb.food_item_facets(location_ids=location_ids, limit=limit)
+        headers = snapshot_headers(snapshot)
+    content = [{"item": name, "trucks": count} for name, count in facets]
+    return Response(dump_json(content), media_type="application/json", headers=headers)
+
+
+# Full-text search over names, food items and location descriptions, best matches first
+@app.get("/food_trucks/search/")
+async def search_food_trucks(
+    request: Request,
+    q: str = Query(..., description="Words to search for, e.g. tacos"),
+    limit: int = Query(20, ge=1, le=100, description="Maximum number of results"),
+    prefix: bool = Query(
+        False, description="Treat the last word as a prefix, for autocomplete"
+    ),
+):
+    snapshot = await adb.get_snapshot()
+    cached = not_modified(request, snapshot)
+    if cached is not None:
+        return cached
+    results = await adb.search_food_trucks(q, limit, prefix)
+    return JSONResponse(
+        content=[result.model_dump() for result in results],
+        headers=validator_headers(snapshot),
+    )
 
 
 @app.post("/food_trucks/")
 async def create_food_truck(food_truck: FoodTruck):
-    db.insert_food_truck(food_truck)
+    await adb.insert_food_truck(food_truck)
     return food_truck
 
 
+class BatchMode(str, Enum):
+    # Nothing is written unless every item is valid
+    atomic = "atomic"
+    # Valid items are written, invalid ones are reported
+    best_effort = "best_effort"
+
+
+MAX_BATCH_SIZE = 10000
+
+
+# Batch writes apply a whole array in one transaction, with one result per item in
+# request order. A rejected atomic batch is answered with 409 and the same results.
+def batch_response(result: BatchResult, mode: BatchMode) -> JSONResponse:
+    rejected = mode == BatchMode.atomic and any(
+        item.status == BatchStatus.failed for item in result.results
+    )
+    return JSONResponse(
+        content=result.model_dump(mode="json"),
+        status_code=status.HTTP_409_CONFLICT if rejected else status.HTTP_200_OK,
+    )
+
+
+@app.post("/food_trucks/batch/")
+async def create_food_trucks(
+    food_trucks: List[FoodTruck] = Body(..., max_length=MAX_BATCH_SIZE),
+    mode: BatchMode = Query(BatchMode.atomic),
+):
+    result = await adb.insert_food_trucks(food_trucks, mode == BatchMode.atomic)
+    return batch_response(result, mode)
+
+
+@app.put("/food_trucks/batch/")
+async def update_food_trucks(
+    food_trucks: List[FoodTruck] = Body(..., max_length=MAX_BATCH_SIZE),
+    mode: BatchMode = Query(BatchMode.atomic),
+):
+    result = await adb.update_food_trucks(food_trucks, mode == BatchMode.atomic)
+    return batch_response(result, mode)
+
+
+@app.delete("/food_trucks/batch/")
+async def delete_food_trucks(
+    location_ids: List[int] = Body(..., max_length=MAX_BATCH_SIZE),
+    mode: BatchMode = Query(BatchMode.atomic),
+):
+    result = await adb.delete_food_trucks(location_ids, mode == BatchMode.atomic)
+    return batch_response(result, mode)
+
+
 @app.put("/food_trucks/{location_id}")
 async def update_food_truck(location_id: int, food_truck: FoodTruck):
-    updated_truck = db.update_food_truck(location_id, food_truck)
+    updated_truck = await adb.update_food_truck(location_id, food_truck)
     if updated_truck is None:
         raise HTTPException(status_code=404, detail="Food truck not found")
     return updated_truck
@@ -113,52 +689,268 @@ async def update_food_truck(location_id: int, food_truck: FoodTruck):
 
 @app.delete("/food_trucks/{location_id}")
 async def delete_food_truck(location_id: int):
-    deleted_truck = db.delete_food_truck(location_id)
+    deleted_truck = await adb.delete_food_truck(location_id)
     if deleted_truck is None:
         raise HTTPException(status_code=404, detail="Food truck not found")
     return status.HTTP_200_OK
 
 
 @app.get("/food_trucks/{location_id}/applicant_fooditems")
-async def get_food_truck_items(location_id: int):
-    food_truck = db.get_food_truck_by_id(location_id)
-    if food_truck is None:
+async def get_food_truck_items(request: Request, location_id: int):
+    snapshot = await adb.get_snapshot()
+    position = snapshot.position(location_id)
+    if position is None:
         raise HTTPException(status_code=404, detail="Food truck not found")
+    cached = not_modified(request, snapshot)
+    if cached is not None:
+        return cached
 
     # return food and location
-    data = {
-        "applicant": food_truck.applicant,
-        "food_items": food_truck.food_items,
-        "address": food_truck.address,
-        "latitude": food_truck.latitude,
-        "longitude": food_truck.longitude,
-    }
+    return JSONResponse(
+        content=snapshot.location(position), headers=validator_headers(snapshot)
+    )
+
+
+# Positions in the snapshot of the closest trucks to each origin. Without filters the
+# spatial index answers each origin; with filters the indexed columns narrow the
+# candidates down before any distance work. views are the snapshot and index to use,
+# the current ones if None.
+async def closest_positions(
+    origins: List[Coordinates],
+    num_closest: int,
+    accuracy: Accuracy,
+    filters: TruckFilter,
+    views: Optional[Tuple[TruckSnapshot, GridIndex]] = None,
+) -> Tuple[TruckSnapshot, List[List[int]]]:
+    snapshot, index = views if views is not None else await adb.get_views()
+    if filters.is_empty():
+        exact = accuracy == Accuracy.exact
+
+        def nearest(chunk):
+            return [
+                snapshot.positions(
+                    [idx for _, idx in index.nearest(lat, lon, num_closest, exact)]
+                )
+                for lat, lon in chunk
+            ]
+
+        positions = []
+        with span("spatial_index"):
+            for start in range(0, len(origins), ORIGIN_CHUNK_SIZE):
+                chunk = origins[start : start + ORIGIN_CHUNK_SIZE]
+                positions.extend(await compute.run(nearest, chunk))
+        return snapshot, positions
+
+    candidates = [
+        {"location_id": location_id, "latitude": lat, "longitude": lon}
+        for location_id, lat, lon in await adb.filter_coordinates(filters)
+    ]
+    closest = await find_closest_applicants_many(
+        candidates, origins, num_closest, accuracy
+    )
+    return snapshot, [
+        snapshot.positions([truck["location_id"] for truck in trucks])
+        for trucks in closest
+    ]
 
-    return JSONResponse(content=data)
 
+# Where a query is centered. Coordinates, e.g. from a phone's GPS, are used as they
+# are without any geocoding; otherwise the address is geocoded.
+async def resolve_origin(
+    address: Optional[str], lat: Optional[float], lon: Optional[float]
+) -> Coordinates:
+    if lat is not None and lon is not None:
+        return (lat, lon)
+    if address is None or lat is not None or lon is not None:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Give either an address or both lat and lon",
+        )
+    user_coordinates = await get_coordinates(address, geolocator)
+    if user_coordinates is None:
+        raise HTTPException(status_code=404, detail="Address not found")
+    return user_coordinates
 
-# Find the closest food trucks to the user's address using geopy and geodesic calculations
+
+# Find the closest food trucks to the user's address or coordinates, with exact
+# geodesic distances used to rank the final candidates
 @app.get("/food_trucks/closest/")
 async def find_closest_food_trucks(
-    address: str = Query(..., description="User's address"),
+    address: Optional[str] = Query(None, description="User's address"),
+    lat: Optional[float] = Query(None, ge=-90, le=90, description="User's latitude"),
+    lon: Optional[float] = Query(None, ge=-180, le=180, description="User's longitude"),
+    num_closest: int = Query(3, ge=1, le=100, description="Number of trucks"),
+    accuracy: Accuracy = Query(
+        Accuracy.exact,
+        description="fast: spherical approximation, exact: WGS-84 ellipsoid",
+    ),
+    filters: TruckFilter = Depends(truck_filter),
 ):
-    results = db.get_all_food_trucks()
-    if not results:
-        raise HTTPException(status_code=404, detail="Food trucks not found")
-
-    # Extracting name, food_items, and coordinates from each food truck
-    data = [
-        {
-            "applicant": truck.applicant,
-            "food_items": truck.food_items,
-            "address": truck.address,
-            "latitude": truck.latitude,
-            "longitude": truck.longitude,
-        }
-        for truck in results
-    ]
+    user_coordinates = await resolve_origin(address, lat, lon)
 
-    user_coordinates = await get_coordinates(address, geolocator)
-    closest_trucks = await find_closest_applicants(data, user_coordinates)
+    # The answer is computed on, and cached under the version of, the same snapshot
+    views = await adb.get_views()
+    snapshot = views[0]
 
-    return closest_trucks
+    async def closest():
+        _, (positions,) = await closest_positions(
+            [user_coordinates], num_closest, accuracy, filters, views
+        )
+        if not positions:
+            raise HTTPException(status_code=404, detail="Food trucks not found")
+        # Extracting name, food_items, and coordinates from each food truck
+        content = [snapshot.location(i) for i in positions]
+        return dump_json(content), snapshot_headers(snapshot)
+
+    # Everyone in the same cell asking the same question gets the answer computed for
+    # the first of them, for as long as the data version holds
+    key = (
+        (
+            geohash(*user_coordinates, CLOSEST_CACHE_PRECISION)
+            if CLOSEST_CACHE_PRECISION
+            else user_coordinates
+        ),
+        num_closest,
+        accuracy,
+        filters.model_dump_json(),
+    )
+    # Ordered by write time first, since a rebuilt database starts over at version 1
+    body, headers = await closest_cache.get_or_compute(
+        key, (snapshot.modified_at, snapshot.version), closest
+    )
+    return Response(body, media_type="application/json", headers=headers)
+
+
+class RadiusSort(str, Enum):
+    distance = "distance"
+    location_id = "location_id"
+
+
+# Every truck within radius_km of the user. A bounding box on the indexed latitude and
+# longitude columns picks the candidates before any exact distance is computed.
+@app.get("/food_trucks/radius/")
+async def find_food_trucks_within_radius(
+    radius_km: float = Query(..., gt=0, le=100, description="Search radius in km"),
+    address: Optional[str] = Query(None, description="User's address"),
+    lat: Optional[float] = Query(None, ge=-90, le=90, description="User's latitude"),
+    lon: Optional[float] = Query(None, ge=-180, le=180, description="User's longitude"),
+    limit: int = Query(100, ge=1, le=10000, description="Maximum number of trucks"),
+    sort: RadiusSort = Query(RadiusSort.distance),
+    accuracy: Accuracy = Query(
+        Accuracy.exact,
+        description="fast: spherical approximation, exact: WGS-84 ellipsoid",
+    ),
+    filters: TruckFilter = Depends(truck_filter),
+):
+    user_coordinates = await resolve_origin(address, lat, lon)
+
+    # The box is widened so it also holds everything within the radius on the ellipsoid
+    box = bounding_box(*user_coordinates, radius_km * ELLIPSOID_MARGIN)
+    snapshot = await adb.get_snapshot()
+    # Candidates are looked up in the snapshot the response is built from, so a truck
+    # a write removed in between is left out of the count as well as the body
+    positions = snapshot.positions(
+        [row[0] for row in await adb.filter_coordinates(filters, box)]
+    )
+
+    def rank():
+        coordinates = CoordinateArray(
+            (snapshot.latitudes[i] for i in positions),
+            (snapshot.longitudes[i] for i in positions),
+        )
+        found = within_radius(*user_coordinates, coordinates, radius_km, accuracy)
+        # Candidates come in location_id order, which breaks distance ties
+        if sort == RadiusSort.distance:
+            found.sort(key=lambda item: item[0])
+        return len(found), found[:limit]
+
+    with span("distances"):
+        total, found = await compute.run(rank)
+    content = [
+        {**snapshot.location(positions[idx]), "distance_km": round(distance, 4)}
+        for distance, idx in found
+    ]
+    headers = snapshot_headers(snapshot)
+    headers["X-Total-Count"] = str(total)
+    return JSONResponse(content=content, headers=headers)
+
+
+# Either an address or a latitude/longitude pair
+class Origin(BaseModel):
+    address: Optional[str] = None
+    latitude: Optional[float] = Field(None, ge=-90, le=90)
+    longitude: Optional[float] = Field(None, ge=-180, le=180)
+
+    @model_validator(mode="after")
+    def check_location(self):
+        coordinates = (self.latitude, self.longitude)
+        by_address = self.address is not None and coordinates == (None, None)
+        by_coordinates = self.address is None and None not in coordinates
+        if not (by_address or by_coordinates):
+            raise ValueError("give either an address or both latitude and longitude")
+        return self
+
+
+MAX_ORIGINS = 10000
+GEOCODE_CONCURRENCY = 8
+
+
+# Geocodes every distinct address once, a few at a time. Addresses that don't
+# resolve map to an error message instead.
+async def geocode_addresses(addresses) -> dict:
+    semaphore = asyncio.Semaphore(GEOCODE_CONCURRENCY)
+
+    async def geocode(address):
+        async with semaphore:
+            try:
+                with span("geocode"):
+                    coordinates = await asyncio.to_thread(
+                        profiled(geolocator.geocode), address
+                    )
+            except GeocodingUnavailable:
+                return "Geocoding service unavailable"
+        return coordinates if coordinates is not None else "Address not found"
+
+    addresses = list(dict.fromkeys(addresses))
+    return dict(zip(addresses, await asyncio.gather(*map(geocode, addresses))))
+
+
+# The closest trucks for each of many origins, in request order. Origins whose address
+# can't be resolved get an error and no trucks; the others are all answered from the
+# same snapshot.
+@app.post("/food_trucks/closest/batch/")
+async def find_closest_food_trucks_batch(
+    origins: List[Origin] = Body(..., max_length=MAX_ORIGINS),
+    num_closest: int = Query(3, ge=1, le=100, description="Trucks per origin"),
+    accuracy: Accuracy = Query(
+        Accuracy.exact,
+        description="fast: spherical approximation, exact: WGS-84 ellipsoid",
+    ),
+    filters: TruckFilter = Depends(truck_filter),
+):
+    geocoded = await geocode_addresses(
+        origin.address for origin in origins if origin.address is not None
+    )
+    located = []
+    for origin in origins:
+        if origin.address is None:
+            located.append((origin.latitude, origin.longitude))
+        else:
+            located.append(geocoded[origin.address])
+
+    valid = [coordinates for coordinates in located if isinstance(coordinates, tuple)]
+    snapshot, positions = await closest_positions(valid, num_closest, accuracy, filters)
+    answers = iter(positions)
+    content = []
+    for coordinates in located:
+        if isinstance(coordinates, str):
+            content.append({"error": coordinates, "trucks": []})
+            continue
+        content.append(
+            {
+                "latitude": coordinates[0],
+                "longitude": coordinates[1],
+                "trucks": [snapshot.location(i) for i in next(answers)],
+            }
+        )
+    return JSONResponse(content=content, headers=snapshot_headers(snapshot))
@@ -0,0 +1,263 @@
+import functools, inspect, threading, time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Mapping, Sequence, Tuple
+
+# Latency buckets in seconds, from a cached lookup up to a slow geocoder call
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(str(v))}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+# Minimal metric types rendered in the Prometheus text exposition format. Label values
+# are passed as keyword arguments, e.g. REQUESTS.inc(method="GET", route="/").
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Mapping[str, str]) -> Labels:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name} takes labels {', '.join(self.labelnames) or 'none'}"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterator[Tuple[str, Sequence[str], Labels, float]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for name, labelnames, values, value in self.samples():
+            labels = _format_labels(labelnames, values)
+            lines.append(f"{name}{labels} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield self.name, self.labelnames, key, value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: non-cumulative bucket counts (last one is +Inf), sum, count
+        self._values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][i] += 1
+            entry[1][0] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(self._key(labels))
+        return sum(entry[0]) if entry else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((k, (list(c), s[0])) for k, (c, s) in self._values.items())
+        bucket_labels = (*self.labelnames, "le")
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket", bucket_labels, (*key, le), cumulative
+            yield f"{self.name}_sum", self.labelnames, key, total
+            yield f"{self.name}_count", self.labelnames, key, cumulative
+
+
+# Gauge whose values are read from a callback at scrape time, e.g. the pool counters
+class CallbackGauge(Metric):
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name,
+        documentation,
+        callback: Callable[[], Mapping[Labels, float]],
+        labelnames=(),
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def samples(self):
+        for key, value in sorted(self.callback().items()):
+            yield self.name, self.labelnames, key, value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(
+    Counter(
+        "estee_http_requests_total",
+        "HTTP requests by route and status code",
+        ("method", "route", "status"),
+    )
+)
+HTTP_ERRORS = REGISTRY.register(
+    Counter(
+        "estee_http_request_errors_total",
+        "HTTP requests that failed with a 5xx or an unhandled exception",
+        ("method", "route"),
+    )
+)
+HTTP_LATENCY = REGISTRY.register(
+    Histogram(
+        "estee_http_request_duration_seconds",
+        "Time to produce the response, streaming bodies excluded",
+        ("method", "route"),
+    )
+)
+DB_LATENCY = REGISTRY.register(
+    Histogram(
+        "estee_db_call_duration_seconds",
+        "Time spent in each Database method",
+        ("method",),
+    )
+)
+DB_ERRORS = REGISTRY.register(
+    Counter(
+        "estee_db_call_errors_total",
+        "Database method calls that raised",
+        ("method",),
+    )
+)
+SPAN_LATENCY = REGISTRY.register(
+    Histogram(
+        "estee_span_duration_seconds",
+        "Time spent in named sections of a request, e.g. geocoding",
+        ("span",),
+    )
+)
+
+
+# Times a section of code, e.g. with span("geocode"): ...
+def span(name: str):
+    return SPAN_LATENCY.time(span=name)
+
+
+def _timed(fn, name: str):
+    if inspect.isgeneratorfunction(fn):
+        # A generator is timed until it is exhausted or closed, not just created
+        @functools.wraps(fn)
+        def generator(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                yield from fn(*args, **kwargs)
+            except Exception:
+                DB_ERRORS.inc(method=name)
+                raise
+            finally:
+                DB_LATENCY.observe(time.perf_counter() - start, method=name)
+
+        return generator
+
+    @functools.wraps(fn)
+    def call(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            DB_ERRORS.inc(method=name)
+            raise
+        finally:
+            DB_LATENCY.observe(time.perf_counter() - start, method=name)
+
+    return call
+
+
+# Class decorator that records the latency and errors of every public method
+def instrument_methods(cls):
+    for name, attr in list(vars(cls).items()):
+        if not name.startswith("_") and inspect.isfunction(attr):
+            setattr(cls, name, _timed(attr, name))
+    return cls
@@ -0,0 +1,190 @@
+import queue, sqlite3, threading, time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from pydantic import BaseModel
+
+
+class PoolStats(BaseModel):
+    size: int
+    open_readers: int
+    idle_readers: int
+    acquisitions: int
+    waits: int
+    total_wait_seconds: float
+    max_wait_seconds: float
+    writer_acquisitions: int
+    writer_total_wait_seconds: float
+    writer_max_wait_seconds: float
+
+
+# Long-lived SQLite connections shared by every Database call.
+# The database runs in WAL mode so readers never block on the writer: reads check a
+# connection out of a bounded queue of query-only connections, while all writes go
+# through a single writer connection guarded by a lock (SQLite only allows one writer
+# at a time anyway). Each connection keeps its own prepared-statement cache.
+class ConnectionPool:
+    def __init__(
+        self,
+        db_name: str,
+        size: int = 4,
+        busy_timeout: float = 5.0,
+        acquire_timeout: Optional[float] = 30.0,
+        statement_cache_size: int = 128,
+        wal_autocheckpoint: int = 1000,
+    ):
+        if size < 1:
+            raise ValueError("pool size must be at least 1")
+        self.db_name = db_name
+        self.size = size
+        self.busy_timeout = busy_timeout
+        self.acquire_timeout = acquire_timeout
+        self.statement_cache_size = statement_cache_size
+        self.wal_autocheckpoint = wal_autocheckpoint
+
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._readers: List[sqlite3.Connection] = []
+        self._writer: Optional[sqlite3.Connection] = None
+        self._writer_lock = threading.Lock()
+        self._lock = threading.Lock()
+        # Bumped by close(). Readers opened before that are closed when they come back
+        # instead of being handed out again.
+        self._generation = 0
+        self._reader_generations: Dict[sqlite3.Connection, int] = {}
+
+        self._acquisitions = 0
+        self._waits = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._writer_acquisitions = 0
+        self._writer_total_wait = 0.0
+        self._writer_max_wait = 0.0
+
+    def _connect(self, query_only: bool) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_name,
+            timeout=self.busy_timeout,
+            check_same_thread=False,
+            cached_statements=self.statement_cache_size,
+        )
+        conn.execute("PRAGMA journal_mode = WAL")
+        # NORMAL is durable enough in WAL mode and skips an fsync per commit
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA wal_autocheckpoint = {int(self.wal_autocheckpoint)}")
+        if query_only:
+            conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def _checkout_reader(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if len(self._readers) < self.size:
+                conn = self._connect(query_only=True)
+                self._readers.append(conn)
+                self._reader_generations[conn] = self._generation
+                return conn
+
+        # Every connection is busy, wait for one to be handed back
+        start = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            raise TimeoutError(
+                f"No database connection available after {self.acquire_timeout}s"
+            ) from None
+        waited = time.perf_counter() - start
+        with self._lock:
+            self._waits += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+        return conn
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        conn = self._checkout_reader()
+        with self._lock:
+            self._acquisitions += 1
+        try:
+            yield conn
+        finally:
+            with self._lock:
+                current = self._reader_generations.get(conn) == self._generation
+            if not current:
+                # Checked out across close(), which already closed it
+                conn.close()
+            else:
+                # Never hand back a connection with an open read transaction, it would
+                # pin the WAL and stop checkpoints from making progress
+                if conn.in_transaction:
+                    conn.rollback()
+                self._idle.put(conn)
+
+    # Yields the writer connection and commits when the block exits, or rolls back if
+    # it raised
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        start = time.perf_counter()
+        if not self._writer_lock.acquire(
+            timeout=-1 if self.acquire_timeout is None else self.acquire_timeout
+        ):
+            raise TimeoutError(
+                f"Database writer not available after {self.acquire_timeout}s"
+            )
+        waited = time.perf_counter() - start
+        try:
+            with self._lock:
+                self._writer_acquisitions += 1
+                self._writer_total_wait += waited
+                self._writer_max_wait = max(self._writer_max_wait, waited)
+            if self._writer is None:
+                self._writer = self._connect(query_only=False)
+            conn = self._writer
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        finally:
+            self._writer_lock.release()
+
+    # mode is one of PASSIVE, FULL, RESTART or TRUNCATE
+    def checkpoint(self, mode: str = "PASSIVE"):
+        if mode.upper() not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+            raise ValueError(f"Unknown checkpoint mode: {mode}")
+        with self.writer() as conn:
+            return conn.execute(f"PRAGMA wal_checkpoint({mode.upper()})").fetchone()
+
+    def stats(self) -> PoolStats:
+        with self._lock:
+            return PoolStats(
+                size=self.size,
+                open_readers=len(self._readers),
+                idle_readers=self._idle.qsize(),
+                acquisitions=self._acquisitions,
+                waits=self._waits,
+                total_wait_seconds=self._total_wait,
+                max_wait_seconds=self._max_wait,
+                writer_acquisitions=self._writer_acquisitions,
+                writer_total_wait_seconds=self._writer_total_wait,
+                writer_max_wait_seconds=self._writer_max_wait,
+            )
+
+    # Closes every connection. Readers that are checked out are closed as well, so
+    # only call this once the application is done with the database, or is about to
+    # open it again (see Database.reset). Those readers are dropped when they come back.
+    def close(self):
+        with self._writer_lock, self._lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
+            self._reader_generations.clear()
+            self._generation += 1
+            self._idle = queue.LifoQueue()
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
@@ -0,0 +1,111 @@
+import functools, sys, threading, time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+# Stacks whose innermost frame is in one of these modules are threads sitting idle,
+# e.g. pool workers waiting for a job
+_IDLE_MODULES = ("threading.py", "queue.py", "selectors.py")
+
+
+# Statistical profiler: a background thread samples the stack of every other thread
+# every interval seconds. The result is in the collapsed-stack format flame graph
+# tools read, one "outer;...;inner count" line per distinct stack.
+#
+# With all_threads=False only the threads inside thread() are sampled, which is how a
+# single request is profiled on a busy server. The event loop thread is still shared
+# with the other requests, so their coroutines can show up in its samples.
+class SamplingProfiler:
+    def __init__(
+        self, interval: float = 0.001, max_depth: int = 64, all_threads: bool = True
+    ):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.all_threads = all_threads
+        self.samples = 0
+        self._stacks: Counter = Counter()
+        # Thread id -> how many times it is inside thread()
+        self._threads: Counter = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="estee-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # Samples the calling thread until the block exits
+    @contextmanager
+    def thread(self):
+        ident = threading.get_ident()
+        with self._lock:
+            self._threads[ident] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._threads[ident] -= 1
+                if not self._threads[ident]:
+                    del self._threads[ident]
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.is_set():
+            with self._lock:
+                threads = set(self._threads)
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own or frame.f_code.co_filename.endswith(_IDLE_MODULES):
+                    continue
+                if not self.all_threads and thread_id not in threads:
+                    continue
+                names = []
+                while frame is not None and len(names) < self.max_depth:
+                    code = frame.f_code
+                    names.append(
+                        f"{code.co_name} ({code.co_filename}:{frame.f_lineno})"
+                    )
+                    frame = frame.f_back
+                self._stacks[";".join(reversed(names))] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+
+    def collapsed(self) -> str:
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self._stacks.most_common()
+        )
+
+
+# The profiler of the request being handled, if it is being profiled
+current_profiler: ContextVar[Optional[SamplingProfiler]] = ContextVar(
+    "current_profiler", default=None
+)
+
+
+# fn, made to have the thread it runs on sampled by the current request's profiler.
+# Used for work handed to other threads, e.g. fn passed to run_in_executor.
+def profiled(fn: Callable) -> Callable:
+    profiler = current_profiler.get()
+    if profiler is None:
+        return fn
+
+    @functools.wraps(fn)
+    def call(*args, **kwargs):
+        with profiler.thread():
+            return fn(*args, **kwargs)
+
+    return call
@@ -0,0 +1,153 @@
+# Caching of computed query results. Nearby users asking the same question share one
+# answer: their coordinates are quantized to a geohash cell, and the result computed
+# for the first of them is reused by everyone in the same cell until the data changes.
+# Identical requests arriving while the answer is still being computed wait for that
+# computation instead of starting their own.
+import asyncio, threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+from pydantic import BaseModel, computed_field
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+# Geohash of a point, e.g. "9q8yy" at precision 5. Cells at precision 7 are about
+# 150 x 150 m, at precision 8 about 38 x 19 m.
+def geohash(lat: float, lon: float, precision: int) -> str:
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits, bit_count, even = 0, 0, True
+    while len(chars) < precision:
+        # Bits alternate between longitude and latitude, longitude first
+        value, bounds = (lon, lon_range) if even else (lat, lat_range)
+        middle = (bounds[0] + bounds[1]) / 2
+        if value >= middle:
+            bits = bits * 2 + 1
+            bounds[0] = middle
+        else:
+            bits *= 2
+            bounds[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+# Runs one computation per key at a time: callers arriving while it is in flight get
+# its result instead of starting their own. The computation runs to completion even if
+# the caller that started it is cancelled, so the others still get the result. Nothing
+# is kept once it's done.
+class SingleFlight:
+    def __init__(self):
+        self._pending: Dict[Hashable, "asyncio.Future"] = {}
+        self.coalesced = 0
+
+    async def run(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            return await asyncio.shield(pending)
+
+        async def run():
+            try:
+                return await compute()
+            finally:
+                del self._pending[key]
+
+        task = self._pending[key] = asyncio.ensure_future(run())
+        # Marks the error as seen even if every caller is gone by the time it fails
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return await asyncio.shield(task)
+
+
+class CacheStats(BaseModel):
+    size: int
+    maxsize: int
+    hits: int
+    misses: int
+    evictions: int
+    invalidations: int
+    coalesced: int
+
+    @computed_field
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+# LRU of results tagged with the data version they were computed from. Every write
+# bumps the version, and the first lookup or result at a newer version drops all
+# entries. Versions only have to compare in the order the writes happened; results
+# computed at an older version than the newest one seen are not kept.
+class ResultCache:
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self.version = None
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    # Whether version is current, after moving on to it if it is newer
+    def _check_version(self, version) -> bool:
+        if self.version is None or version > self.version:
+            self._invalidations += len(self._entries)
+            self._entries.clear()
+            self.version = version
+        return version == self.version
+
+    # Returns (hit, value)
+    def get(self, key: Hashable, version) -> Tuple[bool, Any]:
+        with self._lock:
+            if self._check_version(version) and key in self._entries:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return True, self._entries[key]
+            self._misses += 1
+            return False, None
+
+    def put(self, key: Hashable, version, value: Any):
+        with self._lock:
+            if not self._check_version(version):
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    # The cached value for key, or else the result of compute(), which is then cached.
+    # Concurrent misses on the same key share one computation. Failures are passed on
+    # to everyone waiting but not cached.
+    async def get_or_compute(
+        self, key: Hashable, version, compute: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        hit, value = self.get(key, version)
+        if hit:
+            return value
+
+        async def compute_and_store():
+            value = await compute()
+            self.put(key, version, value)
+            return value
+
+        return await self._flights.run((key, version), compute_and_store)
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                size=len(self._entries),
+                maxsize=self.maxsize,
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                invalidations=self._invalidations,
+                coalesced=self._flights.coalesced,
+            )
@@ -0,0 +1,210 @@
+import json, time
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .geocoding import Coordinates, normalize_address
+from .http_cache import compress
+from .ingest import COLUMNS
+
+APPLICANT = COLUMNS.index("applicant")
+FOOD_ITEMS = COLUMNS.index("food_items")
+ADDRESS = COLUMNS.index("address")
+LATITUDE = COLUMNS.index("latitude")
+LONGITUDE = COLUMNS.index("longitude")
+
+
+# Same encoding FastAPI's JSONResponse uses
+def dump_json(content) -> bytes:
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+# Immutable, versioned copy of the food_trucks table kept in memory.
+# Rows are sorted by location_id. The columns the hot endpoints need are held as
+# arrays and every row is also kept pre-serialized as JSON, so reads never touch
+# SQLite or build Pydantic models. Writes produce a new snapshot through apply()
+# instead of changing this one, so a reader always sees a consistent table.
+class TruckSnapshot:
+    def __init__(
+        self, rows: Sequence[tuple], version: int, modified_at: Optional[float] = None
+    ):
+        self.version = version
+        # When the write this snapshot reflects happened
+        self.modified_at = time.time() if modified_at is None else modified_at
+        self.location_ids = array("q", (row[0] for row in rows))
+        self.latitudes = array("d", (row[LATITUDE] for row in rows))
+        self.longitudes = array("d", (row[LONGITUDE] for row in rows))
+        self.applicants = [row[APPLICANT] for row in rows]
+        self.food_items = [row[FOOD_ITEMS] for row in rows]
+        self.addresses = [row[ADDRESS] for row in rows]
+        self.payloads = [dump_json(dict(zip(COLUMNS, row))) for row in rows]
+        self._list_payloads: Dict[Optional[str], bytes] = {}
+        self._address_index: Optional[Dict[str, List[int]]] = None
+
+    def __len__(self) -> int:
+        return len(self.location_ids)
+
+    def position(self, location_id: int) -> Optional[int]:
+        i = bisect_left(self.location_ids, location_id)
+        if i < len(self.location_ids) and self.location_ids[i] == location_id:
+            return i
+        return None
+
+    # Full row as JSON bytes
+    def payload(self, location_id: int) -> Optional[bytes]:
+        i = self.position(location_id)
+        return None if i is None else self.payloads[i]
+
+    # The fields GET /food_trucks/ returns for the row at position i
+    def summary(self, i: int) -> dict:
+        return {
+            "applicant": self.applicants[i],
+            "food_items": self.food_items[i],
+            "address": self.addresses[i],
+        }
+
+    # The summary plus the coordinates, as returned by the closest-truck endpoints
+    def location(self, i: int) -> dict:
+        return {
+            **self.summary(i),
+            "latitude": self.latitudes[i],
+            "longitude": self.longitudes[i],
+        }
+
+    # Keyset page: positions of the first limit trucks whose location_id is larger
+    # than after, as a (start, end) range
+    def page(self, after: Optional[int], limit: Optional[int]) -> Tuple[int, int]:
+        start = 0 if after is None else bisect_right(self.location_ids, after)
+        end = len(self) if limit is None else min(start + limit, len(self))
+        return start, end
+
+    # JSON array of every summary, serialized once per snapshot and compressed at most
+    # once per content encoding
+    def list_payload(self, encoding: Optional[str] = None) -> bytes:
+        payload = self._list_payloads.get(encoding)
+        if payload is None:
+            if encoding is None:
+                payload = dump_json([self.summary(i) for i in range(len(self))])
+            else:
+                payload = compress(self.list_payload(), encoding)
+            self._list_payloads[encoding] = payload
+        return payload
+
+    def _copy(self, version: int, modified_at: Optional[float]) -> "TruckSnapshot":
+        snapshot = object.__new__(TruckSnapshot)
+        snapshot.version = version
+        snapshot.modified_at = time.time() if modified_at is None else modified_at
+        snapshot.location_ids = array("q", self.location_ids)
+        snapshot.latitudes = array("d", self.latitudes)
+        snapshot.longitudes = array("d", self.longitudes)
+        snapshot.applicants = list(self.applicants)
+        snapshot.food_items = list(self.food_items)
+        snapshot.addresses = list(self.addresses)
+        snapshot.payloads = list(self.payloads)
+        snapshot._list_payloads = {}
+        snapshot._address_index = None
+        return snapshot
+
+    # New snapshot with the rows in deleted removed and then every row in rows
+    # inserted, or replaced if its location_id exists. The arrays are copied once for
+    # the whole batch.
+    def apply(
+        self,
+        rows: Sequence[tuple],
+        deleted: Sequence[int],
+        version: int,
+        modified_at: Optional[float] = None,
+    ) -> "TruckSnapshot":
+        snapshot = self._copy(version, modified_at)
+        if self._address_index is not None:
+            snapshot._address_index = dict(self._address_index)
+        for location_id in deleted:
+            snapshot._remove(location_id)
+        for row in rows:
+            snapshot._upsert(row)
+        return snapshot
+
+    # Normalized address -> location_ids of the trucks there that have coordinates, in
+    # location_id order. Built on first use; apply() patches it along with the columns.
+    def address_index(self) -> Dict[str, List[int]]:
+        index = self._address_index
+        if index is None:
+            index = {}
+            for i, address in enumerate(self.addresses):
+                if address and self.latitudes[i] != 0 and self.longitudes[i] != 0:
+                    index.setdefault(normalize_address(address), []).append(
+                        self.location_ids[i]
+                    )
+            self._address_index = index
+        return index
+
+    # Coordinates of the truck with the lowest location_id at a normalized address
+    def address_coordinates(self, normalized: str) -> Optional[Coordinates]:
+        location_ids = self.address_index().get(normalized)
+        if not location_ids:
+            return None
+        i = self.position(location_ids[0])
+        return self.latitudes[i], self.longitudes[i]
+
+    # In-place changes, only ever made to a fresh copy. The address index lists are
+    # shared with the snapshot it was copied from, so they are replaced, not changed.
+    def _index_address(self, i: int, add: bool):
+        address = self.addresses[i]
+        if not address or self.latitudes[i] == 0 or self.longitudes[i] == 0:
+            return
+        key = normalize_address(address)
+        location_ids = [
+            location_id
+            for location_id in self._address_index.get(key, ())
+            if location_id != self.location_ids[i]
+        ]
+        if add:
+            insort(location_ids, self.location_ids[i])
+        if location_ids:
+            self._address_index[key] = location_ids
+        else:
+            self._address_index.pop(key, None)
+
+    def _upsert(self, row: tuple):
+        payload = dump_json(dict(zip(COLUMNS, row)))
+        i = bisect_left(self.location_ids, row[0])
+        if i < len(self) and self.location_ids[i] == row[0]:
+            if self._address_index is not None:
+                self._index_address(i, add=False)
+            self.latitudes[i] = row[LATITUDE]
+            self.longitudes[i] = row[LONGITUDE]
+            self.applicants[i] = row[APPLICANT]
+            self.food_items[i] = row[FOOD_ITEMS]
+            self.addresses[i] = row[ADDRESS]
+            self.payloads[i] = payload
+        else:
+            self.location_ids.insert(i, row[0])
+            self.latitudes.insert(i, row[LATITUDE])
+            self.longitudes.insert(i, row[LONGITUDE])
+            self.applicants.insert(i, row[APPLICANT])
+            self.food_items.insert(i, row[FOOD_ITEMS])
+            self.addresses.insert(i, row[ADDRESS])
+            self.payloads.insert(i, payload)
+        if self._address_index is not None:
+            self._index_address(i, add=True)
+
+    def _remove(self, location_id: int):
+        i = self.position(location_id)
+        if i is not None:
+            if self._address_index is not None:
+                self._index_address(i, add=False)
+            for column in (
+                self.location_ids,
+                self.latitudes,
+                self.longitudes,
+                self.applicants,
+                self.food_items,
+                self.addresses,
+                self.payloads,
+            ):
+                del column[i]
+
+    def positions(self, location_ids: List[int]) -> List[int]:
+        return [i for i in map(self.position, location_ids) if i is not None]
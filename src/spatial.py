@@ -0,0 +1,170 @@
+import math
+import threading
+from collections import defaultdict
+from typing import ContextManager, Dict, Iterator, List, Tuple
+
+from .geo import (
+    ELLIPSOID_MARGIN,
+    MAX_DISTANCE_KM,
+    bounding_box,
+    geodesic_km,
+    haversine_km,
+)
+
+
+# Roughly 1.1km x 0.9km cells around San Francisco
+DEFAULT_CELL_SIZE = 0.01
+
+
+# Nearest-neighbour search over a uniform latitude/longitude grid. Subclasses store the
+# points: they yield the points in the cells overlapping a box and look a point up by
+# location_id.
+class GridIndex:
+    cell_size: float
+    _lock: ContextManager
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def _point(self, location_id: int) -> Tuple[float, float]:
+        raise NotImplementedError
+
+    def _points_in_box(
+        self, box: Tuple[float, float, float, float]
+    ) -> Iterator[Tuple[int, float, float]]:
+        raise NotImplementedError
+
+    def _cell(self, latitude: float, longitude: float) -> Tuple[int, int]:
+        return (
+            math.floor(latitude / self.cell_size),
+            math.floor(longitude / self.cell_size),
+        )
+
+    def _within(
+        self, latitude: float, longitude: float, radius_km: float
+    ) -> List[Tuple[float, int]]:
+        box = bounding_box(latitude, longitude, radius_km)
+        candidates = []
+        for location_id, lat, lon in self._points_in_box(box):
+            distance = haversine_km(latitude, longitude, lat, lon)
+            if distance <= radius_km:
+                candidates.append((distance, location_id))
+        return candidates
+
+    # Returns up to k (distance_km, location_id) pairs sorted by distance, ties broken
+    # by location_id. Candidates are gathered with the spherical approximation and, when
+    # exact is set, re-ranked with the geodesic distance on the WGS-84 ellipsoid.
+    def nearest(
+        self, latitude: float, longitude: float, k: int = 3, exact: bool = True
+    ) -> List[Tuple[float, int]]:
+        with self._lock:
+            if k <= 0 or not len(self):
+                return []
+
+            k = min(k, len(self))
+
+            # Grow the search box until it holds at least k trucks
+            radius = self.cell_size * 111.0
+            while True:
+                box = bounding_box(latitude, longitude, radius)
+                found = sum(1 for _ in self._points_in_box(box))
+                if found >= k or radius >= MAX_DISTANCE_KM:
+                    break
+                radius *= 2
+
+            # The k-th closest truck in the box bounds the search radius; anything
+            # further away than that (plus the ellipsoid margin) can't make the cut
+            distances = sorted(
+                haversine_km(latitude, longitude, lat, lon)
+                for _, lat, lon in self._points_in_box(box)
+            )
+            radius = min(distances[k - 1] * ELLIPSOID_MARGIN + 1e-9, MAX_DISTANCE_KM)
+            candidates = self._within(latitude, longitude, radius)
+
+            if exact:
+                candidates = [
+                    (
+                        geodesic_km(latitude, longitude, *self._point(location_id)),
+                        location_id,
+                    )
+                    for _, location_id in candidates
+                ]
+
+        candidates.sort()
+        return candidates[:k]
+
+
+# Uniform latitude/longitude grid over the truck locations.
+# Each cell holds the trucks that fall inside it, so a nearest-neighbour query only
+# has to look at the handful of cells around the user instead of the whole table.
+class SpatialIndex(GridIndex):
+    def __init__(self, cell_size: float = DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+        self._cells: Dict[Tuple[int, int], Dict[int, Tuple[float, float]]] = (
+            defaultdict(dict)
+        )
+        self._points: Dict[int, Tuple[float, float]] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def __contains__(self, location_id: int) -> bool:
+        return location_id in self._points
+
+    def _point(self, location_id: int) -> Tuple[float, float]:
+        return self._points[location_id]
+
+    def insert(self, location_id: int, latitude: float, longitude: float):
+        with self._lock:
+            self.remove(location_id)
+            self._points[location_id] = (latitude, longitude)
+            self._cells[self._cell(latitude, longitude)][location_id] = (
+                latitude,
+                longitude,
+            )
+
+    def remove(self, location_id: int) -> bool:
+        with self._lock:
+            point = self._points.pop(location_id, None)
+            if point is None:
+                return False
+            cell = self._cell(*point)
+            del self._cells[cell][location_id]
+            if not self._cells[cell]:
+                del self._cells[cell]
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._cells.clear()
+            self._points.clear()
+
+    # Yields (location_id, latitude, longitude) for every point in the cells
+    # overlapping the box. Points may lie slightly outside of it.
+    def _points_in_box(
+        self, box: Tuple[float, float, float, float]
+    ) -> Iterator[Tuple[int, float, float]]:
+        min_row, min_col = self._cell(box[0], box[1])
+        max_row, max_col = self._cell(box[2], box[3])
+        num_cells = (max_row - min_row + 1) * (max_col - min_col + 1)
+
+        # A huge box (far away query, sparse data) would make us walk millions of
+        # empty cells, so walk the occupied ones instead
+        if num_cells > len(self._cells):
+            cells = [
+                points
+                for (row, col), points in self._cells.items()
+                if min_row <= row <= max_row and min_col <= col <= max_col
+            ]
+        else:
+            cells = [
+                self._cells[(row, col)]
+                for row in range(min_row, max_row + 1)
+                for col in range(min_col, max_col + 1)
+                if (row, col) in self._cells
+            ]
+
+        for points in cells:
+            for location_id, (latitude, longitude) in points.items():
+                yield location_id, latitude, longitude
@@ -0,0 +1,151 @@
+# Everything a worker does before it can serve requests, kept out of import time so
+# that importing src.main stays cheap and never touches the disk. The application
+# lifespan runs it on boot; run it as a module to build the database and its columnar
+# snapshot ahead of a deploy so that no worker ever has to ingest the CSV itself.
+#
+#   python -m src.startup ./data/Mobile_Food_Facility_Permit.csv --db food_trucks.db
+import argparse, os, time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from pydantic import BaseModel, computed_field
+
+from .database import Database
+
+try:
+    import fcntl
+except ImportError:  # no flock on Windows, start one worker there first
+    fcntl = None
+
+CSV_FILE = "./data/Mobile_Food_Facility_Permit.csv"
+DB_FILE = "food_trucks.db"
+
+
+class StartupReport(BaseModel):
+    # Whether this process built the database from the CSV
+    built: bool = False
+    rows: int = 0
+    version: int = 0
+    # Seconds spent per phase: waiting for the lock, building or migrating the
+    # database and loading the snapshot and spatial index
+    seconds: Dict[str, float] = {}
+
+    @computed_field
+    @property
+    def total_seconds(self) -> float:
+        return sum(self.seconds.values())
+
+
+# Exclusive lock on a file next to the database. Workers started together queue up on
+# it, so exactly one of them builds or migrates the database and the others find it
+# ready.
+@contextmanager
+def file_lock(path: str, timeout: Optional[float] = 60.0, poll: float = 0.05):
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as file:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if deadline is not None and time.monotonic() > deadline:
+                    raise TimeoutError(f"{path} still locked after {timeout}s")
+                time.sleep(poll)
+        try:
+            yield
+        finally:
+            fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+# Loads the CSV into a scratch file and moves it into place once it is complete, so
+# that nothing ever opens a half-built database
+def build_database(db_file: str, csv_file, **kwargs):
+    if not os.path.exists(csv_file):
+        raise FileNotFoundError(
+            f"File {csv_file} not found. Please download the file from https://data.sfgov.org/api/views/rqzj-sfat/rows.csv and place it in the data directory."
+        )
+    scratch = f"{db_file}.building"
+    for path in (scratch, f"{scratch}-wal", f"{scratch}-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+    db = Database(scratch, **kwargs)
+    try:
+        report = db.create_database(csv_file)
+    finally:
+        # Checkpoints the WAL into the file, which is all there is to move
+        db.close()
+    # A WAL left behind by an earlier file would be replayed into the new one
+    for path in (f"{db_file}-wal", f"{db_file}-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+    os.replace(scratch, db_file)
+    return report
+
+
+# Makes db ready to serve: builds the database if there is none yet (or if rebuild is
+# set), brings an existing one up to the current schema, then loads the views so the
+# first request doesn't pay for them
+def prepare(
+    db: Database,
+    csv_file=CSV_FILE,
+    rebuild: bool = False,
+    lock_timeout: Optional[float] = 60.0,
+) -> StartupReport:
+    report = StartupReport()
+    start = time.perf_counter()
+    with file_lock(f"{db.db_name}.lock", lock_timeout):
+        locked = time.perf_counter()
+        report.seconds["lock"] = locked - start
+        if rebuild or not os.path.exists(db.db_name):
+            build_database(db.db_name, csv_file)
+            # Connections opened before the file was replaced still read the old one
+            db.reset()
+            report.built = True
+        else:
+            db.create_table()
+        report.seconds["database"] = time.perf_counter() - locked
+
+    start = time.perf_counter()
+    snapshot = db.get_snapshot()
+    # Writes the columnar file now rather than after the first request
+    db.export_columnar()
+    report.seconds["views"] = time.perf_counter() - start
+    report.rows = len(snapshot)
+    report.version = snapshot.version
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Build a ready-to-serve food truck database ahead of a deploy"
+    )
+    parser.add_argument("csv_file", nargs="?", default=CSV_FILE)
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Replace an existing database. Use python -m src.sync to refresh one "
+        "that servers are running on.",
+    )
+    parser.add_argument(
+        "--no-columns",
+        action="store_true",
+        help="Don't write the columnar snapshot the server memory-maps",
+    )
+    args = parser.parse_args(argv)
+
+    db = Database(
+        args.db, columnar_file=None if args.no_columns else f"{args.db}.columns"
+    )
+    try:
+        report = prepare(db, args.csv_file, rebuild=args.rebuild)
+    finally:
+        db.close()
+    print(report.model_dump_json(indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# Incremental refresh of the database from a new copy of the permit CSV. Every row is
+# hashed and compared with the hash stored when it was last loaded, so only inserted,
+# changed and removed rows are written, in one transaction. A running API notices the
+# new data version and swaps in fresh views without a restart.
+#
+#   python -m src.sync ./data/Mobile_Food_Facility_Permit.csv --db food_trucks.db
+import argparse
+from typing import List
+
+from .database import Database
+from .geocoding import GeocodeCache
+from .ingest import IngestReport, RejectedRow, read_csv_batches, row_hash
+
+CSV_FILE = "./data/Mobile_Food_Facility_Permit.csv"
+DB_FILE = "food_trucks.db"
+
+
+class SyncReport(IngestReport):
+    updated: int = 0
+    deleted: int = 0
+    unchanged: int = 0
+    # Data version after the sync, unchanged if there was nothing to do
+    version: int = 0
+
+
+# Brings the food_trucks table in line with csv_file. Rows that were created through
+# the API and never appeared in the CSV are left alone; rows the CSV no longer has are
+# deleted. With dry_run set the diff is only reported.
+def sync_csv(
+    db: Database, csv_file, batch_size: int = 5000, dry_run: bool = False
+) -> SyncReport:
+    db.create_table()
+    report = SyncReport()
+    # Only the hashes are held for the whole table, rows only when they changed
+    stored = db.get_row_hashes()
+    seen = set()
+    rows: List[tuple] = []
+    with open(csv_file, "r", encoding="utf-8") as file:
+        for batch in read_csv_batches(file, report, batch_size):
+            for line, values in batch:
+                location_id = values[0]
+                if location_id in seen:
+                    report.rejected.append(
+                        RejectedRow(
+                            line=line,
+                            location_id=str(location_id),
+                            reason="duplicate location_id",
+                        )
+                    )
+                    continue
+                seen.add(location_id)
+                if location_id not in stored:
+                    report.inserted += 1
+                elif stored[location_id] != row_hash(values):
+                    report.updated += 1
+                else:
+                    report.unchanged += 1
+                    continue
+                rows.append(values)
+
+    # A None hash is a row the CSV never had (or that was changed through the API)
+    deleted = [
+        location_id
+        for location_id, hash_ in stored.items()
+        if hash_ is not None and location_id not in seen
+    ]
+    report.deleted = len(deleted)
+
+    if (rows or deleted) and not dry_run:
+        report.version = db.apply_changes(rows, deleted)
+    else:
+        report.version = db.data_version()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Apply a fresh copy of the permit CSV to the food truck database"
+    )
+    parser.add_argument("csv_file", nargs="?", default=CSV_FILE)
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Only report what would change"
+    )
+    parser.add_argument(
+        "--change-retention-days",
+        type=float,
+        default=30,
+        help="Remove deletions older than this from the change feed",
+    )
+    args = parser.parse_args(argv)
+
+    db = Database(args.db)
+    try:
+        report = sync_csv(db, args.csv_file, args.batch_size, args.dry_run)
+        if not args.dry_run:
+            db.compact_changes(args.change_retention_days * 24 * 3600)
+            GeocodeCache(db.pool).purge_expired()
+    finally:
+        db.close()
+    print(report.model_dump_json(indent=2))
+
+
+if __name__ == "__main__":
+    main()
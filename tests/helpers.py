@@ -0,0 +1,69 @@
+import csv
+from pathlib import Path
+
+from src.database import FoodTruck
+
+
+# A complete FoodTruck with placeholder values, override whatever the test cares about
+def make_truck(location_id, **overrides):
+    truck = FoodTruck(
+        location_id=location_id,
+        applicant="Test Tacos",
+        facility_type="Truck",
+        cnn=1,
+        location_description="",
+        address="1 TEST ST",
+        blocklot="",
+        block="",
+        lot="",
+        permit="",
+        status="APPROVED",
+        food_items="Tacos",
+        x=0.0,
+        y=0.0,
+        latitude=37.77,
+        longitude=-122.41,
+        schedule=None,
+        dayshours=None,
+        NOISent=None,
+        approved=None,
+        received=None,
+        prior_permit=None,
+        expiration_date=None,
+        location=None,
+        fire_prevention_districts=None,
+        police_districts=None,
+        supervisor_districts=None,
+        zip_codes=None,
+        neighborhoods_old=None,
+    )
+    return truck.model_copy(update=overrides)
+
+
+with open(
+    Path(__file__).parent.parent / "data" / "Mobile_Food_Facility_Permit.csv",
+    encoding="utf-8",
+) as file:
+    HEADER = file.readline()
+
+
+def write_csv(path, rows):
+    fieldnames = next(csv.reader([HEADER]))
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=fieldnames)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+
+
+def truck_row(location_id, **overrides):
+    row = {
+        "location_id": location_id,
+        "Applicant": f"Truck {location_id}",
+        "FacilityType": "Truck",
+        "Status": "APPROVED",
+        "Latitude": "37.7749",
+        "Longitude": "-122.4194",
+    }
+    row.update(overrides)
+    return row
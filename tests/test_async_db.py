@@ -0,0 +1,40 @@
+import asyncio, threading, time
+
+import pytest
+
+from src.async_db import AsyncDatabase, BoundedExecutor, QueryTimeout
+from src.database import Database
+
+
+def test_database_methods_run_off_the_event_loop(tmp_path):
+    db = Database(str(tmp_path / "async.db"))
+    db.create_table()
+    adb = AsyncDatabase(db, max_workers=2)
+
+    async def main():
+        loop_thread = threading.get_ident()
+        results = await asyncio.gather(
+            adb.get_all_food_trucks(),
+            adb.run(threading.get_ident),
+        )
+        return results, loop_thread
+
+    (trucks, worker_thread), loop_thread = asyncio.run(main())
+    assert trucks == []
+    assert worker_thread != loop_thread
+    adb.shutdown()
+    db.close()
+
+
+def test_slow_calls_time_out():
+    executor = BoundedExecutor(max_workers=1, timeout=0.05)
+
+    async def main():
+        # The loop stays free while the worker is busy
+        slow = asyncio.ensure_future(executor.run(time.sleep, 0.5))
+        await asyncio.sleep(0)
+        with pytest.raises(QueryTimeout):
+            await slow
+
+    asyncio.run(main())
+    executor.shutdown()
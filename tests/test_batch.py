@@ -0,0 +1,52 @@
+import pytest
+
+from src.database import BatchStatus, Database
+from tests.helpers import make_truck
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / "batch.db"))
+    db.create_table()
+    db.insert_food_truck(make_truck(1))
+    yield db
+    db.close()
+
+
+def test_atomic_batch_writes_nothing_if_any_item_fails(db):
+    version = db.get_snapshot().version
+    result = db.insert_food_trucks(
+        [make_truck(2), make_truck(1), make_truck(3, latitude=123.0)]
+    )
+    assert result.applied == 0
+    assert [item.status for item in result.results] == [
+        BatchStatus.skipped,
+        BatchStatus.failed,
+        BatchStatus.failed,
+    ]
+    assert result.results[1].error == "location_id already exists"
+    assert db.get_food_truck_by_id(2) is None
+    assert db.get_snapshot().version == version
+
+
+def test_best_effort_batch_writes_the_valid_items(db):
+    result = db.insert_food_trucks(
+        [make_truck(None), make_truck(5), make_truck(5), make_truck(None)],
+        atomic=False,
+    )
+    assert result.applied == 3
+    # Ids are handed out after the largest one in the table or the batch
+    assert [item.location_id for item in result.results] == [6, 5, 5, 7]
+    assert result.results[2].status == BatchStatus.failed
+    assert list(db.get_snapshot().location_ids) == [1, 5, 6, 7]
+
+    result = db.update_food_trucks(
+        [make_truck(5, applicant="Renamed"), make_truck(8)], atomic=False
+    )
+    assert result.results[1].error == "food truck not found"
+    assert db.get_food_truck_by_id(5).applicant == "Renamed"
+    assert db.search_food_trucks("Renamed")[0].location_id == 5
+
+    result = db.delete_food_trucks([5, 6, 6], atomic=False)
+    assert result.applied == 2
+    assert list(db.get_snapshot().location_ids) == [1, 7]
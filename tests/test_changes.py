@@ -0,0 +1,92 @@
+import pytest
+
+from src.database import Database, StaleCursor
+from src.startup import build_database
+from src.sync import sync_csv
+from tests.helpers import make_truck, truck_row, write_csv
+
+
+def summary(changes):
+    return [(change.location_id, change.deleted) for change in changes]
+
+
+def test_change_log_follows_writes(tmp_path):
+    csv_file = tmp_path / "trucks.csv"
+    write_csv(csv_file, [truck_row(1), truck_row(2)])
+    db = Database(str(tmp_path / "changes.db"))
+    db.create_database(csv_file)
+
+    page = db.get_changes()
+    changes, cursor = page.changes, page.cursor(page.last_seq)
+    assert summary(changes) == [(1, False), (2, False)]
+    assert changes[0].truck.applicant == "Truck 1"
+
+    db.insert_food_truck(make_truck(3))
+    db.update_food_truck(1, make_truck(1, applicant="Renamed"))
+    db.delete_food_truck(2)
+    # Moving a truck to another location_id deletes the old one
+    db.update_food_truck(3, make_truck(4))
+    changes = db.get_changes(cursor).changes
+    assert summary(changes) == [(1, False), (2, True), (3, True), (4, False)]
+    assert changes[0].truck.applicant == "Renamed"
+    assert changes[1].truck is None
+
+    # Only the latest change of each truck is kept
+    page = db.get_changes()
+    changes, cursor = page.changes, page.cursor(page.last_seq)
+    assert summary(changes) == [(1, False), (2, True), (3, True), (4, False)]
+    assert changes[-1].seq == page.last_seq
+    assert db.get_changes(page.cursor(changes[0].seq), limit=2).changes == changes[1:3]
+
+    # A sync from the CSV is logged as well; truck 4 was created through the API and
+    # stays
+    write_csv(csv_file, [truck_row(1), truck_row(5)])
+    sync_csv(db, csv_file)
+    changes = db.get_changes(cursor).changes
+    assert sorted(summary(changes)) == [(1, False), (5, False)]
+
+    with pytest.raises(StaleCursor):
+        db.get_changes(page.cursor(page.last_seq + 100))
+    db.close()
+
+
+def test_compaction_expires_old_cursors(tmp_path):
+    db = Database(str(tmp_path / "compact.db"))
+    db.create_table()
+    for location_id in (1, 2, 3):
+        db.insert_food_truck(make_truck(location_id))
+    db.delete_food_truck(1)
+    page = db.get_changes()
+    cursor = page.cursor(page.last_seq)
+    db.delete_food_truck(2)
+
+    assert db.compact_changes(retention=3600) == 0
+    assert db.compact_changes(retention=0) == 2
+    # Both deletions are gone: a cursor from before the last one has to start over
+    with pytest.raises(StaleCursor):
+        db.get_changes(cursor)
+    page = db.get_changes()
+    assert summary(page.changes) == [(3, False)]
+    assert db.get_changes(page.cursor(page.last_seq)).changes == []
+    db.close()
+
+
+def test_cursors_do_not_survive_a_rebuild(tmp_path):
+    csv_file = tmp_path / "trucks.csv"
+    write_csv(csv_file, [truck_row(location_id) for location_id in (1, 2, 3)])
+    db_file = str(tmp_path / "rebuilt.db")
+    build_database(db_file, csv_file)
+    db = Database(db_file)
+    db.delete_food_truck(1)
+    page = db.get_changes()
+    cursor = page.cursor(page.changes[0].seq)
+    db.close()
+
+    # The new log numbers its entries from 1 again, so the old cursor is in range
+    write_csv(csv_file, [truck_row(location_id) for location_id in (2, 3, 4, 5)])
+    build_database(db_file, csv_file)
+    db = Database(db_file)
+    assert db.get_changes().last_seq == 4
+    with pytest.raises(StaleCursor):
+        db.get_changes(cursor)
+    db.close()
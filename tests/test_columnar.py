@@ -0,0 +1,134 @@
+import os, random, time
+
+from src.columnar import (
+    MappedSnapshot,
+    MappedSpatialIndex,
+    open_columnar,
+    write_columnar,
+)
+from src.database import Database
+from src.snapshot import TruckSnapshot
+from tests.helpers import make_truck
+
+CSV_FILE = "./data/Mobile_Food_Facility_Permit.csv"
+
+
+def test_mapped_views_match_the_in_memory_ones(tmp_path):
+    db = Database(str(tmp_path / "trucks.db"))
+    db.create_database(CSV_FILE)
+    snapshot, index = db.get_views()
+    db.close()
+
+    path = str(tmp_path / "trucks.columns")
+    write_columnar(path, snapshot)
+    columns = open_columnar(path)
+    mapped, mapped_index = MappedSnapshot(columns), MappedSpatialIndex(columns)
+
+    assert (mapped.version, mapped.modified_at) == (
+        snapshot.version,
+        snapshot.modified_at,
+    )
+    assert mapped.list_payload() == snapshot.list_payload()
+    assert list(mapped.payloads) == snapshot.payloads
+    location_id = snapshot.location_ids[42]
+    assert mapped.payload(location_id) == snapshot.payload(location_id)
+    assert mapped.location(42) == snapshot.location(42)
+
+    rng = random.Random(7)
+    for _ in range(50):
+        user = (rng.uniform(37.6, 37.9), rng.uniform(-122.6, -122.3))
+        for exact in (True, False):
+            assert mapped_index.nearest(*user, 5, exact) == index.nearest(
+                *user, 5, exact
+            )
+    assert mapped_index.nearest(40.0, -100.0, 2) == index.nearest(40.0, -100.0, 2)
+
+    # Patching a mapped snapshot gives an ordinary in-memory one
+    patched = mapped.apply([make_truck(1).as_row()], [location_id], mapped.version + 1)
+    assert type(patched) is TruckSnapshot
+    assert patched.payload(location_id) is None and patched.payload(1) is not None
+
+    write_columnar(path, TruckSnapshot([], 0))
+    empty = open_columnar(path)
+    assert len(MappedSnapshot(empty)) == 0
+    assert MappedSpatialIndex(empty).nearest(37.77, -122.41) == []
+
+
+# Two workers on the same database share one file, and see each other's writes
+def test_workers_share_the_columnar_file(tmp_path):
+    db_file, path = str(tmp_path / "trucks.db"), str(tmp_path / "trucks.columns")
+    first = Database(db_file, columnar_file=path, version_check_interval=0)
+    first.create_database(CSV_FILE)
+    second = Database(db_file, columnar_file=path, version_check_interval=0)
+
+    first.get_snapshot()
+    first.export_columnar()
+    assert isinstance(first.get_snapshot(), MappedSnapshot)
+    inode = os.stat(path).st_ino
+    # Already up to date, so the second worker only maps it
+    assert len(second.get_snapshot()) == len(first.get_snapshot())
+    assert isinstance(second.get_snapshot(), MappedSnapshot)
+    assert os.stat(path).st_ino == inode
+
+    # The write is served from memory right away and only exported afterwards
+    first.insert_food_truck(make_truck(1, latitude=37.7749, longitude=-122.4194))
+    assert first.get_snapshot().payload(1) is not None
+    assert os.stat(path).st_ino == inode
+    first.export_columnar()
+    assert isinstance(first.get_snapshot(), MappedSnapshot)
+    assert os.stat(path).st_ino != inode
+
+    snapshot, index = second.get_views()
+    assert isinstance(snapshot, MappedSnapshot)
+    assert snapshot.version == first.get_snapshot().version
+    assert snapshot.payload(1) is not None
+    assert index.nearest(37.7749, -122.4194, 1)[0][1] == 1
+
+    first.close()
+    second.close()
+
+
+# Writes from two workers within one version check interval: the second one must not
+# export its stale copy, which would hide the first write from every worker
+def test_concurrent_workers_never_export_a_stale_snapshot(tmp_path):
+    db_file, path = str(tmp_path / "trucks.db"), str(tmp_path / "trucks.columns")
+    first = Database(db_file, columnar_file=path)
+    first.create_database(CSV_FILE)
+    second = Database(db_file, columnar_file=path)
+    first.get_snapshot()
+    second.get_snapshot()
+
+    first.insert_food_truck(make_truck(1))
+    second.insert_food_truck(make_truck(2))
+    # The first worker only notices the second write at its next version check, the
+    # others see both
+    assert first.get_snapshot().payload(1) is not None
+    third = Database(db_file, columnar_file=path)
+    for db in (second, third):
+        snapshot = db.get_snapshot()
+        assert snapshot.version == db.data_version()
+        assert snapshot.payload(1) is not None and snapshot.payload(2) is not None
+    for db in (first, second, third):
+        db.close()
+
+
+# A burst of writes is exported once, in the background, after export_delay
+def test_writes_are_exported_after_the_delay(tmp_path):
+    db_file, path = str(tmp_path / "trucks.db"), str(tmp_path / "trucks.columns")
+    db = Database(db_file, columnar_file=path, export_delay=0.2)
+    db.create_database(CSV_FILE)
+    db.get_snapshot()
+    db.export_columnar()
+    inode = os.stat(path).st_ino
+
+    for location_id in range(1, 6):
+        db.insert_food_truck(make_truck(location_id))
+    assert os.stat(path).st_ino == inode
+    deadline = time.monotonic() + 5
+    while not isinstance(db.get_snapshot(), MappedSnapshot):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    columns = open_columnar(path)
+    assert columns.version == db.data_version()
+    assert MappedSnapshot(columns).payload(5) is not None
+    db.close()
@@ -0,0 +1,59 @@
+from collections import Counter
+
+from src.database import Database, TruckFilter
+from src.food_items import food_item_names, normalize_food_item
+from tests.helpers import make_truck
+
+
+def test_food_item_names():
+    assert normalize_food_item("  Mac &  Cheese. ") == "mac & cheese"
+    assert normalize_food_item("and String beans.") == "string beans"
+    assert normalize_food_item("Sodas etc.") == "sodas"
+    assert food_item_names("Tacos: Burritos: tacos; and Chips etc.") == [
+        "tacos",
+        "burritos",
+        "chips",
+    ]
+    assert food_item_names(None) == []
+
+
+def test_facets_follow_writes(tmp_path):
+    db = Database(str(tmp_path / "items.db"))
+    db.create_table()
+    db.insert_food_truck(make_truck(1, food_items="Tacos: Burritos"))
+    db.insert_food_truck(make_truck(2, food_items="Tacos: Hot dogs", status="EXPIRED"))
+    db.insert_food_truck(make_truck(3, food_items="Coffee: and tacos."))
+
+    assert db.food_item_facets() == [
+        ("tacos", 3),
+        ("burritos", 1),
+        ("coffee", 1),
+        ("hot dogs", 1),
+    ]
+
+    db.update_food_truck(3, make_truck(3, food_items="Coffee: Pastries"))
+    db.delete_food_truck(1)
+    expected = Counter(
+        name
+        for truck in db.get_all_food_trucks()
+        for name in food_item_names(truck.food_items)
+    )
+    facets = db.food_item_facets()
+    assert dict(facets) == expected
+    assert facets[0] == ("coffee", 1)
+    assert db.food_item_facets(limit=2) == facets[:2]
+
+    # Counted over the matching trucks only
+    approved = TruckFilter(status=["APPROVED"])
+    assert db.food_item_facets(approved) == [("coffee", 1), ("pastries", 1)]
+    assert db.food_item_facets(location_ids=[2, 3, 99]) == facets
+    assert db.food_item_facets(location_ids=[]) == []
+
+    # The same index backs the food_item filter
+    filters = TruckFilter(food_item=["Hot Dogs", "pastries"])
+    ids = [
+        row["location_id"]
+        for row in db.filter_food_trucks(filters, columns=["location_id"])
+    ]
+    assert ids == [2, 3]
+    db.close()
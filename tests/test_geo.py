@@ -0,0 +1,62 @@
+import random
+
+import pytest
+from geopy.distance import geodesic
+
+from src.geo import (
+    Accuracy,
+    CoordinateArray,
+    distances_from,
+    haversine_km,
+    nearest_indices,
+    top_k,
+    within_radius,
+)
+
+USER = (37.7749, -122.4194)
+TRUCKS = [(37.8, -122.4), (37.7749, -122.4194), (37.75, -122.45), (0.0, 0.0)]
+
+
+def test_batch_kernels_match_scalar_distances():
+    coordinates = CoordinateArray(*zip(*TRUCKS))
+
+    fast = distances_from(*USER, coordinates, Accuracy.fast)
+    exact = distances_from(*USER, coordinates, Accuracy.exact)
+
+    for truck, fast_km, exact_km in zip(TRUCKS, fast, exact):
+        assert fast_km == pytest.approx(haversine_km(*USER, *truck))
+        assert exact_km == pytest.approx(geodesic(USER, truck).km)
+        # The sphere and the ellipsoid never disagree by more than a fraction of a percent
+        assert fast_km == pytest.approx(exact_km, rel=0.006)
+
+
+def test_top_k_keeps_original_order_for_ties():
+    assert top_k([3.0, 1.0, 2.0, 1.0, 0.5], 3) == [4, 1, 3]
+    assert top_k([3.0, 1.0], 5) == [1, 0]
+    assert top_k([3.0, 1.0], 0) == []
+
+
+def test_nearest_indices_matches_a_full_geodesic_ranking():
+    rng = random.Random(7)
+    points = [
+        (rng.uniform(37.70, 37.82), rng.uniform(-122.52, -122.36)) for _ in range(500)
+    ]
+    coordinates = CoordinateArray(*zip(*points))
+    for _ in range(20):
+        origin = (rng.uniform(37.70, 37.82), rng.uniform(-122.52, -122.36))
+        expected = top_k(distances_from(*origin, coordinates, Accuracy.exact), 5)
+        assert nearest_indices(*origin, coordinates, 5) == expected
+        assert len(nearest_indices(*origin, coordinates, 5, Accuracy.fast)) == 5
+
+
+def test_within_radius_matches_exact_distances():
+    rng = random.Random(11)
+    points = [
+        (rng.uniform(37.70, 37.82), rng.uniform(-122.52, -122.36)) for _ in range(500)
+    ]
+    coordinates = CoordinateArray(*zip(*points))
+    exact = distances_from(*USER, coordinates, Accuracy.exact)
+
+    found = within_radius(*USER, coordinates, 2.5)
+    assert [i for _, i in found] == [i for i, d in enumerate(exact) if d <= 2.5]
+    assert all(d == pytest.approx(exact[i]) for d, i in found)
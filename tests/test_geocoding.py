@@ -0,0 +1,114 @@
+import pytest
+from geopy.exc import GeocoderServiceError
+
+from src.database import Database
+from src.geocoding import (
+    GeocodeCache,
+    GeocodingService,
+    GeocodingUnavailable,
+    OfflineGeocoder,
+    normalize_address,
+)
+
+
+class FakeOnlineGeocoder:
+    def __init__(self, answers):
+        self.answers = answers
+        self.calls = []
+
+    def geocode(self, address):
+        self.calls.append(address)
+        answer = self.answers[address]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / "geo.db"))
+    db.create_database("./data/Mobile_Food_Facility_Permit.csv")
+    yield db
+    db.close()
+
+
+def test_normalize_address():
+    assert normalize_address("90 Broadway, San Francisco, CA 94133") == "90 BROADWAY"
+    assert normalize_address("  201 bay shore boulevard ") == "201 BAY SHORE BLVD"
+    assert normalize_address("1 Main St., Oakland, CA") == "1 MAIN ST, OAKLAND"
+
+
+def test_known_addresses_never_leave_the_process(db):
+    online = FakeOnlineGeocoder({})
+    service = GeocodingService(
+        GeocodeCache(db.pool), OfflineGeocoder(db.get_snapshot), online
+    )
+    assert service.geocode("90 Broadway, San Francisco, CA") == (
+        37.799260113502285,
+        -122.39961794865545,
+    )
+    assert online.calls == []
+
+
+def test_online_answers_are_cached_and_persisted(db):
+    online = FakeOnlineGeocoder(
+        {"1 Main St, Oakland": (37.8, -122.27), "Nowhere Land": None}
+    )
+    service = GeocodingService(GeocodeCache(db.pool), online=online)
+
+    for _ in range(2):
+        assert service.geocode("1 Main St, Oakland") == (37.8, -122.27)
+        assert service.geocode("Nowhere Land") is None
+    assert online.calls == ["1 Main St, Oakland", "Nowhere Land"]
+
+    # A fresh cache (e.g. after a restart) reads the entries back from SQLite
+    restarted = GeocodingService(GeocodeCache(db.pool), online=online)
+    assert restarted.geocode("1 main street, oakland") == (37.8, -122.27)
+    assert restarted.geocode("nowhere land") is None
+    assert len(online.calls) == 2
+
+
+def test_service_errors_are_not_cached(db):
+    online = FakeOnlineGeocoder({"Somewhere": GeocoderServiceError("down")})
+    service = GeocodingService(GeocodeCache(db.pool), online=online)
+    for _ in range(2):
+        with pytest.raises(GeocodingUnavailable):
+            service.geocode("Somewhere")
+    assert len(online.calls) == 2
+
+
+def test_offline_addresses_follow_writes(db):
+    offline = OfflineGeocoder(db.get_snapshot)
+    address = "90 Broadway, San Francisco, CA"
+    assert offline.geocode(address) is not None
+
+    trucks = [
+        truck
+        for truck in db.get_all_food_trucks()
+        if normalize_address(truck.address) == "90 BROADWAY"
+    ]
+    for truck in trucks:
+        moved = truck.model_copy(update={"latitude": 37.8, "longitude": -122.4})
+        db.update_food_truck(truck.location_id, moved)
+    assert offline.geocode(address) == (37.8, -122.4)
+
+    for truck in trucks:
+        db.delete_food_truck(truck.location_id)
+    assert offline.geocode(address) is None
+
+
+def test_persisted_cache_is_bounded(db):
+    cache = GeocodeCache(db.pool, max_rows=3, negative_ttl=-1)
+    for i in range(5):
+        cache.put(f"{i} MAIN ST", (37.0 + i, -122.0))
+    cache.put("NOWHERE", None)
+    with db.pool.reader() as conn:
+        rows = conn.execute(
+            "SELECT address FROM geocode_cache ORDER BY expires_at"
+        ).fetchall()
+    # The negative entry is already expired, so it goes first
+    assert [address for (address,) in rows] == ["2 MAIN ST", "3 MAIN ST", "4 MAIN ST"]
+
+    unbounded = GeocodeCache(db.pool, negative_ttl=-1)
+    unbounded.put("NOWHERE", None)
+    assert unbounded.purge_expired() == 1
@@ -0,0 +1,79 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from src.database import Database, TruckFilter
+from src.hours import hours_rows, minute_of_week, parse_dayshours, weekly_hours
+from tests.helpers import make_truck
+
+DAY = 24 * 60
+
+
+def test_parse_dayshours():
+    assert parse_dayshours("Mo-We:7AM-7PM") == [
+        (day * DAY + 7 * 60, day * DAY + 19 * 60) for day in range(3)
+    ]
+    # Several groups and ranges, merged where they overlap
+    assert parse_dayshours("Mo:10AM-11AM/10:30AM-12PM;Mo/We:11AM-1PM") == [
+        (10 * 60, 13 * 60),
+        (2 * DAY + 11 * 60, 2 * DAY + 13 * 60),
+    ]
+    # Past midnight, and past Sunday midnight into Monday
+    assert parse_dayshours("Su:8PM-2AM") == [(0, 2 * 60), (6 * DAY + 20 * 60, 7 * DAY)]
+    assert parse_dayshours("Sa-Mo:12PM-12AM") == [
+        (12 * 60, DAY),
+        (5 * DAY + 12 * 60, 6 * DAY),
+        (6 * DAY + 12 * 60, 7 * DAY),
+    ]
+
+    with pytest.raises(ValueError):
+        parse_dayshours("Mo-Fr 7AM-7PM")
+    assert weekly_hours("Xx:7AM-7PM") == []
+    assert weekly_hours(None) == []
+
+
+def test_hours_rows_are_split_per_weekday():
+    row = make_truck(7, dayshours="Fr:8PM-2AM").as_row()
+    assert list(hours_rows([row])) == [
+        (7, 4, 4 * DAY + 20 * 60, 5 * DAY),
+        (7, 5, 5 * DAY, 5 * DAY + 2 * 60),
+    ]
+
+
+def test_minute_of_week():
+    assert minute_of_week(datetime(2024, 5, 6, 0, 0)) == 0
+    assert minute_of_week(datetime(2024, 5, 12, 23, 59)) == 7 * DAY - 1
+    # 19:30 UTC on a Monday is 12:30 in San Francisco (daylight saving time)
+    utc = datetime(2024, 5, 6, 19, 30, tzinfo=timezone.utc)
+    assert minute_of_week(utc) == 12 * 60 + 30
+
+
+def test_open_at_follows_writes(tmp_path):
+    db = Database(str(tmp_path / "hours.db"))
+    db.create_table()
+    db.insert_food_truck(make_truck(1, dayshours="Mo-Fr:11AM-2PM"))
+    db.insert_food_truck(make_truck(2, dayshours="Sa-Su:9AM-4PM"))
+    db.insert_food_truck(make_truck(3, dayshours=None))
+
+    def open_at(when):
+        filters = TruckFilter(open_at=minute_of_week(when))
+        return [
+            row["location_id"]
+            for row in db.filter_food_trucks(filters, columns=["location_id"])
+        ]
+
+    monday_noon, sunday_noon = datetime(2024, 5, 6, 12), datetime(2024, 5, 12, 12)
+    assert open_at(monday_noon) == [1]
+    assert open_at(sunday_noon) == [2]
+    assert [
+        row[0]
+        for row in db.filter_coordinates(
+            TruckFilter(open_at=minute_of_week(sunday_noon))
+        )
+    ] == [2]
+
+    db.update_food_truck(3, make_truck(3, dayshours="Mo-Su:10AM-6PM"))
+    db.delete_food_truck(1)
+    assert open_at(monday_noon) == [3]
+    assert open_at(sunday_noon) == [2, 3]
+    db.close()
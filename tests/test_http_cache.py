@@ -0,0 +1,40 @@
+from src.http_cache import (
+    cache_headers,
+    choose_encoding,
+    etag,
+    http_date,
+    is_not_modified,
+)
+
+
+def test_is_not_modified():
+    modified_at = 1700000000.25
+    tag = etag(3, modified_at)
+    assert is_not_modified({"if-none-match": f'W/"1-0", {tag}'}, 3, modified_at)
+    assert not is_not_modified({"if-none-match": tag}, 4, modified_at)
+    assert is_not_modified({"if-none-match": "*"}, 4, modified_at)
+
+    since = {"if-modified-since": http_date(modified_at)}
+    assert is_not_modified(since, 3, modified_at)
+    assert not is_not_modified(since, 4, modified_at + 1)
+    assert not is_not_modified({"if-modified-since": "yesterday"}, 3, modified_at)
+    # If-None-Match takes precedence
+    assert not is_not_modified({**since, "if-none-match": '"other"'}, 3, modified_at)
+
+
+def test_cache_headers():
+    headers = cache_headers(3, 1700000000.0, max_age=60)
+    assert headers["Cache-Control"] == "public, max-age=60"
+    assert headers["Last-Modified"] == "Tue, 14 Nov 2023 22:13:20 GMT"
+
+
+def test_choose_encoding():
+    assert choose_encoding("gzip, deflate") == "gzip"
+    assert choose_encoding("deflate") is None
+    assert choose_encoding("gzip;q=0") is None
+    assert choose_encoding("gzip;q=0.0") is None
+    assert choose_encoding("gzip; q=0") is None
+    assert choose_encoding("gzip; Q=0.000, identity") is None
+    assert choose_encoding("identity") is None
+    assert choose_encoding("gzip;q=0.5") == "gzip"
+    assert choose_encoding("deflate;q=0, GZIP ; q=1") == "gzip"
@@ -0,0 +1,29 @@
+from src.database import Database
+from tests.helpers import truck_row, write_csv
+
+
+def test_bulk_load_reports_rejected_rows(tmp_path):
+    csv_file = tmp_path / "trucks.csv"
+    write_csv(
+        csv_file,
+        [
+            truck_row("1"),
+            truck_row("2", Latitude="north"),
+            truck_row(""),
+            truck_row("1"),
+            truck_row("3", Longitude="-222.0"),
+            truck_row("4"),
+        ],
+    )
+    db = Database(str(tmp_path / "trucks.db"))
+
+    report = db.create_database(csv_file, batch_size=2)
+
+    assert report.inserted == 2
+    assert [(row.line, row.reason) for row in report.rejected] == [
+        (3, "invalid latitude: 'north'"),
+        (4, "missing location_id"),
+        (5, "duplicate location_id"),
+        (6, "longitude out of range: -222.0"),
+    ]
+    assert [truck.location_id for truck in db.get_all_food_trucks()] == [1, 4]
@@ -1,10 +1,13 @@
-import os, random
+import json, os, random
+from datetime import datetime
 
 import pytest
 from fastapi.testclient import TestClient
 
-from src.main import app, Database, db, CSV_FILE, DB_FILE
+from src.main import app, closest_cache, Database, db, CSV_FILE, DB_FILE
 from src.database import FoodTruck
+from src.food_items import food_item_names
+from src.hours import minute_of_week, weekly_hours
 
 
 # Test database file path
@@ -20,9 +23,12 @@ def setup_test_db():
     # Initialize the test database with data from the CSV file
     test_db.create_database(CSV_FILE)
 
-    yield test_db
+    # Runs the app's lifespan, which prepares the database it serves from
+    with client:
+        yield test_db
 
-    # Teardown: Remove the test database file
+    # Teardown: Close the pooled connections and remove the test database file
+    test_db.close()
     os.remove(TEST_DB_FILE)
 
 
@@ -185,3 +191,378 @@ def test_find_closest_food_trucks():
             "longitude": -122.39961794865545,
         },
     ]
+
+
+# The spatial index should agree with the ordering of the original full scan
+def test_get_closest_food_trucks(setup_test_db):
+    results = setup_test_db.get_closest_food_trucks(
+        37.799260113502285, -122.39961794865545
+    )
+    assert [truck.applicant for truck in results] == [
+        "Senor Sisig",
+        "Senor Sisig",
+        "Roadside Rotisserie Corporation / Country Grill",
+    ]
+
+
+# Test keyset pagination of GET /food_trucks/
+def test_get_food_trucks_paginated():
+    everything = client.get("/food_trucks/").json()
+
+    pages = []
+    params = {"limit": 100}
+    while True:
+        response = client.get("/food_trucks/", params=params)
+        assert response.status_code == 200
+        pages.extend(response.json())
+        if "x-next-after" not in response.headers:
+            break
+        params["after"] = response.headers["x-next-after"]
+
+    assert pages == everything
+
+
+# Test streaming GET /food_trucks/ as newline delimited JSON
+def test_get_food_trucks_streamed():
+    response = client.get("/food_trucks/", params={"stream": "ndjson"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert rows == client.get("/food_trucks/").json()
+
+
+# Test GET /food_trucks/search/
+def test_search_food_trucks():
+    response = client.get("/food_trucks/search/", params={"q": "tacos", "limit": 3})
+    assert response.status_code == 200
+    results = response.json()
+    assert len(results) == 3
+    for item in results:
+        assert "taco" in (item["applicant"] + item["food_items"]).lower()
+
+    response = client.get("/food_trucks/search/", params={"q": "zzzz"})
+    assert response.status_code == 200
+    assert response.json() == []
+
+
+# Test GET /food_trucks/filter/
+def test_filter_food_trucks():
+    response = client.get(
+        "/food_trucks/filter/",
+        params={"status": "APPROVED", "facility_type": ["Push Cart", "Truck"]},
+    )
+    assert response.status_code == 200
+    results = response.json()
+    assert len(results) > 0
+    for truck in results:
+        assert truck["status"] == "APPROVED"
+        assert truck["facility_type"] in ("Push Cart", "Truck")
+
+
+# Test filters on GET /food_trucks/closest/ are applied before ranking
+def test_find_closest_food_trucks_filtered():
+    response = client.get(
+        "/food_trucks/closest/",
+        params={"address": "90 BROADWAY, San Francisco, CA", "status": "EXPIRED"},
+    )
+    assert response.status_code == 200
+    closest = response.json()
+    assert len(closest) == 3
+    expired = client.get(
+        "/food_trucks/filter/", params={"status": "EXPIRED", "limit": 10000}
+    ).json()
+    expired_addresses = {truck["address"] for truck in expired}
+    for truck in closest:
+        assert truck["address"] in expired_addresses
+
+
+def test_batch_food_trucks():
+    trucks = [
+        {**sample_food_truck, "location_id": None, "applicant": f"Batch {i}"}
+        for i in range(3)
+    ]
+    response = client.post("/food_trucks/batch/", json=trucks)
+    assert response.status_code == 200
+    assert response.json()["applied"] == 3
+    ids = [item["location_id"] for item in response.json()["results"]]
+    assert client.get(f"/food_trucks/{ids[1]}").json()["applicant"] == "Batch 1"
+
+    renamed = [{**trucks[0], "location_id": ids[0], "applicant": "Renamed"}]
+    response = client.put("/food_trucks/batch/", json=renamed)
+    assert response.json()["results"][0]["status"] == "updated"
+    assert client.get(f"/food_trucks/{ids[0]}").json()["applicant"] == "Renamed"
+
+    # One unknown id rejects the whole batch unless it is best effort
+    response = client.request("DELETE", "/food_trucks/batch/", json=ids + [-1])
+    assert response.status_code == 409
+    assert [item["status"] for item in response.json()["results"]] == [
+        "skipped",
+        "skipped",
+        "skipped",
+        "failed",
+    ]
+    assert client.get(f"/food_trucks/{ids[0]}").status_code == 200
+
+    response = client.request(
+        "DELETE", "/food_trucks/batch/?mode=best_effort", json=ids + [-1]
+    )
+    assert response.status_code == 200
+    assert response.json()["applied"] == 3
+    assert client.get(f"/food_trucks/{ids[0]}").status_code == 404
+
+
+def test_find_closest_food_trucks_batch():
+    single = client.get(
+        "/food_trucks/closest/", params={"address": "90 BROADWAY", "num_closest": 2}
+    ).json()
+    origins = [
+        {"address": "90 BROADWAY"},
+        {"latitude": single[0]["latitude"], "longitude": single[0]["longitude"]},
+        {"address": "Nowhere In Particular"},
+    ]
+    response = client.post(
+        "/food_trucks/closest/batch/", params={"num_closest": 2}, json=origins
+    )
+    assert response.status_code == 200
+    results = response.json()
+    assert results[0]["trucks"] == single
+    assert results[1]["trucks"][0] == single[0]
+    # Not found, or the online geocoder couldn't be reached
+    assert results[2]["error"] and results[2]["trucks"] == []
+
+    filtered = client.post(
+        "/food_trucks/closest/batch/",
+        params={"num_closest": 2, "status": "APPROVED"},
+        json=origins[:2],
+    ).json()
+    assert all(len(result["trucks"]) == 2 for result in filtered)
+
+    for origin in [
+        {"latitude": 37.7},
+        {"address": "90 BROADWAY", "latitude": 37.7},
+        {"address": "90 BROADWAY", "latitude": 37.7, "longitude": -122.4},
+        {},
+    ]:
+        response = client.post("/food_trucks/closest/batch/", json=[origin])
+        assert response.status_code == 422
+
+
+def test_find_closest_food_trucks_by_coordinates():
+    by_address = client.get("/food_trucks/closest/", params={"address": "90 BROADWAY"})
+    origin = by_address.json()[0]
+    by_coordinates = client.get(
+        "/food_trucks/closest/",
+        params={"lat": origin["latitude"], "lon": origin["longitude"]},
+    )
+    assert by_coordinates.status_code == 200
+    assert by_coordinates.json()[0] == origin
+
+    response = client.get("/food_trucks/closest/", params={"lat": 37.79})
+    assert response.status_code == 422
+
+
+def test_find_food_trucks_within_radius():
+    params = {"lat": 37.7749, "lon": -122.4194, "radius_km": 1.5}
+    response = client.get("/food_trucks/radius/", params=params)
+    assert response.status_code == 200
+    trucks = response.json()
+    assert trucks
+    distances = [truck["distance_km"] for truck in trucks]
+    assert distances == sorted(distances)
+    assert distances[-1] <= 1.5
+    assert int(response.headers["X-Total-Count"]) == len(trucks)
+
+    capped = client.get("/food_trucks/radius/", params={**params, "limit": 2})
+    assert capped.json() == trucks[:2]
+    assert capped.headers["X-Total-Count"] == response.headers["X-Total-Count"]
+
+    wider = client.get("/food_trucks/radius/", params={**params, "radius_km": 3})
+    assert len(wider.json()) > len(trucks)
+
+
+def test_radius_count_matches_the_body_when_a_write_races(monkeypatch):
+    params = {"lat": 37.7749, "lon": -122.4194, "radius_km": 1.5}
+    expected = client.get("/food_trucks/radius/", params=params).json()
+    filter_coordinates = db.filter_coordinates
+
+    # A truck is inserted right at the origin after the snapshot was taken
+    def with_new_truck(*args, **kwargs):
+        return filter_coordinates(*args, **kwargs) + [
+            (10**12, params["lat"], params["lon"])
+        ]
+
+    monkeypatch.setattr(db, "filter_coordinates", with_new_truck)
+    response = client.get(
+        "/food_trucks/radius/", params={**params, "limit": len(expected) + 5}
+    )
+    assert response.json() == expected
+    assert int(response.headers["X-Total-Count"]) == len(expected)
+
+
+def test_conditional_get_food_trucks():
+    response = client.get("/food_trucks/")
+    etag = response.headers["ETag"]
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Cache-Control"] == "no-cache"
+
+    cached = client.get("/food_trucks/", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert cached.headers["ETag"] == etag
+
+    since = client.get(
+        "/food_trucks/",
+        headers={"If-Modified-Since": response.headers["Last-Modified"]},
+    )
+    assert since.status_code == 304
+
+    # Any write moves the ETag on
+    truck = {**sample_food_truck, "location_id": None}
+    created = client.post("/food_trucks/batch/", json=[truck]).json()
+    response = client.get("/food_trucks/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+    location_id = created["results"][0]["location_id"]
+    single = client.get(f"/food_trucks/{location_id}")
+    # Too small to be worth compressing
+    assert "Content-Encoding" not in single.headers
+    cached = client.get(
+        f"/food_trucks/{location_id}", headers={"If-None-Match": single.headers["ETag"]}
+    )
+    assert cached.status_code == 304
+    client.request("DELETE", "/food_trucks/batch/", json=[location_id])
+
+
+def test_metrics():
+    client.get("/food_trucks/-1")
+    body = client.get("/metrics").text
+    assert (
+        'estee_http_requests_total{method="GET",route="/food_trucks/{location_id}",status="404"}'
+        in body
+    )
+    assert 'estee_db_call_duration_seconds_count{method="get_snapshot"}' in body
+    assert 'estee_db_pool{stat="size"}' in body
+
+
+def test_open_at_filters_closed_trucks():
+    # A Saturday lunchtime, when only trucks posting weekend hours are open
+    saturday = datetime(2024, 5, 4, 12, 30)
+    minute = minute_of_week(saturday)
+    open_ids = {
+        truck.location_id
+        for truck in db.get_all_food_trucks()
+        if any(start <= minute < end for start, end in weekly_hours(truck.dayshours))
+    }
+    assert open_ids
+
+    params = {"open_at": saturday.isoformat()}
+    response = client.get("/food_trucks/", params=params)
+    assert response.status_code == 200
+    assert len(response.json()) == len(open_ids)
+    page = client.get("/food_trucks/", params={**params, "limit": 1})
+    assert page.json() == response.json()[:1]
+    assert int(page.headers["X-Next-After"]) == min(open_ids)
+
+    response = client.get(
+        "/food_trucks/closest/",
+        params={**params, "lat": 37.7749, "lon": -122.4194, "num_closest": 100},
+    )
+    assert response.status_code == 200
+    assert len(response.json()) == len(open_ids)
+
+
+def test_food_item_facets():
+    trucks = db.get_all_food_trucks()
+    response = client.get("/food_trucks/facets/", params={"limit": 5})
+    assert response.status_code == 200
+    facets = response.json()
+    assert len(facets) == 5
+    top = facets[0]
+    assert top["trucks"] == sum(
+        top["item"] in food_item_names(truck.food_items) for truck in trucks
+    )
+    assert [facet["trucks"] for facet in facets] == sorted(
+        (facet["trucks"] for facet in facets), reverse=True
+    )
+
+    # Trucks serving the top item, by the food_item filter
+    response = client.get(
+        "/food_trucks/filter/", params={"food_item": top["item"], "limit": 1000}
+    )
+    assert response.status_code == 200
+    assert len(response.json()) == top["trucks"]
+
+    # Within a radius only the trucks in range are counted
+    params = {"lat": 37.7749, "lon": -122.4194, "radius_km": 1, "limit": 10000}
+    nearby = client.get("/food_trucks/radius/", params=params).json()
+    response = client.get("/food_trucks/facets/", params=params)
+    assert response.status_code == 200
+    counts = {facet["item"]: facet["trucks"] for facet in response.json()}
+    assert sum(counts.values()) == sum(
+        len(food_item_names(truck["food_items"])) for truck in nearby
+    )
+
+    response = client.get("/food_trucks/facets/", params={"lat": 37.7749})
+    assert response.status_code == 422
+
+
+def test_closest_results_are_cached_per_cell():
+    params = {"lat": 37.7749, "lon": -122.4194, "num_closest": 4}
+    first = client.get("/food_trucks/closest/", params=params)
+    before = closest_cache.stats()
+    # A few meters away is the same geohash cell
+    nearby = {**params, "lat": 37.77491, "lon": -122.41941}
+    second = client.get("/food_trucks/closest/", params=nearby)
+    assert second.json() == first.json()
+    assert second.headers["X-Data-Version"] == first.headers["X-Data-Version"]
+    assert closest_cache.stats().hits == before.hits + 1
+
+    # Other parameters are another entry
+    client.get("/food_trucks/closest/", params={**params, "num_closest": 2})
+    assert closest_cache.stats().misses == before.misses + 1
+
+    # Writes invalidate every entry
+    truck = {**sample_food_truck, "location_id": None}
+    created = client.post("/food_trucks/batch/", json=[truck]).json()
+    client.get("/food_trucks/closest/", params=params)
+    location_id = created["results"][0]["location_id"]
+    client.request("DELETE", "/food_trucks/batch/", json=[location_id])
+    stats = closest_cache.stats()
+    assert stats.misses == before.misses + 2 and stats.invalidations >= 2
+    assert 'estee_closest_cache{stat="hit_ratio"}' in client.get("/metrics").text
+
+
+def test_change_feed():
+    page = db.get_changes()
+    truck = {**sample_food_truck, "location_id": None}
+    created = client.post("/food_trucks/batch/", json=[truck, truck]).json()
+    ids = [result["location_id"] for result in created["results"]]
+    client.request("DELETE", "/food_trucks/batch/", json=ids[:1])
+
+    response = client.get(
+        "/food_trucks/changes/",
+        params={"since": page.cursor(page.last_seq), "limit": 1},
+    )
+    assert response.status_code == 200
+    (change,) = response.json()
+    assert change["location_id"] == ids[1] and not change["deleted"]
+    assert change["truck"]["applicant"] == sample_food_truck["applicant"]
+    assert "Link" in response.headers
+
+    since = response.headers["X-Next-Since"]
+    response = client.get("/food_trucks/changes/", params={"since": since})
+    (change,) = response.json()
+    assert change["location_id"] == ids[0] and change["deleted"]
+    assert change["truck"] is None
+    assert "Link" not in response.headers
+    assert response.headers["X-Next-Since"] == page.cursor(
+        int(response.headers["X-Last-Seq"])
+    )
+
+    # Cursors the log knows nothing about
+    last_seq = int(response.headers["X-Last-Seq"])
+    for since in (page.cursor(last_seq + 1), f"1-{last_seq}", "1"):
+        response = client.get("/food_trucks/changes/", params={"since": since})
+        assert response.status_code == 410
+    client.request("DELETE", "/food_trucks/batch/", json=ids[1:])
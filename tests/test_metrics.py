@@ -0,0 +1,103 @@
+import threading, time
+
+import pytest
+
+from src.metrics import (
+    DB_ERRORS,
+    DB_LATENCY,
+    Counter,
+    Histogram,
+    instrument_methods,
+)
+from src.profiler import SamplingProfiler, current_profiler, profiled
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("test_seconds", "Test", ("route",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, route="/a")
+    histogram.observe(0.5, route="/a")
+    histogram.observe(5.0, route="/a")
+
+    lines = histogram.render()
+    assert lines[:2] == ["# HELP test_seconds Test", "# TYPE test_seconds histogram"]
+    assert 'test_seconds_bucket{route="/a",le="0.1"} 1.0' in lines
+    assert 'test_seconds_bucket{route="/a",le="1.0"} 2.0' in lines
+    assert 'test_seconds_bucket{route="/a",le="+Inf"} 3.0' in lines
+    assert 'test_seconds_count{route="/a"} 3.0' in lines
+    assert 'test_seconds_sum{route="/a"} 5.55' in lines
+
+
+def test_counter_checks_and_escapes_labels():
+    counter = Counter("test_total", "Test", ("path",))
+    counter.inc(path='a "quoted"\npath')
+    assert counter.render()[-1] == 'test_total{path="a \\"quoted\\"\\npath"} 1.0'
+    with pytest.raises(ValueError):
+        counter.inc(route="/")
+
+
+def test_instrument_methods():
+    @instrument_methods
+    class Store:
+        def lookup(self):
+            return 1
+
+        def rows(self):
+            yield from range(3)
+
+        def broken(self):
+            raise RuntimeError
+
+        def _private(self):
+            return 2
+
+    store = Store()
+    before = DB_LATENCY.count(method="lookup")
+    assert store.lookup() == 1
+    assert list(store.rows()) == [0, 1, 2]
+    with pytest.raises(RuntimeError):
+        store.broken()
+    assert DB_LATENCY.count(method="lookup") == before + 1
+    assert DB_LATENCY.count(method="rows") >= 1
+    assert DB_ERRORS.value(method="broken") >= 1
+    assert DB_LATENCY.count(method="_private") == 0
+
+
+def test_sampling_profiler_sees_busy_code():
+    def busy_loop():
+        deadline = time.perf_counter() + 0.1
+        while time.perf_counter() < deadline:
+            pass
+
+    with SamplingProfiler() as profiler:
+        busy_loop()
+    assert profiler.samples > 0
+    assert "busy_loop" in profiler.collapsed()
+
+
+def test_request_profiler_samples_only_its_threads():
+    def busy_loop():
+        deadline = time.perf_counter() + 0.1
+        while time.perf_counter() < deadline:
+            pass
+
+    def other_request():
+        busy_loop()
+
+    def this_request():
+        busy_loop()
+
+    profiler = SamplingProfiler(all_threads=False)
+    token = current_profiler.set(profiler)
+    try:
+        job = threading.Thread(target=profiled(this_request))
+    finally:
+        current_profiler.reset(token)
+    other = threading.Thread(target=other_request)
+    with profiler:
+        other.start()
+        job.start()
+        job.join()
+        other.join()
+    collapsed = profiler.collapsed()
+    assert "this_request" in collapsed
+    assert "other_request" not in collapsed
@@ -0,0 +1,78 @@
+import threading, time
+
+import pytest
+
+from src.pool import ConnectionPool
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "pool.db"), size=2, acquire_timeout=0.5)
+    with pool.writer() as conn:
+        conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)")
+        conn.execute("INSERT INTO items (name) VALUES ('first')")
+    yield pool
+    pool.close()
+
+
+# With WAL a reader sees the last committed state while a write is in flight
+def test_readers_do_not_block_on_writer(pool):
+    with pool.writer() as conn:
+        conn.execute("INSERT INTO items (name) VALUES ('second')")
+        with pool.reader() as reader:
+            assert reader.execute("SELECT COUNT(*) FROM items").fetchone() == (1,)
+    with pool.reader() as reader:
+        assert reader.execute("SELECT COUNT(*) FROM items").fetchone() == (2,)
+
+
+def test_writer_rolls_back_on_error(pool):
+    with pytest.raises(RuntimeError):
+        with pool.writer() as conn:
+            conn.execute("INSERT INTO items (name) VALUES ('lost')")
+            raise RuntimeError("boom")
+    with pool.reader() as reader:
+        assert reader.execute("SELECT COUNT(*) FROM items").fetchone() == (1,)
+
+
+def test_readers_are_query_only(pool):
+    with pool.reader() as reader:
+        with pytest.raises(Exception):
+            reader.execute("INSERT INTO items (name) VALUES ('nope')")
+
+
+def test_pool_is_bounded_and_records_waits(pool):
+    with pool.reader(), pool.reader():
+        with pytest.raises(TimeoutError):
+            with pool.reader():
+                pass
+
+    # Another thread holds both connections for a moment, so we have to wait for one
+    busy = threading.Event()
+
+    def hold_connections():
+        with pool.reader(), pool.reader():
+            busy.set()
+            time.sleep(0.1)
+
+    thread = threading.Thread(target=hold_connections)
+    thread.start()
+    busy.wait()
+    with pool.reader():
+        pass
+    thread.join()
+
+    stats = pool.stats()
+    assert stats.open_readers == 2
+    assert stats.waits == 1
+    assert stats.max_wait_seconds > 0
+
+
+# A reader checked out across close() is dropped when it comes back, so the pool only
+# ever hands out live connections afterwards
+def test_readers_from_before_close_are_not_reused(pool):
+    with pool.reader() as conn:
+        pool.close()
+    assert pool.stats().idle_readers == 0
+    with pool.reader() as conn:
+        assert conn.execute("SELECT name FROM items").fetchone() == ("first",)
+    assert pool.stats().open_readers == 1
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from src.result_cache import ResultCache, SingleFlight, geohash
+
+
+def test_geohash():
+    assert geohash(37.7749, -122.4194, 5) == "9q8yy"
+    assert geohash(42.605, -5.603, 5) == "ezs42"
+    assert geohash(57.64911, 10.40744, 11) == "u4pruydqqvj"
+    # Points a few meters apart share a cell
+    assert geohash(37.77490, -122.41940, 8) == geohash(37.77491, -122.41941, 8)
+
+
+def test_result_cache_evicts_and_invalidates():
+    cache = ResultCache(maxsize=2)
+    cache.put("a", 1, "A")
+    cache.put("b", 1, "B")
+    assert cache.get("a", 1) == (True, "A")
+    # "b" is the least recently used
+    cache.put("c", 1, "C")
+    assert cache.get("b", 1) == (False, None)
+    assert cache.get("c", 1) == (True, "C")
+
+    # A write bumped the version: nothing computed before it is served
+    assert cache.get("a", 2) == (False, None)
+    stats = cache.stats()
+    assert (stats.size, stats.hits, stats.misses) == (0, 2, 2)
+    assert (stats.evictions, stats.invalidations) == (1, 2)
+    assert stats.hit_ratio == 0.5
+
+
+def test_concurrent_misses_share_one_computation():
+    cache = ResultCache()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def main():
+        results = await asyncio.gather(
+            *(cache.get_or_compute("key", 1, compute) for _ in range(5))
+        )
+        return results + [await cache.get_or_compute("key", 1, compute)]
+
+    assert asyncio.run(main()) == [1] * 6
+    stats = cache.stats()
+    assert (stats.misses, stats.coalesced, stats.hits) == (5, 4, 1)
+
+
+def test_single_flight_shares_failures_and_forgets_them():
+    flights = SingleFlight()
+    calls = []
+
+    async def fail():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def main():
+        results = await asyncio.gather(
+            *(flights.run("key", fail) for _ in range(3)), return_exceptions=True
+        )
+        assert all(isinstance(result, ValueError) for result in results)
+        with pytest.raises(ValueError):
+            await flights.run("key", fail)
+
+    asyncio.run(main())
+    assert len(calls) == 2
+    assert flights.coalesced == 2
+
+
+def test_results_of_an_older_version_are_dropped():
+    cache = ResultCache()
+    cache.put("a", 2, "A2")
+    # A computation started before version 2 finishes late
+    cache.put("b", 1, "B1")
+    assert cache.get("a", 2) == (True, "A2")
+    assert cache.get("b", 1) == (False, None)
+    assert cache.get("b", 2) == (False, None)
+    stats = cache.stats()
+    assert (stats.size, stats.invalidations) == (1, 0)
+
+    cache.put("a", 3, "A3")
+    assert cache.stats().invalidations == 1
+    assert cache.get("a", 3) == (True, "A3")
@@ -0,0 +1,42 @@
+import pytest
+
+from src.database import Database, fts_query
+from tests.helpers import make_truck
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / "search.db"))
+    db.create_database("./data/Mobile_Food_Facility_Permit.csv")
+    yield db
+    db.close()
+
+
+def test_fts_query_escapes_user_input():
+    assert fts_query('tacos "OR" (burritos') == '"tacos" "OR" "burritos"'
+    assert fts_query("chicken ric", prefix=True) == '"chicken" "ric"*'
+    assert fts_query("!!!") == ""
+
+
+def test_search_ranks_and_limits(db):
+    results = db.search_food_trucks("tacos", limit=5)
+    assert len(results) == 5
+    assert all("taco" in (r.applicant + r.food_items).lower() for r in results)
+    assert [r.score for r in results] == sorted(r.score for r in results)
+
+    assert {r.applicant for r in db.search_food_trucks("seno", prefix=True)} == {
+        "Senor Sisig"
+    }
+    assert db.search_food_trucks("seno") == []
+
+
+def test_triggers_keep_the_index_in_sync(db):
+    db.insert_food_truck(make_truck(1, food_items="Quokkaburgers: Horchata"))
+    assert [r.location_id for r in db.search_food_trucks("quokkaburgers")] == [1]
+
+    db.update_food_truck(1, make_truck(1, food_items="Wombatwraps"))
+    assert db.search_food_trucks("quokkaburgers") == []
+    assert [r.location_id for r in db.search_food_trucks("wombatwraps")] == [1]
+
+    db.delete_food_truck(1)
+    assert db.search_food_trucks("wombatwraps") == []
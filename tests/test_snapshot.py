@@ -0,0 +1,140 @@
+import json
+
+import pytest
+
+from src import snapshot as snapshot_module
+from src.database import Database, FoodTruck
+from src.geocoding import normalize_address
+from tests.helpers import make_truck
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / "snapshot.db"))
+    db.create_database("./data/Mobile_Food_Facility_Permit.csv")
+    yield db
+    db.close()
+
+
+def test_snapshot_matches_the_table(db):
+    snapshot = db.get_snapshot()
+    trucks = db.get_all_food_trucks()
+
+    assert len(snapshot) == len(trucks)
+    assert json.loads(snapshot.list_payload()) == [
+        {"applicant": t.applicant, "food_items": t.food_items, "address": t.address}
+        for t in trucks
+    ]
+    truck = trucks[10]
+    assert FoodTruck.model_validate_json(snapshot.payload(truck.location_id)) == truck
+
+
+def test_writes_patch_the_snapshot(db):
+    before = db.get_snapshot()
+
+    db.insert_food_truck(make_truck(1))
+    inserted = db.get_snapshot()
+    assert inserted.version > before.version
+    assert inserted.location_ids[0] == 1
+    # Older snapshots are never modified
+    assert before.payload(1) is None
+
+    db.update_food_truck(1, make_truck(2, applicant="Renamed"))
+    updated = db.get_snapshot()
+    assert updated.version > inserted.version
+    assert updated.payload(1) is None
+    assert json.loads(updated.payload(2))["applicant"] == "Renamed"
+
+    db.delete_food_truck(2)
+    deleted = db.get_snapshot()
+    assert deleted.payload(2) is None
+    assert len(deleted) == len(before)
+    assert deleted.list_payload() == before.list_payload()
+
+
+def test_projections_return_plain_rows(db):
+    columns = ["location_id", "applicant", "address"]
+    rows = db.get_all_food_trucks(columns)
+    trucks = db.get_all_food_trucks()
+    assert rows[0] == {column: getattr(trucks[0], column) for column in columns}
+
+    ids = [trucks[3].location_id, trucks[1].location_id]
+    assert [
+        row["location_id"] for row in db.get_food_trucks_by_ids(ids, columns)
+    ] == ids
+    assert db.get_food_truck_by_id(ids[0], ["applicant"]) == {
+        "applicant": trucks[3].applicant
+    }
+    assert db.get_food_truck_by_name("Sisig", ["applicant"])[0]["applicant"].startswith(
+        "Senor Sisig"
+    )
+
+    with pytest.raises(ValueError):
+        db.get_all_food_trucks(["applicant", "secret"])
+
+
+def test_write_after_another_process_wrote_rebuilds_the_views(db):
+    # Another process, e.g. python -m src.sync, deletes a truck. This one writes before
+    # it next checks the data version, which it only does once a second.
+    before = db.get_snapshot()
+    other = Database(db.db_name)
+    deleted_id = before.location_ids[0]
+    other.delete_food_truck(deleted_id)
+    other.close()
+
+    db.insert_food_truck(make_truck(1))
+    snapshot = db.get_snapshot()
+    assert snapshot.version == db.data_version()
+    assert len(snapshot) == len(before)
+    assert snapshot.payload(deleted_id) is None
+    assert snapshot.payload(1) is not None
+    assert len(db.spatial_index) == len(snapshot)
+
+
+def test_views_load_without_waiting_for_the_writer(tmp_path):
+    db = Database(str(tmp_path / "cold.db"), acquire_timeout=0.5)
+    db.create_database("./data/Mobile_Food_Facility_Permit.csv")
+    version = db.data_version()
+    # A write is in flight while the first request loads the views
+    with db.pool.writer() as conn:
+        conn.execute("DELETE FROM food_trucks")
+        snapshot = db.get_snapshot()
+        conn.rollback()
+    assert snapshot.version == version
+    assert len(snapshot) == len(db.get_all_food_trucks())
+    db.close()
+
+
+def test_views_built_before_a_local_write_are_not_published(db):
+    db.get_snapshot()
+    with db.pool.reader() as conn:
+        # Pins the read transaction before the write
+        conn.execute("BEGIN")
+        conn.execute("SELECT COUNT(*) FROM food_trucks").fetchone()
+        db.insert_food_truck(make_truck(1))
+        assert not db._build_views(conn)
+    snapshot = db.get_snapshot()
+    assert snapshot.version == db.data_version()
+    assert snapshot.payload(1) is not None
+
+
+def test_writes_patch_the_address_index(db, monkeypatch):
+    db.get_snapshot().address_index()
+    truck = db.get_all_food_trucks()[0]
+    normalized = []
+    monkeypatch.setattr(
+        snapshot_module,
+        "normalize_address",
+        lambda address: normalized.append(address) or normalize_address(address),
+    )
+
+    db.insert_food_truck(make_truck(1, address="1 Test Pl"))
+    db.update_food_truck(truck.location_id, truck.model_copy(update={"latitude": 0}))
+    snapshot = db.get_snapshot()
+    # Only the rows written are looked at, not every address in the table
+    assert len(normalized) <= 3
+    assert snapshot.address_coordinates("1 TEST PL") == (37.77, -122.41)
+
+    other = Database(db.db_name)
+    assert snapshot.address_index() == other.get_snapshot().address_index()
+    other.close()
@@ -0,0 +1,45 @@
+import random
+
+from geopy.distance import geodesic
+
+from src.spatial import SpatialIndex
+
+
+def random_points(count, seed=42):
+    rng = random.Random(seed)
+    return {
+        location_id: (rng.uniform(37.70, 37.81), rng.uniform(-122.52, -122.36))
+        for location_id in range(1, count + 1)
+    }
+
+
+# The index has to agree with a full geodesic scan
+def test_nearest_matches_brute_force():
+    points = random_points(2000)
+    index = SpatialIndex()
+    for location_id, (lat, lon) in points.items():
+        index.insert(location_id, lat, lon)
+
+    for user in [(37.7749, -122.4194), (37.8, -122.4), (40.0, -100.0)]:
+        expected = sorted(
+            (geodesic(user, point).km, location_id)
+            for location_id, point in points.items()
+        )[:5]
+        result = index.nearest(*user, k=5)
+        assert [idx for _, idx in result] == [idx for _, idx in expected]
+
+
+def test_insert_update_and_remove():
+    index = SpatialIndex()
+    index.insert(1, 37.7749, -122.4194)
+    index.insert(2, 37.8, -122.4)
+    assert [idx for _, idx in index.nearest(37.7749, -122.4194, k=1)] == [1]
+
+    # Moving truck 2 right next to the user makes it the closest one
+    index.insert(2, 37.77491, -122.4194)
+    index.remove(1)
+    assert len(index) == 1
+    assert [idx for _, idx in index.nearest(37.7749, -122.4194, k=3)] == [2]
+
+    index.remove(2)
+    assert index.nearest(37.7749, -122.4194) == []
@@ -0,0 +1,47 @@
+import os, subprocess, sys
+from concurrent.futures import ThreadPoolExecutor
+
+from src.database import Database
+from src.startup import prepare
+from tests.helpers import truck_row, write_csv
+
+
+def test_prepare_builds_the_database_once(tmp_path):
+    csv_file = tmp_path / "trucks.csv"
+    write_csv(csv_file, [truck_row(1), truck_row(2), truck_row(3)])
+    db_file = str(tmp_path / "trucks.db")
+
+    # Workers starting together: one builds the database, the others wait and use it
+    def worker(_):
+        db = Database(db_file)
+        try:
+            return prepare(db, csv_file)
+        finally:
+            db.close()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        reports = list(executor.map(worker, range(4)))
+    assert sum(report.built for report in reports) == 1
+    assert {report.rows for report in reports} == {3}
+    assert {report.version for report in reports} == {1}
+    assert not os.path.exists(f"{db_file}.building")
+
+    # An existing database is only migrated, unless a rebuild is asked for
+    write_csv(csv_file, [truck_row(1), truck_row(2)])
+    db = Database(db_file)
+    assert not prepare(db, csv_file).built
+    report = prepare(db, csv_file, rebuild=True)
+    assert report.built and report.rows == 2
+    assert set(report.seconds) == {"lock", "database", "views"}
+    db.close()
+
+
+def test_importing_main_has_no_side_effects(tmp_path):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run(
+        [sys.executable, "-c", "import src.main"],
+        cwd=tmp_path,
+        env={**os.environ, "PYTHONPATH": root},
+        check=True,
+    )
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+from src.database import Database
+from src.sync import sync_csv
+from tests.helpers import make_truck, truck_row, write_csv
+
+
+@pytest.fixture
+def db(tmp_path):
+    csv_file = tmp_path / "trucks.csv"
+    write_csv(csv_file, [truck_row(1), truck_row(2), truck_row(3)])
+    db = Database(str(tmp_path / "sync.db"), version_check_interval=0)
+    db.create_database(csv_file)
+    yield db
+    db.close()
+
+
+def test_sync_applies_only_the_diff(db, tmp_path):
+    # Created through the API, never part of the CSV
+    db.insert_food_truck(make_truck(100))
+    version = db.get_snapshot().version
+
+    csv_file = tmp_path / "trucks.csv"
+    write_csv(csv_file, [truck_row(1), truck_row(2), truck_row(3)])
+    report = sync_csv(db, csv_file)
+    assert (report.inserted, report.updated, report.deleted) == (0, 0, 0)
+    assert report.unchanged == 3
+    assert report.version == version
+
+    write_csv(csv_file, [truck_row(1), truck_row(3, Applicant="Renamed"), truck_row(4)])
+    report = sync_csv(db, csv_file)
+    assert (report.inserted, report.updated, report.deleted) == (1, 1, 1)
+    assert report.version > version
+
+    snapshot = db.get_snapshot()
+    assert list(snapshot.location_ids) == [1, 3, 4, 100]
+    assert json.loads(snapshot.payload(3))["applicant"] == "Renamed"
+    assert db.search_food_trucks("Renamed")[0].location_id == 3
+    assert db.get_food_truck_by_id(2) is None
+
+
+def test_sync_restores_rows_changed_through_the_api(db, tmp_path):
+    db.update_food_truck(1, make_truck(1, applicant="Edited"))
+    db.delete_food_truck(2)
+
+    csv_file = tmp_path / "trucks.csv"
+    report = sync_csv(db, csv_file)
+    assert (report.inserted, report.updated, report.unchanged) == (1, 1, 1)
+    assert db.get_food_truck_by_id(1).applicant == "Truck 1"
+    assert db.get_food_truck_by_id(2) is not None
+
+
+def test_running_instance_picks_up_the_sync(db, tmp_path):
+    # Another process with the same database file, e.g. the API server
+    server = Database(db.db_name, version_check_interval=0)
+    before = server.get_snapshot()
+
+    csv_file = tmp_path / "trucks.csv"
+    write_csv(csv_file, [truck_row(1), truck_row(2, Applicant="Renamed")])
+    sync_csv(db, csv_file)
+
+    after = server.get_snapshot()
+    assert after.version > before.version
+    assert list(after.location_ids) == [1, 2]
+    assert json.loads(after.payload(2))["applicant"] == "Renamed"
+    assert server.spatial_index.nearest(37.7749, -122.4194, k=5)[0][1] in (1, 2)
+    server.close()